@@ -0,0 +1,140 @@
+''' Cache of pre-compiled shared libraries for the C++ code used by the selection
+    scripts (bstar.cc and modules/*.cc).
+
+    Instead of JIT compiling the source every time a script starts, the source is
+    compiled once with ACLiC into `libcache/` and the library is loaded directly
+    on later runs. Libraries are keyed by a hash of the source file, every local
+    file it `#include`s, and the ROOT version/architecture, so a stale library
+    is never picked up after the code changes.
+
+    The cache directory can be filled ahead of time and shipped in the Condor
+    tarball so that jobs start without compiling anything:
+    ```
+    python CppCache.py bstar.cc modules/GenMatching.cc modules/top_sf.cc modules/Collection.cc
+    ```
+'''
+import os, re, hashlib
+import ROOT
+from TIMBER.Tools.Common import CompileCpp
+
+cachedir = 'libcache/'
+include_regex = re.compile(r'^\s*#include\s+"([^"]+)"', re.M)
+
+def LocalSources(filename,found=None):
+    '''Finds the source file and all of the local (quoted) includes it pulls in, recursively.
+
+    Args:
+        filename (str): Path to the C++ source.
+        found (list, optional): Files already found. Used for the recursion. Defaults to None.
+
+    Returns:
+        list(str): Paths of the source and its local includes.
+    '''
+    if found == None: found = []
+    filename = os.path.normpath(filename)
+    if (filename in found) or (not os.path.exists(filename)):
+        return found
+    found.append(filename)
+    with open(filename) as f:
+        text = f.read()
+    for include in include_regex.findall(text):
+        LocalSources(os.path.join(os.path.dirname(filename),include),found)
+    return found
+
+def SourceHash(filename):
+    '''Hash of the source, its local includes, and the ROOT build it will be compiled against.
+
+    Args:
+        filename (str): Path to the C++ source.
+
+    Returns:
+        str: Hexadecimal hash (16 characters).
+    '''
+    h = hashlib.sha1()
+    h.update(('%s %s %s'%(ROOT.gROOT.GetVersion(), ROOT.gSystem.GetBuildArch(), os.environ.get('SCRAM_ARCH',''))).encode())
+    for src in LocalSources(filename):
+        with open(src,'rb') as f:
+            h.update(f.read())
+    return h.hexdigest()[:16]
+
+def LibraryPath(filename,libdir=cachedir):
+    '''Path of the cached library for the current version of the source.
+
+    Args:
+        filename (str): Path to the C++ source.
+        libdir (str, optional): Cache directory. Defaults to `libcache/`.
+
+    Returns:
+        str: Path to the `.so` (which may not exist yet).
+    '''
+    libname = os.path.basename(filename).replace('.','_')
+    return os.path.join(libdir,'%s_%s.so'%(libname,SourceHash(filename)))
+
+def CompileCppCached(filename,libdir=cachedir,build=True):
+    '''Drop-in replacement for TIMBER's CompileCpp() for source files.
+       Loads the cached library if the source is unchanged, otherwise compiles
+       it with ACLiC into the cache. If that fails, falls back to JIT compiling
+       the source with CompileCpp().
+
+    Args:
+        filename (str): Path to the C++ source.
+        libdir (str, optional): Cache directory. Defaults to `libcache/`.
+        build (bool, optional): Compile into the cache if the library is missing. Defaults to True.
+
+    Returns:
+        str: Path to the loaded library or None if the fallback was used.
+    '''
+    lib = LibraryPath(filename,libdir)
+    if os.path.exists(lib):
+        if ROOT.gSystem.Load(lib) >= 0:
+            return lib
+        print ('WARNING: Could not load cached library %s, rebuilding'%lib)
+
+    if build:
+        if not os.path.exists(libdir):
+            os.makedirs(libdir)
+        # CompileMacro() also loads the library if the compilation succeeds
+        if ROOT.gSystem.CompileMacro(filename,'kO',os.path.abspath(lib)[:-3],os.path.abspath(libdir)):
+            return lib
+        print ('WARNING: Could not compile %s into %s'%(filename,libdir))
+
+    print ('Falling back to JIT compilation of %s'%filename)
+    CompileCpp(filename)
+    return None
+
+def CleanCache(sources,libdir=cachedir):
+    '''Removes cached files for the given sources that do not match their current version.
+
+    Args:
+        sources (list(str)): Paths to the C++ sources.
+        libdir (str, optional): Cache directory. Defaults to `libcache/`.
+
+    Returns:
+        list(str): Removed files.
+    '''
+    removed = []
+    if not os.path.exists(libdir): return removed
+    for src in sources:
+        current = os.path.basename(LibraryPath(src,libdir))[:-3]
+        prefix = os.path.basename(src).replace('.','_')+'_'
+        for f in os.listdir(libdir):
+            if f.startswith(prefix) and not f.startswith(current):
+                os.remove(os.path.join(libdir,f))
+                removed.append(f)
+    return removed
+
+if __name__ == "__main__":
+    from argparse import ArgumentParser
+    parser = ArgumentParser(description='Pre-compile C++ sources into the library cache')
+    parser.add_argument('sources', nargs='+', help='C++ sources to compile. E.g. bstar.cc modules/top_sf.cc')
+    parser.add_argument('-d', '--dir', type=str, dest='libdir', action='store', default=cachedir,
+                        help='Cache directory. Defaults to %s'%cachedir)
+    parser.add_argument('--clean', action='store_true',
+                        help='Remove stale libraries from the cache after building')
+    args = parser.parse_args()
+
+    for src in args.sources:
+        print ('%s -> %s'%(src,CompileCppCached(src,args.libdir)))
+    if args.clean:
+        for f in CleanCache(args.sources,args.libdir):
+            print ('Removed %s'%f)
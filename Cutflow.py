@@ -0,0 +1,177 @@
+''' Cutflow tables of the selections.
+
+    The number of events (unweighted and weighted by `norm`) passing every Cut
+    from the input to a given node is booked lazily so that it is counted in
+    the same event loop as the histograms:
+    ```
+    cutflow = Cutflow.Cutflow(a.GetActiveNode(), setname, year, norm)
+    for action in cutflow.actions: hists.AddAction(action)   # or book it before anything triggers the event loop
+    hists.Run()
+    cutflow.Write()                    # TH1s in the open output file
+    cutflow.Save('rootfiles/ttbar_16_cutflow')   # .json and .txt
+    ```
+    The JSON tables of several samples and years can be merged with
+    ```
+    python Cutflow.py rootfiles/*_selection_cutflow.json -o rootfiles/cutflow_selection
+    ```
+'''
+import json
+from collections import OrderedDict
+import ROOT
+from NodeProfiler import NodeChain, NodeType, ColumnNames
+
+class Cutflow(object):
+    '''Books the unweighted and weighted number of events after every Cut leading to a node.
+
+    Args:
+        node (Node): Last node of the selection.
+        setname (str): Name of the set.
+        year (str): 16, 17, 18.
+        norm (float, optional): Normalization used where the `norm` column is not defined yet. Defaults to 1.
+        weight (str, optional): Weight column. Defaults to 'norm'.
+    '''
+    def __init__(self,node,setname,year,norm=1.,weight='norm'):
+        self.setname = setname
+        self.year = year
+        self.norm = float(norm)
+        self.booked = []
+        self.actions = []
+        for n in NodeChain([node]):
+            nodetype = NodeType(n)
+            if nodetype == 'Define': continue
+            name = 'all' if nodetype == 'Input' else n.name
+            count = n.DataFrame.Count()
+            # The weight is a constant per set, so where the column does not exist yet the count is scaled instead
+            weighted = n.DataFrame.Sum(weight) if weight in ColumnNames(n) else None
+            self.booked.append((name,count,weighted))
+            self.actions.extend([count] if weighted == None else [count,weighted])
+        self.table = None
+
+    def Results(self):
+        '''Cutflow table (runs the event loop if it has not run yet).
+
+        Returns:
+            OrderedDict: {cut name: (events, weighted events)}
+        '''
+        if self.table == None:
+            self.table = OrderedDict()
+            for name,count,weighted in self.booked:
+                events = count.GetValue()
+                self.table[name] = (events, weighted.GetValue() if weighted != None else events*self.norm)
+        return self.table
+
+    def Write(self,name='cutflow'):
+        '''Writes the cutflow as two TH1Ds (`<name>` and `<name>_weighted`)
+           with one labelled bin per cut to the current directory.
+
+        Args:
+            name (str, optional): Name of the histograms. Defaults to 'cutflow'.
+        '''
+        table = self.Results()
+        unweighted = ROOT.TH1D(name,'%s %s;;Events'%(self.setname,self.year),len(table),0,len(table))
+        weighted = ROOT.TH1D(name+'_weighted','%s %s;;Weighted events'%(self.setname,self.year),len(table),0,len(table))
+        for i,(cut,(events,wevents)) in enumerate(table.items()):
+            for h,value in [(unweighted,events),(weighted,wevents)]:
+                h.GetXaxis().SetBinLabel(i+1,cut)
+                h.SetBinContent(i+1,value)
+        unweighted.Write()
+        weighted.Write()
+
+    def Save(self,basename):
+        '''Writes the cutflow to `<basename>.json` and as a text table to `<basename>.txt`.
+
+        Args:
+            basename (str): Output name without extension.
+        '''
+        table = self.Results()
+        out = {'setname':self.setname, 'year':self.year,
+               'cuts':[{'name':cut,'events':events,'weighted':wevents} for cut,(events,wevents) in table.items()]}
+        with open(basename+'.json','w') as f:
+            json.dump(out,f,indent=2)
+        with open(basename+'.txt','w') as f:
+            f.write(FormatTable(['%s %s'%(self.setname,self.year)],[c['name'] for c in out['cuts']],
+                                {'%s %s'%(self.setname,self.year):dict([(c['name'],(c['events'],c['weighted'])) for c in out['cuts']])}))
+        print ('Cutflow written to %s.json/.txt'%basename)
+
+def FormatTable(columns,cuts,values):
+    '''Formats cutflows as a text table with the events, weighted events,
+       and efficiency relative to the previous cut for each column.
+
+    Args:
+        columns (list(str)): Column names (ex. samples).
+        cuts (list(str)): Cut names (rows).
+        values (dict): {column: {cut: (events, weighted events)}}
+
+    Returns:
+        str: Table.
+    '''
+    lines = []
+    for column in columns:
+        lines.append('%s'%column)
+        lines.append('  %-20s %14s %16s %10s %10s'%('cut','events','weighted','eff.','cum. eff.'))
+        first, previous = None, None
+        for cut in cuts:
+            if cut not in values[column]:
+                lines.append('  %-20s %14s'%(cut,'-'))
+                continue
+            events, weighted = values[column][cut]
+            if first == None: first = events
+            eff = '%.4f'%(float(events)/previous) if previous else '-'
+            cumeff = '%.4f'%(float(events)/first) if first else '-'
+            lines.append('  %-20s %14d %16.2f %10s %10s'%(cut,events,weighted,eff,cumeff))
+            previous = events
+        lines.append('')
+    return '\n'.join(lines)
+
+def MergeCutflows(filenames):
+    '''Merges cutflow JSON files of several samples and years.
+
+    Args:
+        filenames (list(str)): Files written by Cutflow.Save().
+
+    Returns:
+        dict: 'cuts' (all cut names in order), 'columns' (one per sample and year,
+            one total per year and one overall total) and 'values' ({column: {cut: (events, weighted)}}).
+    '''
+    cuts, columns, values = [], [], OrderedDict()
+    totals = OrderedDict()
+    for filename in filenames:
+        with open(filename) as f:
+            cutflow = json.load(f)
+        column = '%s %s'%(cutflow['setname'],cutflow['year'])
+        columns.append(column)
+        values[column] = OrderedDict()
+        for total in ['total %s'%cutflow['year'],'total']:
+            if total not in totals: totals[total] = OrderedDict()
+        for c in cutflow['cuts']:
+            if c['name'] not in cuts: cuts.append(c['name'])
+            values[column][c['name']] = (c['events'],c['weighted'])
+            for total in ['total %s'%cutflow['year'],'total']:
+                events, weighted = totals[total].get(c['name'],(0,0.))
+                totals[total][c['name']] = (events+c['events'],weighted+c['weighted'])
+    # Totals per year first, then the overall total
+    for total in sorted([t for t in totals if t != 'total'])+['total']:
+        if total in totals:
+            columns.append(total)
+            values[total] = totals[total]
+    return {'cuts':cuts, 'columns':columns, 'values':values}
+
+if __name__ == "__main__":
+    from argparse import ArgumentParser
+    parser = ArgumentParser(description='Merge the cutflows of several samples and years')
+    parser.add_argument('files', nargs='+', help='Cutflow JSON files. E.g. rootfiles/*_cutflow.json')
+    parser.add_argument('-o', '--output', type=str, dest='output', action='store', default='rootfiles/cutflow_merged',
+                        help='Output name without extension (.json and .txt are written). Defaults to rootfiles/cutflow_merged')
+    args = parser.parse_args()
+
+    merged = MergeCutflows(args.files)
+    with open(args.output+'.json','w') as f:
+        json.dump({'cuts':merged['cuts'],
+                   'columns':[{'name':column,'cuts':[{'name':cut,'events':merged['values'][column][cut][0],'weighted':merged['values'][column][cut][1]}
+                                                     for cut in merged['cuts'] if cut in merged['values'][column]]}
+                              for column in merged['columns']]},f,indent=2)
+    table = FormatTable(merged['columns'],merged['cuts'],merged['values'])
+    with open(args.output+'.txt','w') as f:
+        f.write(table)
+    print (table)
+    print ('Merged cutflow written to %s.json/.txt'%args.output)
@@ -0,0 +1,281 @@
+''' Local read-through cache for the remote (xrootd) input files.
+
+    `CachedPath()` maps a remote URL (ex. `root://cmsxrootd.fnal.gov//store/...root`)
+    to a copy on local disk, fetching it on first use. Later runs on the same
+    samples then read from local disk instead of streaming over the WAN.
+
+    - The cache is only used if the cache directory exists (`filecache/` or
+      `$BSTAR_CACHE_DIR`). Otherwise the URL is returned unchanged, so Condor
+      jobs keep streaming their inputs.
+    - The total size is bounded (`$BSTAR_CACHE_SIZE` in GB, default 50). The
+      least recently used files are evicted first.
+    - Every copy is checked against the size (and optionally the adler32 checksum)
+      of the remote file, which is stored next to it in a `.meta` file.
+    - If anything goes wrong the URL is returned and the file is streamed as before.
+
+    The remote store can also be a local directory (ex. for testing), in which case
+    plain file copies are used instead of `xrdcp`.
+
+    To fill the cache ahead of time:
+    ```
+    python FileCache.py -s ttbar QCDHT700 QCDHT1000 -y 16 17 18
+    ```
+'''
+import os, re, json, shutil, subprocess, zlib
+
+cachedir = os.environ.get('BSTAR_CACHE_DIR','filecache/')
+maxsize = float(os.environ.get('BSTAR_CACHE_SIZE',50))*1e9
+redirector = 'root://cmsxrootd.fnal.gov/'
+rootfile_path = '/store/user/cmsdas/2021/long_exercises/BstarTW/rootfiles'
+url_regex = re.compile(r'^root://([^/]+)/+(.*)$')
+
+def SplitURL(url):
+    '''Splits an xrootd URL into the host and the path on the host.
+
+    Args:
+        url (str): Remote URL or local path.
+
+    Returns:
+        tuple(str,str): Host (None for a local path) and path.
+    '''
+    m = url_regex.match(url)
+    if m: return m.group(1), '/'+m.group(2)
+    return None, url
+
+def LocalPath(url,cachedir=cachedir):
+    '''Path of the cached copy of a remote file.
+
+    Args:
+        url (str): Remote URL or local path.
+        cachedir (str, optional): Cache directory. Defaults to `filecache/` or $BSTAR_CACHE_DIR.
+
+    Returns:
+        str: Path in the cache (which may not exist yet).
+    '''
+    host, path = SplitURL(url)
+    if host == None:
+        host, path = 'local', os.path.abspath(path)
+    return os.path.join(cachedir,host,path.lstrip('/'))
+
+def Adler32(filename):
+    '''adler32 checksum of a local file in the format used by xrootd.
+
+    Args:
+        filename (str): Path to the file.
+
+    Returns:
+        str: Checksum as 8 hexadecimal characters.
+    '''
+    value = 1
+    with open(filename,'rb') as f:
+        for block in iter(lambda: f.read(1<<20), b''):
+            value = zlib.adler32(block,value)
+    return '%08x'%(value & 0xffffffff)
+
+def RemoteSize(url):
+    '''Size of the remote file in bytes.
+
+    Args:
+        url (str): Remote URL or local path.
+
+    Returns:
+        int: Size in bytes.
+    '''
+    host, path = SplitURL(url)
+    if host == None:
+        return os.path.getsize(path)
+    out = subprocess.check_output(['xrdfs',host,'stat',path]).decode()
+    return int(re.search(r'Size:\s+(\d+)',out).group(1))
+
+def RemoteChecksum(url):
+    '''adler32 checksum of the remote file.
+
+    Args:
+        url (str): Remote URL or local path.
+
+    Returns:
+        str: Checksum as 8 hexadecimal characters.
+    '''
+    host, path = SplitURL(url)
+    if host == None:
+        return Adler32(path)
+    out = subprocess.check_output(['xrdfs',host,'query','checksum',path]).decode()
+    return out.split()[-1].lower().zfill(8)
+
+def ReadMeta(local):
+    '''Reads the metadata stored next to a cached file.
+
+    Args:
+        local (str): Path of the cached file.
+
+    Returns:
+        dict: Metadata (url, size and possibly adler32) or None if missing/unreadable.
+    '''
+    if not os.path.exists(local+'.meta'): return None
+    try:
+        with open(local+'.meta') as f:
+            return json.load(f)
+    except ValueError:
+        return None
+
+def IsValid(local,checksum=False):
+    '''Checks a cached file against its metadata.
+
+    Args:
+        local (str): Path of the cached file.
+        checksum (bool, optional): Also compare the adler32 checksum. Defaults to False.
+
+    Returns:
+        bool: True if the cached copy is complete.
+    '''
+    meta = ReadMeta(local)
+    if meta == None or not os.path.exists(local): return False
+    if os.path.getsize(local) != meta['size']: return False
+    if checksum and meta.get('adler32') != None and Adler32(local) != meta['adler32']: return False
+    return True
+
+def CachedFiles(cachedir=cachedir):
+    '''Files in the cache, least recently used first.
+
+    Args:
+        cachedir (str, optional): Cache directory. Defaults to `filecache/` or $BSTAR_CACHE_DIR.
+
+    Returns:
+        list(tuple(str,int)): Path and size of each cached file.
+    '''
+    files = []
+    for root, dirs, names in os.walk(cachedir):
+        for name in names:
+            if name.endswith('.meta') or '.part' in name: continue
+            path = os.path.join(root,name)
+            files.append((os.path.getmtime(path),path,os.path.getsize(path)))
+    return [(path,size) for mtime,path,size in sorted(files)]
+
+def Evict(needed,cachedir=cachedir,maxsize=maxsize,keep=None):
+    '''Removes the least recently used files until `needed` bytes fit under `maxsize`.
+
+    Args:
+        needed (int): Bytes to make room for.
+        cachedir (str, optional): Cache directory. Defaults to `filecache/` or $BSTAR_CACHE_DIR.
+        maxsize (float, optional): Maximum size of the cache in bytes. Defaults to $BSTAR_CACHE_SIZE GB.
+        keep (str, optional): Path to never evict. Defaults to None.
+
+    Returns:
+        list(str): Removed files.
+    '''
+    files = CachedFiles(cachedir)
+    total = sum([size for path,size in files])
+    removed = []
+    for path,size in files:
+        if total + needed <= maxsize: break
+        if path == keep: continue
+        os.remove(path)
+        if os.path.exists(path+'.meta'): os.remove(path+'.meta')
+        total -= size
+        removed.append(path)
+    return removed
+
+def Fetch(url,cachedir=cachedir,maxsize=maxsize,checksum=False):
+    '''Copies a remote file into the cache (evicting old files if needed).
+
+    Args:
+        url (str): Remote URL or local path.
+        cachedir (str, optional): Cache directory. Defaults to `filecache/` or $BSTAR_CACHE_DIR.
+        maxsize (float, optional): Maximum size of the cache in bytes. Defaults to $BSTAR_CACHE_SIZE GB.
+        checksum (bool, optional): Also check the adler32 checksum of the copy. Defaults to False.
+
+    Raises:
+        IOError: If the file does not fit in the cache or the copy does not match the remote file.
+
+    Returns:
+        str: Path of the cached copy.
+    '''
+    local = LocalPath(url,cachedir)
+    size = RemoteSize(url)
+    if size > maxsize:
+        raise IOError('%s (%s bytes) is larger than the cache (%s bytes)'%(url,size,maxsize))
+    Evict(size,cachedir,maxsize,keep=local)
+
+    if not os.path.exists(os.path.dirname(local)):
+        os.makedirs(os.path.dirname(local))
+    # Copy to a temporary name first so that other processes never see a partial file
+    tmp = '%s.part%s'%(local,os.getpid())
+    try:
+        host, path = SplitURL(url)
+        if host == None: shutil.copyfile(path,tmp)
+        else: subprocess.check_call(['xrdcp','-f','-s',url,tmp])
+
+        if os.path.getsize(tmp) != size:
+            raise IOError('Size of the copy of %s does not match (%s != %s)'%(url,os.path.getsize(tmp),size))
+        meta = {'url':url, 'size':size}
+        if checksum:
+            meta['adler32'] = RemoteChecksum(url)
+            if Adler32(tmp) != meta['adler32']:
+                raise IOError('Checksum of the copy of %s does not match'%url)
+        with open(local+'.meta','w') as f:
+            json.dump(meta,f)
+        os.rename(tmp,local)
+    finally:
+        if os.path.exists(tmp): os.remove(tmp)
+    return local
+
+def CachedPath(url,cachedir=cachedir,maxsize=maxsize,checksum=False):
+    '''Returns the local copy of a remote file, fetching it into the cache if needed.
+       Returns the URL unchanged if the cache directory does not exist, if the
+       input is not a single ROOT file, or if the file could not be cached.
+
+    Args:
+        url (str): Remote URL or local path.
+        cachedir (str, optional): Cache directory. Defaults to `filecache/` or $BSTAR_CACHE_DIR.
+        maxsize (float, optional): Maximum size of the cache in bytes. Defaults to $BSTAR_CACHE_SIZE GB.
+        checksum (bool, optional): Also check the adler32 checksum. Defaults to False.
+
+    Returns:
+        str: Path to open.
+    '''
+    if not os.path.isdir(cachedir) or not url.endswith('.root'):
+        return url
+    local = LocalPath(url,cachedir)
+    if IsValid(local,checksum):
+        os.utime(local,None) # mark as recently used
+        return local
+    try:
+        local = Fetch(url,cachedir,maxsize,checksum)
+        print ('Cached %s -> %s'%(url,local))
+        return local
+    except (IOError,OSError,subprocess.CalledProcessError) as e:
+        print ('WARNING: Could not cache %s (%s). Reading it remotely.'%(url,e))
+        return url
+
+if __name__ == "__main__":
+    from argparse import ArgumentParser
+    parser = ArgumentParser(description='Prefetch input files into the local cache')
+    parser.add_argument('-s', type=str, dest='setnames', nargs='+', action='store', default=[],
+                        help='Setnames to fetch. E.g. ttbar signalLH2000 QCDHT700')
+    parser.add_argument('-y', type=str, dest='years', nargs='+', action='store', default=['16','17','18'],
+                        help='Years to fetch. Defaults to 16 17 18')
+    parser.add_argument('-r', '--redirector', type=str, dest='redirector', action='store', default=redirector,
+                        help='Redirector of the remote store (empty for a local directory). Defaults to %s'%redirector)
+    parser.add_argument('-p', '--path', type=str, dest='path', action='store', default=rootfile_path,
+                        help='Directory of the files on the remote store. Defaults to %s'%rootfile_path)
+    parser.add_argument('-d', '--dir', type=str, dest='cachedir', action='store', default=cachedir,
+                        help='Cache directory. Defaults to %s'%cachedir)
+    parser.add_argument('--max-size', type=float, dest='maxsize', action='store', default=maxsize/1e9,
+                        help='Maximum size of the cache in GB. Defaults to %s'%(maxsize/1e9))
+    parser.add_argument('--checksum', action='store_true',
+                        help='Also check the adler32 checksum of every file')
+    parser.add_argument('--list', action='store_true',
+                        help='List the contents of the cache (least recently used first)')
+    args = parser.parse_args()
+
+    if not os.path.exists(args.cachedir):
+        os.makedirs(args.cachedir)
+    for setname in args.setnames:
+        for year in args.years:
+            url = '%s%s/%s_bstar%s.root'%(args.redirector,args.path,setname,year)
+            print ('%s -> %s'%(url,CachedPath(url,args.cachedir,args.maxsize*1e9,args.checksum)))
+    if args.list:
+        files = CachedFiles(args.cachedir)
+        for path,size in files:
+            print ('%10.1f MB  %s'%(size/1e6,path))
+        print ('Total: %.2f GB in %s files'%(sum([size for path,size in files])/1e9,len(files)))
@@ -0,0 +1,256 @@
+''' Merges the histogram outputs of many jobs and samples into one file per year
+    (a parallel replacement for `hadd`).
+
+    Handles the outputs of
+    - `bs_select.py` and `exercises/bs_select.py`: `Presel_<setname>[_<year>][_<job>].root` (2D histograms),
+    - `exercises/selection.py`: `<setname>_<year>_selection[_<job>].root` (1D histograms),
+    - `exercises/nminus1.py`: `<setname>_<year>_Nminus1[_<job>].root` (1D histograms),
+    and writes `<outdir>/merged_<year>_<kind>.root` (kind = Presel, selection or Nminus1)
+    with one directory per setname holding the sum of the histograms of all its jobs.
+
+    The inputs of every setname are summed in chunks by a pool of worker processes,
+    then the partial sums are combined per year and kind (also in parallel), so
+    hundreds of inputs are read by all the workers at once instead of one after the other.
+
+    The scripts already fill the histograms weighted by `norm`. With `--normalize`
+    every MC setname is instead scaled by getNormFactor() (xsec*lumi/genEventCount)
+    during the merge, for outputs filled without weights, and `--lumi` rescales the
+    MC to another integrated luminosity. The unweighted `cutflow` histogram is never scaled.
+
+    Usage (from the top of the repository):
+    ```
+    python MergeOutputs.py rootfiles/*_selection.root rootfiles/*_Nminus1.root -j 8
+    python MergeOutputs.py selectfiles/Presel_*.root -y 16 -j 16 --normalize
+    ```
+'''
+import os, re, sys, glob, math, time, shutil, tempfile, multiprocessing
+from collections import OrderedDict
+from argparse import ArgumentParser
+import ROOT
+ROOT.gROOT.SetBatch(True)
+
+output_regex = re.compile(r'^(?P<setname>.+?)_(?P<year>16|17|18)_(?P<kind>selection|Nminus1)(_(?P<job>\w+))?\.root$')
+presel_regex = re.compile(r'^Presel_(?P<setname>.+?)(_(?P<year>16|17|18))?(_(?P<job>\d+))?\.root$')
+unscaled = ['cutflow']
+
+def ParseName(filename,year=None):
+    '''Kind, setname and year of an output file from its name.
+
+    Args:
+        filename (str): Output file of one of the scripts.
+        year (str, optional): Year of the Presel files that do not have it in their name. Defaults to None.
+
+    Returns:
+        tuple(str,str,str): (kind, setname, year) or None if the name is not recognized.
+    '''
+    basename = os.path.basename(filename)
+    if basename.startswith('merged_') or basename.startswith('plotcache_'): return None # made from the outputs
+    m = output_regex.match(basename)
+    if m:
+        return (m.group('kind'), m.group('setname'), m.group('year'))
+    m = presel_regex.match(basename)
+    if m and (m.group('year') != None or year != None):
+        return ('Presel', m.group('setname'), m.group('year') if m.group('year') != None else year)
+    return None
+
+def IsData(setname):
+    '''Whether a setname is data (never normalized).
+
+    Args:
+        setname (str): Name of the set.
+
+    Returns:
+        bool
+    '''
+    return setname.startswith('data')
+
+def ScaleFactor(setname,year,config,normalize=False,lumi=None):
+    '''Factor applied to the histograms of a setname during the merge.
+
+    Args:
+        setname (str): Name of the set.
+        year (str): 16, 17, 18.
+        config (dict): Opened bstar_config.json.
+        normalize (bool, optional): Scale MC by xsec*lumi/genEventCount. Defaults to False.
+        lumi (float, optional): Rescale MC to this luminosity instead of the one in the config. Defaults to None.
+
+    Returns:
+        float: Scale factor.
+    '''
+    if IsData(setname): return 1.
+    scale = 1.
+    if normalize:
+        from helpers import getNormFactor
+        scale *= getNormFactor(setname,year,config)
+    if lumi != None:
+        scale *= float(lumi)/config['lumi'+str(year)]
+    return scale
+
+def SumHistograms(filenames,scale=1.,dirname=None):
+    '''Sums the histograms with the same name in several files.
+
+    Args:
+        filenames (list(str)): Input files.
+        scale (float, optional): Factor applied to the sum (except the histograms in `unscaled`). Defaults to 1.
+        dirname (str, optional): Directory to read the histograms from. Defaults to None (top of the file).
+
+    Returns:
+        OrderedDict: {name: histogram} detached from the files.
+    '''
+    ROOT.TH1.AddDirectory(False)
+    total = OrderedDict()
+    for filename in filenames:
+        infile = ROOT.TFile.Open(filename)
+        if not infile or infile.IsZombie():
+            raise IOError('Could not open %s'%filename)
+        directory = infile.Get(dirname) if dirname != None else infile
+        for key in directory.GetListOfKeys():
+            if not ROOT.TClass.GetClass(key.GetClassName()).InheritsFrom('TH1'): continue
+            name = key.GetName()
+            hist = key.ReadObj()
+            if name not in total:
+                total[name] = hist
+            elif not total[name].Add(hist):
+                raise ValueError('Histogram %s in %s has a different binning than in the previous files'%(name,filename))
+        infile.Close()
+    if scale != 1.:
+        for name,hist in total.items():
+            if name not in unscaled: hist.Scale(scale)
+    return total
+
+def MergeChunk(task):
+    '''Sums a chunk of the files of one setname into a partial file. Meant to be run in a worker process.
+
+    Args:
+        task (tuple): (filenames, setname, scale, partialname)
+
+    Returns:
+        tuple: (partialname, number of histograms)
+    '''
+    filenames, setname, scale, partialname = task
+    total = SumHistograms(filenames,scale)
+    outfile = ROOT.TFile.Open(partialname,'RECREATE')
+    for hist in total.values():
+        hist.Write()
+    outfile.Close()
+    return (partialname, len(total))
+
+def MergeYear(task):
+    '''Combines the partial sums of every setname into the output file of one year and kind.
+       Meant to be run in a worker process.
+
+    Args:
+        task (tuple): (outname, OrderedDict of {setname: list of partial files})
+
+    Returns:
+        str: Output file name.
+    '''
+    outname, partials = task
+    outfile = ROOT.TFile.Open(outname,'RECREATE')
+    for setname,filenames in partials.items():
+        total = SumHistograms(filenames)
+        outfile.mkdir(setname).cd()
+        for hist in total.values():
+            hist.Write()
+    outfile.Close()
+    return outname
+
+def GroupInputs(filenames,year=None):
+    '''Groups the input files by year, kind and setname.
+
+    Args:
+        filenames (list(str)): Input files.
+        year (str, optional): Year of the Presel files that do not have it in their name. Defaults to None.
+
+    Returns:
+        OrderedDict: {(year, kind): OrderedDict({setname: [files]})}
+    '''
+    groups = OrderedDict()
+    for filename in sorted(filenames):
+        parsed = ParseName(filename,year)
+        if parsed == None:
+            print ('WARNING: skipping %s (not a Presel, selection or Nminus1 output, or no year given with -y)'%filename)
+            continue
+        kind, setname, fileyear = parsed
+        groups.setdefault((fileyear,kind),OrderedDict()).setdefault(setname,[]).append(filename)
+    return groups
+
+def Merge(filenames,outdir='rootfiles/',jobs=None,chunk=None,year=None,config='bstar_config.json',normalize=False,lumi=None):
+    '''Merges the outputs into `<outdir>/merged_<year>_<kind>.root`.
+
+    Args:
+        filenames (list(str)): Input files.
+        outdir (str, optional): Output directory. Defaults to 'rootfiles/'.
+        jobs (int, optional): Number of worker processes. Defaults to the number of CPUs.
+        chunk (int, optional): Maximum number of files summed by one task. Defaults to spreading
+            every setname over all the workers.
+        year (str, optional): Year of the Presel files that do not have it in their name. Defaults to None.
+        config (str, optional): Configuration file with the xsecs, luminosities and event counts. Defaults to 'bstar_config.json'.
+        normalize (bool, optional): Scale MC by xsec*lumi/genEventCount. Defaults to False.
+        lumi (float, optional): Rescale MC to this luminosity. Defaults to None.
+
+    Returns:
+        list(str): Output files.
+    '''
+    if jobs == None: jobs = multiprocessing.cpu_count()
+    groups = GroupInputs(filenames,year)
+    if normalize or lumi != None:
+        from TIMBER.Tools.Common import OpenJSON
+        config = OpenJSON(config)
+    if not os.path.exists(outdir):
+        os.makedirs(outdir)
+    tmpdir = tempfile.mkdtemp(prefix='merge_',dir=outdir)
+
+    # Stage 1: sum chunks of the inputs of every setname
+    chunk_tasks, partials = [], OrderedDict()
+    for (fileyear,kind),setnames in groups.items():
+        partials[(fileyear,kind)] = OrderedDict()
+        for setname,setfiles in setnames.items():
+            scale = ScaleFactor(setname,fileyear,config,normalize,lumi) if (normalize or lumi != None) else 1.
+            size = chunk if chunk != None else max(1,int(math.ceil(float(len(setfiles))/jobs)))
+            for i in range(0,len(setfiles),size):
+                partialname = os.path.join(tmpdir,'%s_%s_%s_%s.root'%(kind,fileyear,setname,i//size))
+                chunk_tasks.append((setfiles[i:i+size],setname,scale,partialname))
+                partials[(fileyear,kind)].setdefault(setname,[]).append(partialname)
+
+    pool = multiprocessing.Pool(jobs)
+    try:
+        start = time.time()
+        pool.map(MergeChunk,chunk_tasks)
+        print ('Summed %s files in %s chunks on %s workers in %.1f s'%(sum([len(t[0]) for t in chunk_tasks]),len(chunk_tasks),jobs,time.time()-start))
+        # Stage 2: one output per year and kind
+        start = time.time()
+        outputs = pool.map(MergeYear,[(os.path.join(outdir,'merged_%s_%s.root'%(fileyear,kind)),setnames)
+                                      for (fileyear,kind),setnames in partials.items()])
+        print ('Wrote %s merged files in %.1f s'%(len(outputs),time.time()-start))
+    finally:
+        pool.close()
+        pool.join()
+        shutil.rmtree(tmpdir)
+    return outputs
+
+if __name__ == "__main__":
+    sys.path.append('./')
+    parser = ArgumentParser(description='Merge the histogram outputs of many jobs and samples into one file per year')
+    parser.add_argument('files', nargs='+', help='Output files (globs are expanded). E.g. rootfiles/*_selection.root selectfiles/Presel_*.root')
+    parser.add_argument('-o', '--outdir', type=str, dest='outdir', action='store', default='rootfiles/',
+                        help='Output directory for merged_<year>_<kind>.root. Defaults to rootfiles/')
+    parser.add_argument('-j', '--jobs', type=int, dest='jobs', action='store', default=None,
+                        help='Number of worker processes. Defaults to the number of CPUs')
+    parser.add_argument('--chunk', type=int, dest='chunk', action='store', default=None,
+                        help='Maximum number of files summed by one task. Defaults to spreading every setname over all the workers')
+    parser.add_argument('-y', '--year', type=str, dest='year', action='store', default=None,
+                        help='Year of the Presel_<setname>.root files (their names do not have it)')
+    parser.add_argument('-c', '--config', type=str, dest='config', action='store', default='bstar_config.json',
+                        help='Configuration file with the xsecs, luminosities and event counts. Defaults to bstar_config.json')
+    parser.add_argument('--normalize', action='store_true',
+                        help='Scale MC by xsec*lumi/genEventCount (for outputs filled without the norm weight)')
+    parser.add_argument('--lumi', type=float, dest='lumi', action='store', default=None,
+                        help='Rescale MC to this integrated luminosity instead of the one in the config')
+    args = parser.parse_args()
+
+    filenames = []
+    for pattern in args.files:
+        filenames.extend(glob.glob(pattern) if any([c in pattern for c in '*?[']) else [pattern])
+    for output in Merge(filenames,args.outdir,args.jobs,args.chunk,args.year,args.config,args.normalize,args.lumi):
+        print ('Merged histograms written to %s'%output)
@@ -0,0 +1,235 @@
+''' Profiling of the TIMBER node chain of a selection.
+
+    For every node between the input and the given end nodes it records
+    - the number of events going in and out (for Cuts),
+    - the time spent in the node itself: evaluating its Cut, or computing
+      its Define column (and reading the branches it is the first to use).
+
+    Everything is booked lazily so that it is measured in the same event loop
+    as the histograms. Every node gets a Count on a pass-through Filter that
+    calls a C++ timer (a Define is only evaluated if something uses it, so the
+    Filter also reads the column). RDataFrame runs the actions of an event in
+    the order they were booked, so with the profile booked before the
+    histograms every timer only sees the cost of its own node: the columns and
+    cuts of the nodes before it were already evaluated by their own timers.
+    The times are summed over the threads and what is not in any node (reading
+    the event, filling the histograms, RDataFrame itself) goes to the Input node.
+    RDataFrame's own JIT compilation is reported by its log, which is turned on
+    for the loop when this ROOT version has it.
+
+    The results are written as JSON and as a `.dot` graph of the nodes
+    annotated with the numbers (the slowest nodes in red). Usage:
+    ```
+    profile = NodeProfiler.NodeProfile([a.GetActiveNode()])   # before booking the histograms
+    for action in profile.actions: hists.AddAction(action)
+    hists.Run()
+    profile.Save('rootfiles/ttbar_16_selection_profile.json', 'plots/ttbar_16_selection_profile.dot')
+    ```
+'''
+import json
+import ROOT
+
+ntimers = [0]
+
+def NodeChain(nodes):
+    '''All nodes from the input to the given end nodes, parents always before their children.
+
+    Args:
+        nodes (list(Node)): End nodes of the chain(s).
+
+    Returns:
+        list(Node): Ordered unique nodes.
+    '''
+    chain, seen = [], set()
+    for node in nodes:
+        ancestors = []
+        while node != None:
+            ancestors.append(node)
+            node = node.parent
+        for node in reversed(ancestors):
+            if id(node) in seen: continue
+            seen.add(id(node))
+            chain.append(node)
+    return chain
+
+def ColumnNames(node):
+    '''Names of the columns available at a node.
+
+    Args:
+        node (Node): TIMBER node.
+
+    Returns:
+        set(str): Column names.
+    '''
+    return set([str(c) for c in node.DataFrame.GetColumnNames()])
+
+def NodeType(node):
+    '''Kind of action that made a node.
+
+    Args:
+        node (Node): TIMBER node.
+
+    Returns:
+        str: 'Input' for the first node, 'Define' if the node adds a column and 'Cut' otherwise.
+    '''
+    if node.parent == None:
+        return 'Input'
+    elif node.name in ColumnNames(node) and node.name not in ColumnNames(node.parent):
+        return 'Define'
+    return 'Cut'
+
+timer_code = '''
+#include <chrono>
+#include <vector>
+namespace bstar_profile {
+    /** Time between consecutive calls of Lap() in every thread, given to the node of the second call */
+    class Timer {
+        private:
+            std::vector<std::vector<double>> times; // [slot][node]
+            std::vector<std::chrono::steady_clock::time_point> last; // [slot]
+            std::vector<char> started; // [slot]
+        public:
+            Timer(unsigned int nslots, unsigned int nnodes) :
+                times(nslots, std::vector<double>(nnodes, 0.)), last(nslots), started(nslots, 0) {};
+            bool Lap(unsigned int slot, int node) {
+                auto now = std::chrono::steady_clock::now();
+                if (started[slot]) times[slot][node] += std::chrono::duration<double>(now - last[slot]).count();
+                started[slot] = 1;
+                last[slot] = now;
+                return true;
+            }
+            double Time(int node) const {
+                double total = 0.;
+                for (const auto& slot : times) total += slot[node];
+                return total;
+            }
+    };
+}
+'''
+
+def NSlots(node):
+    '''Number of processing slots (threads) of the event loop of a node.'''
+    if hasattr(node.DataFrame,'GetNSlots'):
+        return node.DataFrame.GetNSlots()
+    if ROOT.ROOT.IsImplicitMTEnabled():
+        return ROOT.ROOT.GetThreadPoolSize() if hasattr(ROOT.ROOT,'GetThreadPoolSize') else ROOT.ROOT.GetImplicitMTPoolSize()
+    return 1
+
+class NodeProfile(object):
+    '''Books the event counts and timers of every node leading to `nodes`.
+       Book it before the histograms so that it is filled in the same event loop
+       and its timers are the first to evaluate every node.
+
+    Args:
+        nodes (list(Node)): End nodes of the selection (ex. [a.GetActiveNode()]).
+    '''
+    def __init__(self,nodes):
+        self.chain = NodeChain(nodes)
+        index = dict([(id(node),i) for i,node in enumerate(self.chain)])
+
+        if not hasattr(ROOT,'bstar_profile'):
+            ROOT.gInterpreter.Declare(timer_code)
+        ntimers[0] += 1
+        self.timer = 'bstar_profile_timer%s'%ntimers[0]
+        ROOT.gInterpreter.Declare('bstar_profile::Timer %s(%s, %s);'%(self.timer,NSlots(self.chain[0]),len(self.chain)))
+
+        self.entries, self.counts, self.actions = [], [], []
+        for i,node in enumerate(self.chain):
+            entry = {'index':i, 'name':node.name, 'action':node.action,
+                     'parent':index[id(node.parent)] if node.parent != None else None}
+            entry['type'] = NodeType(node)
+            lap = '%s.Lap(rdfslot_, %s)'%(self.timer,i)
+            if entry['type'] == 'Define':
+                count = node.DataFrame.Filter('((void)%s, %s)'%(node.name,lap)).Count()
+            else:
+                count = node.DataFrame.Filter(lap).Count()
+            self.actions.append(count)
+            if entry['type'] == 'Cut':
+                # Run right after the one above: gets the time of the Cut when it rejects the event
+                self.actions.append(node.parent.DataFrame.Filter(lap).Count())
+            self.entries.append(entry)
+            self.counts.append(count)
+
+        # RDataFrame reports the time of its JIT compilation in its log (ROOT >= 6.24)
+        try:
+            self.verbosity = ROOT.Experimental.RLogScopedVerbosity(ROOT.Detail.RDF.RDFLogChannel(), ROOT.Experimental.ELogLevel.kInfo)
+        except AttributeError:
+            self.verbosity = None
+        self.profile = None
+
+    def Results(self):
+        '''Profile of every node (runs the event loop if it has not run yet).
+
+        Returns:
+            list(dict): One entry per node with index, name, type, action, parent (index of the parent node),
+                events_in, events_out, efficiency and time (seconds summed over the threads).
+        '''
+        if self.profile == None:
+            self.counts[0].GetValue()
+            self.verbosity = None
+            timer = getattr(ROOT,self.timer)
+            for entry,count in zip(self.entries,self.counts):
+                entry['events_out'] = count.GetValue()
+                entry['time'] = timer.Time(entry['index'])
+            for entry in self.entries:
+                parent = self.entries[entry['parent']] if entry['parent'] != None else None
+                entry['events_in'] = parent['events_out'] if parent != None else entry['events_out']
+                entry['efficiency'] = float(entry['events_out'])/entry['events_in'] if entry['events_in'] > 0 else None
+            self.profile = self.entries
+        return self.profile
+
+    def Save(self,jsonname,dotname=None):
+        '''Writes the profile as JSON and optionally as an annotated `.dot` graph.
+
+        Args:
+            jsonname (str): Output JSON file.
+            dotname (str, optional): Output annotated `.dot` file. Defaults to None (not written).
+        '''
+        profile = self.Results()
+        with open(jsonname,'w') as f:
+            json.dump(profile,f,indent=2)
+        print ('Profiling: wrote %s'%jsonname)
+        if dotname != None:
+            WriteDot(profile,dotname)
+            print ('Profiling: wrote %s'%dotname)
+
+def ProfileNodes(nodes,jsonname,dotname=None):
+    '''Profiles every node leading to `nodes` in one event loop of its own and writes the results.
+       Use NodeProfile to profile in the event loop of the histograms instead.
+
+    Args:
+        nodes (list(Node)): End nodes of the selection (ex. [a.GetActiveNode()]).
+        jsonname (str): Output JSON file.
+        dotname (str, optional): Output annotated `.dot` file. Defaults to None (not written).
+
+    Returns:
+        list(dict): Output of NodeProfile.Results().
+    '''
+    profile = NodeProfile(nodes)
+    profile.Save(jsonname,dotname)
+    return profile.Results()
+
+def WriteDot(profile,dotname):
+    '''Writes the profiled nodes as a graphviz `.dot` file annotated with
+       the event counts and times. Nodes are shaded from white (fast) to red (slowest).
+
+    Args:
+        profile (list(dict)): Output of ProfileNodes().
+        dotname (str): Output file.
+    '''
+    slowest = max([entry['time'] for entry in profile]+[1e-9])
+    lines = ['digraph profile {','    node [shape=box, style=filled, fontname="Helvetica"];']
+    for entry in profile:
+        label = '%s (%s)\\n%s'%(entry['name'],entry['type'],entry['action'].replace('"','\\"')) if entry['action'] else '%s (%s)'%(entry['name'],entry['type'])
+        label += '\\nevents: %s -> %s'%(entry['events_in'],entry['events_out'])
+        if entry['efficiency'] != None and entry['type'] == 'Cut':
+            label += ' (%.1f%%)'%(100*entry['efficiency'])
+        label += '\\ntime: %.3f s'%entry['time']
+        shade = int(255*(1-entry['time']/slowest))
+        lines.append('    n%s [label="%s", fillcolor="#ff%02x%02x"];'%(entry['index'],label,shade,shade))
+    for entry in profile:
+        if entry['parent'] != None:
+            lines.append('    n%s -> n%s;'%(entry['parent'],entry['index']))
+    lines.append('}')
+    with open(dotname,'w') as f:
+        f.write('\n'.join(lines)+'\n')
@@ -0,0 +1,149 @@
+''' Cache of the histograms read by `exercises/plot.py`.
+
+    The first time a year is plotted, the `rootfiles/<setname>_<year>_selection.root`
+    (or `_Nminus1.root`) of every sample are read once, the QCD HT slices and the
+    single top processes are summed into their groups, and everything is written to
+    `rootfiles/plotcache_<year>_<kind>.root` with one directory per sample and per group.
+    The cache stores the modification times of its inputs and is only rebuilt when
+    one of them changes (or a sample appears or disappears), so re-plotting with
+    other styles (`--logy`, `--soverb`) only reads this one file:
+    ```
+    histgroups = PlotCache.LoadHists(['ttbar','QCDHT700',...], '16', 'selection')
+    histgroups['QCD']['lead_tau32']
+    ```
+'''
+import os, json
+from collections import OrderedDict
+import ROOT
+from MergeOutputs import SumHistograms
+
+# Backgrounds that are always plotted summed together
+groups = OrderedDict([
+    ('QCD',       ['QCDHT700','QCDHT1000','QCDHT1500','QCDHT2000']),
+    ('singletop', ['singletop_tW','singletop_tWB']),
+])
+# Bookkeeping histograms that are not distributions
+skipped = ['cutflow','cutflow_weighted']
+
+def InputPath(sample,year,kind,rootdir='rootfiles/'):
+    '''Output of selection.py (kind = selection) or nminus1.py (kind = Nminus1) for a sample.'''
+    return os.path.join(rootdir,'{}_{}_{}.root'.format(sample,year,kind))
+
+def CachePath(year,kind,rootdir='rootfiles/'):
+    '''Cache file of a year and kind.'''
+    return os.path.join(rootdir,'plotcache_{}_{}.root'.format(year,kind))
+
+def CacheKey(samples,year,kind,rootdir='rootfiles/'):
+    '''Inputs the cache is built from and their modification times.
+
+    Args:
+        samples (list(str)): Samples to plot (group members included).
+        year (str): 16, 17, 18.
+        kind (str): selection or Nminus1.
+        rootdir (str, optional): Directory of the inputs. Defaults to 'rootfiles/'.
+
+    Returns:
+        dict: {sample: modification time} of the inputs that exist.
+    '''
+    key = {}
+    for sample in samples:
+        path = InputPath(sample,year,kind,rootdir)
+        if os.path.exists(path):
+            key[sample] = os.path.getmtime(path)
+    return key
+
+def ReadSample(sample,year,kind,rootdir='rootfiles/'):
+    '''Histograms of a sample by variable name.
+
+    Args:
+        sample (str): Name of the sample.
+        year (str): 16, 17, 18.
+        kind (str): selection or Nminus1.
+        rootdir (str, optional): Directory of the inputs. Defaults to 'rootfiles/'.
+
+    Returns:
+        OrderedDict: {varname: histogram}
+    '''
+    hists = OrderedDict()
+    for name,hist in SumHistograms([InputPath(sample,year,kind,rootdir)]).items():
+        if name in skipped: continue
+        # Selection histograms are named <sample>_<year>_<varname>, N-1 histograms by the variable only
+        if kind == 'selection':
+            if not name.startswith(sample+'_'+year+'_'): continue
+            name = name[len(sample+'_'+year)+1:]
+        hists[name] = hist
+    return hists
+
+def BuildCache(samples,year,kind,rootdir='rootfiles/'):
+    '''Reads the inputs, sums the groups and writes the cache.
+
+    Args:
+        samples (list(str)): Samples to plot (group members included).
+        year (str): 16, 17, 18.
+        kind (str): selection or Nminus1.
+        rootdir (str, optional): Directory of the inputs and cache. Defaults to 'rootfiles/'.
+
+    Returns:
+        OrderedDict: {sample or group: {varname: histogram}}
+    '''
+    key = CacheKey(samples,year,kind,rootdir)
+    histgroups = OrderedDict()
+    for sample in samples:
+        if sample in key:
+            histgroups[sample] = ReadSample(sample,year,kind,rootdir)
+    for group,members in groups.items():
+        for member in [m for m in members if m in histgroups]:
+            if group not in histgroups: histgroups[group] = OrderedDict()
+            for varname,hist in histgroups[member].items():
+                if varname not in histgroups[group]:
+                    histgroups[group][varname] = hist.Clone(group+'_'+varname)
+                else:
+                    histgroups[group][varname].Add(hist)
+
+    cachefile = ROOT.TFile.Open(CachePath(year,kind,rootdir),'RECREATE')
+    ROOT.TNamed('inputs',json.dumps(key)).Write()
+    for name,hists in histgroups.items():
+        cachefile.mkdir(name).cd()
+        for varname,hist in hists.items():
+            hist.Write(varname) # keyed by the variable name whatever the name of the histogram
+    cachefile.Close()
+    print ('Plot cache %s built from %s inputs'%(CachePath(year,kind,rootdir),len(key)))
+    return histgroups
+
+def ReadCache(year,kind,rootdir='rootfiles/'):
+    '''Contents of the cache.
+
+    Returns:
+        tuple(dict,OrderedDict): Key the cache was built with (None if there is no cache)
+            and {sample or group: {varname: histogram}}.
+    '''
+    cachename = CachePath(year,kind,rootdir)
+    if not os.path.exists(cachename): return None, None
+    cachefile = ROOT.TFile.Open(cachename)
+    if not cachefile or cachefile.IsZombie() or not cachefile.Get('inputs'): return None, None
+    key = json.loads(cachefile.Get('inputs').GetTitle())
+    names = [k.GetName() for k in cachefile.GetListOfKeys() if k.GetClassName() == 'TDirectoryFile']
+    cachefile.Close()
+    histgroups = OrderedDict()
+    for name in names:
+        histgroups[name] = SumHistograms([cachename],dirname=name)
+    return key, histgroups
+
+def LoadHists(samples,year,kind,rootdir='rootfiles/',rebuild=False):
+    '''Histograms of the samples and groups, from the cache if it is up to date.
+
+    Args:
+        samples (list(str)): Samples to plot (group members included).
+        year (str): 16, 17, 18.
+        kind (str): selection or Nminus1.
+        rootdir (str, optional): Directory of the inputs and cache. Defaults to 'rootfiles/'.
+        rebuild (bool, optional): Rebuild the cache even if it is up to date. Defaults to False.
+
+    Returns:
+        OrderedDict: {sample or group: {varname: histogram}}
+    '''
+    if not rebuild:
+        key, histgroups = ReadCache(year,kind,rootdir)
+        if key != None and key == CacheKey(samples,year,kind,rootdir):
+            return histgroups
+    return BuildCache(samples,year,kind,rootdir)
@@ -0,0 +1,68 @@
+''' Pass/fail templates of the whole signal mass grid of a year in one job.
+
+    Every signal sample gets its own analyzer (so its own RDataFrame and `norm`,
+    from getNormFactor()) and the selections of all the samples are booked before
+    any event loop runs. They are then run together with RDF.RunGraphs(), which
+    compiles the code of all of them at once and runs their event loops at the
+    same time on the thread pool, instead of one process per signal mass:
+    ```
+    results = OrderedDict()
+    for setname,setfiles in files.items():                     # files = {setname: [files]}
+        a = analyzer(setfiles)
+        final, results[setname] = Select(a, ..., str(helpers.getNormFactor(setname,year,config)), ...)
+    SignalTemplates.RunAll(results)
+    SignalTemplates.WriteTemplates('templates_16.root', results)
+    ```
+    The sample of an event is the one of its analyzer, never deduced from the
+    entry number (which in multi-thread runs is not the position in the files).
+    The output has one directory per setname with the same histograms as
+    `Presel_<setname>.root`, like the files written by MergeOutputs.py.
+'''
+import re
+from collections import OrderedDict
+import ROOT
+
+signal_regex = re.compile(r'^signal(LH|RH)(\d+)$')
+
+def SignalSets(config,year):
+    '''Signal setnames of a year, ordered by chirality and mass.
+
+    Args:
+        config (dict): Opened bstar_config.json.
+        year (str): 16, 17, 18.
+
+    Returns:
+        list(str)
+    '''
+    setnames = [s for s in config['NEVENTS'][str(year)] if signal_regex.match(s)]
+    return sorted(setnames,key=lambda s: (signal_regex.match(s).group(1),int(signal_regex.match(s).group(2))))
+
+def RunAll(results):
+    '''Runs the event loops of all the samples together.
+
+    Args:
+        results (OrderedDict): {setname: [booked histograms]} of analyzers that were not run yet.
+    '''
+    booked = [h for hists in results.values() for h in hists]
+    if len(booked) == 0: return
+    if hasattr(ROOT.RDF,'RunGraphs'):
+        ROOT.RDF.RunGraphs(booked)
+    else:
+        # One loop per sample, one after the other
+        for hists in results.values():
+            if len(hists) > 0: hists[0].GetValue()
+
+def WriteTemplates(outname,results):
+    '''Writes the templates with one directory per setname.
+
+    Args:
+        outname (str): Output file.
+        results (OrderedDict): {setname: [histograms]} (RDataFrame results or histograms).
+    '''
+    outfile = ROOT.TFile.Open(outname,'RECREATE')
+    for setname,hists in results.items():
+        outfile.mkdir(setname).cd()
+        for h in hists:
+            (h.GetValue() if hasattr(h,'GetValue') else h).Write()
+    outfile.Close()
+    print ('Templates of %s signal samples written to %s'%(len(results),outname))
@@ -0,0 +1,160 @@
+''' Jet energy and mass scale and resolution (JES, JER, JMS, JMR) variations of the selection.
+
+    The inputs carry the individual corrections of the fatJetUncertainties module
+    instead of the corrected pt and mass (see the docstring of bs_select.py), stored as
+    `FatJet_<source>_<nom|up|down>`. For every variation the corrected columns are
+    ```
+    FatJet_pt_<variation>        = FatJet_pt * JES * JER
+    FatJet_msoftdrop_<variation> = FatJet_msoftdrop * JES * JER * JMS * JMR
+    ```
+    with the nominal correction of every source except the varied one.
+
+    The selection after the shared part (filters, trigger, hemispheres) is booked once per
+    variation on its own branch of the node graph, with every column and node renamed
+    with the variation as suffix. Everything is booked before the event loop runs, so the
+    shared part is done once per event for all the variations:
+    ```
+    renames = Systematics.DefineVariations(a, variations)
+    results = Systematics.ForEachVariation(a, variations, lambda variation: Book(a, variation, renames[variation]))
+    ```
+'''
+import re
+from collections import OrderedDict
+from NodeProfiler import ColumnNames
+
+sources = ['JES','JER','JMS','JMR']
+pt_sources = ['JES','JER'] # the mass corrections only change the softdrop mass
+correction_column = 'FatJet_{source}_{shift}'
+
+def Variations(sources=sources):
+    '''Names of the variations: nominal and <source>_up/<source>_down of every source.
+
+    Args:
+        sources (list(str), optional): Sources of uncertainty. Defaults to JES, JER, JMS and JMR.
+
+    Returns:
+        list(str)
+    '''
+    return ['nominal'] + ['%s_%s'%(source,shift) for source in sources for shift in ['up','down']]
+
+def Shift(variation,source):
+    '''Shift (nom, up or down) of a source in a variation.'''
+    return variation.split('_')[-1] if variation.startswith(source+'_') else 'nom'
+
+def AvailableVariations(node,variations):
+    '''Variations whose corrections are stored in the input (ex. none of the up/down ones for data).
+
+    Args:
+        node (Node): Node with the input columns.
+        variations (list(str)): Requested variations.
+
+    Returns:
+        list(str): Variations that can be made.
+    '''
+    columns = ColumnNames(node)
+    available = []
+    for variation in variations:
+        missing = [correction_column.format(source=s,shift=Shift(variation,s)) for s in sources
+                   if Shift(variation,s) != 'nom' and correction_column.format(source=s,shift=Shift(variation,s)) not in columns]
+        if len(missing) > 0:
+            print ('WARNING: skipping the %s variation (%s not in the input)'%(variation,', '.join(missing)))
+        else:
+            available.append(variation)
+    return available
+
+def CorrectionStrings(variation,columns):
+    '''Expressions of the corrected FatJet pt and softdrop mass of a variation.
+
+    Args:
+        variation (str): Name of the variation.
+        columns (set(str)): Columns of the input. Nominal corrections that are not stored are skipped.
+
+    Returns:
+        tuple(str,str): pt and softdrop mass expressions.
+    '''
+    pt, msd = ['FatJet_pt'], ['FatJet_msoftdrop']
+    for source in sources:
+        column = correction_column.format(source=source,shift=Shift(variation,source))
+        if column not in columns: continue
+        if source in pt_sources: pt.append(column)
+        msd.append(column)
+    return '*'.join(pt), '*'.join(msd)
+
+def DefineVariations(a,variations):
+    '''Defines the corrected pt and softdrop mass of every variation on the active node
+       (only computed for the variations that use them).
+
+    Args:
+        a (analyzer): TIMBER analyzer after the shared part of the selection.
+        variations (list(str)): Variations to define.
+
+    Returns:
+        dict: {variation: {column: renamed column}} to pass to Rename() and RenameGroups().
+    '''
+    columns = ColumnNames(a.GetActiveNode())
+    renames = {}
+    for variation in variations:
+        pt, msd = CorrectionStrings(variation,columns)
+        a.Define('FatJet_pt_%s'%variation, pt)
+        a.Define('FatJet_msoftdrop_%s'%variation, msd)
+        renames[variation] = {'FatJet_pt':'FatJet_pt_%s'%variation, 'FatJet_msoftdrop':'FatJet_msoftdrop_%s'%variation}
+    return renames
+
+def Rename(expression,renames):
+    '''Replaces the column names (whole words only) in an expression.
+
+    Args:
+        expression (str): C++ expression.
+        renames (dict): {column: new name}
+
+    Returns:
+        str
+    '''
+    if len(renames) == 0: return expression
+    regex = re.compile(r'\b(%s)\b'%'|'.join([re.escape(c) for c in sorted(renames,key=len,reverse=True)]))
+    return regex.sub(lambda m: renames[m.group(1)], expression)
+
+def RenameGroups(groups,variation,renames):
+    '''Copies of VarGroups and CutGroups for one variation: every column and cut gets
+       the variation as suffix and the expressions use the renamed columns.
+
+    Args:
+        groups (list(Group)): VarGroups and CutGroups (ex. from BuildTaggingGroups()).
+        variation (str): Name of the variation.
+        renames (dict): {column: new name} of the columns defined before the groups.
+            The columns of the VarGroups are added to it.
+
+    Returns:
+        list(Group)
+    '''
+    renames = dict(renames)
+    out = []
+    for group in groups:
+        copy = type(group)('%s_%s'%(group.name,variation))
+        for name in group.keys():
+            copy.Add('%s_%s'%(name,variation), Rename(group[name],renames))
+            # Names in a CutGroup are only node names, the ones in a VarGroup are columns used later
+            if group.__class__.__name__ == 'VarGroup':
+                renames[name] = '%s_%s'%(name,variation)
+        out.append(copy)
+    return out
+
+def ForEachVariation(a,variations,build):
+    '''Books the selection of every variation on its own branch starting from the active node.
+
+    Args:
+        a (analyzer): TIMBER analyzer after the shared part of the selection.
+        variations (list(str)): Variations to book.
+        build (function): Called with the variation name with the branch point as active node.
+            Returns what was booked.
+
+    Returns:
+        OrderedDict: {variation: what build() returned}
+    '''
+    base = a.GetActiveNode()
+    results = OrderedDict()
+    for variation in variations:
+        a.SetActiveNode(base)
+        results[variation] = build(variation)
+    a.SetActiveNode(base)
+    return results
@@ -0,0 +1,156 @@
+''' Shared policy for the number of implicit-MT threads used by the scripts.
+
+    The number of threads is taken from (first one found):
+    1. the `-t/--threads` option of the script,
+    2. the `BSTAR_NTHREADS` environment variable,
+    3. the CPUs allocated to the Condor job (`request_cpus` in condor/templates/jdl_template),
+    4. the default of the script (4 unless the script says otherwise),
+    and is never more than the CPUs available on the machine or, for a local
+    input file, the number of clusters in it (RDataFrame can not split the work
+    any finer, so extra threads would sit idle). 0 or 1 runs single-threaded.
+
+    ROOT only allows one thread pool per process, so the first call to EnableMT()
+    decides for every later analyzer in the same process. Scripts that run several
+    inputs in one process call it first without a file, so that the first input
+    does not cap the threads of all the others:
+    ```
+    ThreadPolicy.EnableMT(args.threads, None, 'args file')
+    for input_args in helpers.ReadArgsFile(...):
+        run(input_args)   # its EnableMT() only reports
+    ```
+'''
+import os, re, multiprocessing
+import ROOT
+
+default_threads = 4
+
+def CondorCpus():
+    '''CPUs allocated to the current Condor job.
+
+    Returns:
+        int: Number of CPUs or None if not running in a Condor job.
+    '''
+    jobad = os.environ.get('_CONDOR_JOB_AD')
+    if jobad != None and os.path.exists(jobad):
+        with open(jobad) as f:
+            m = re.search(r'^\s*RequestCpus\s*=\s*(\d+)', f.read(), re.M)
+        if m: return int(m.group(1))
+    # Condor also sets OMP_NUM_THREADS to the requested CPUs
+    if '_CONDOR_SCRATCH_DIR' in os.environ and os.environ.get('OMP_NUM_THREADS','').isdigit():
+        return int(os.environ['OMP_NUM_THREADS'])
+    return None
+
+def AvailableCpus():
+    '''CPUs this process may run on.
+
+    Returns:
+        int: Number of CPUs.
+    '''
+    if hasattr(os,'sched_getaffinity'):
+        return len(os.sched_getaffinity(0))
+    return multiprocessing.cpu_count()
+
+def IsLocal(filename):
+    '''Whether a file is read from the local disk (not over xrootd or http).
+
+    Args:
+        filename (str): Path or URL.
+
+    Returns:
+        bool
+    '''
+    return '://' not in filename or filename.startswith('file://')
+
+def FileClusters(filename,treename='Events'):
+    '''Number of entry clusters in the tree of a ROOT file. This is the
+       largest number of tasks RDataFrame can split the event loop into.
+
+    Args:
+        filename (str): Path or URL of a single ROOT file.
+        treename (str, optional): Name of the tree. Defaults to 'Events'.
+
+    Returns:
+        int: Number of clusters or None if the file could not be read.
+    '''
+    if not filename.endswith('.root'): return None
+    f = ROOT.TFile.Open(filename)
+    if not f or f.IsZombie(): return None
+    tree = f.Get(treename)
+    nclusters = None
+    if tree:
+        nentries = tree.GetEntries()
+        it = tree.GetClusterIterator(0)
+        start = it.Next()
+        nclusters = 0
+        while start < nentries:
+            nclusters += 1
+            start = it.Next()
+    f.Close()
+    return nclusters
+
+def NThreads(threads=None,filename=None,default=default_threads):
+    '''Decides the number of threads following the policy above.
+
+    Args:
+        threads (int, optional): Number requested on the command line. Defaults to None.
+        filename (str, optional): Input file used to cap the number by its clusters (only if it is local,
+            so that remote inputs are not opened an extra time). Defaults to None.
+        default (int, optional): Number used if nothing else is set. Defaults to 4.
+
+    Returns:
+        tuple(int,str): Number of threads and where it came from.
+    '''
+    if threads != None:
+        nthreads, source = threads, 'command line'
+    elif os.environ.get('BSTAR_NTHREADS','').isdigit():
+        nthreads, source = int(os.environ['BSTAR_NTHREADS']), '$BSTAR_NTHREADS'
+    elif CondorCpus() != None:
+        nthreads, source = CondorCpus(), 'Condor request_cpus'
+    else:
+        nthreads, source = default, 'default'
+
+    cpus = AvailableCpus()
+    if nthreads > cpus:
+        nthreads, source = cpus, source+', capped at %s available CPUs'%cpus
+    if nthreads > 1 and filename != None and IsLocal(filename):
+        nclusters = FileClusters(filename)
+        if nclusters != None and nclusters < nthreads:
+            nthreads, source = max(1,nclusters), source+', capped at %s clusters in the input'%nclusters
+    return nthreads, source
+
+def EnableMT(threads=None,filename=None,name='',default=default_threads):
+    '''Enables implicit multi-threading following the policy above and reports it.
+       Does nothing (other than reporting) if it is already enabled in this process.
+
+    Args:
+        threads (int, optional): Number requested on the command line. Defaults to None.
+        filename (str, optional): Input file used to cap the number by its clusters. Defaults to None.
+            Leave it out when the process runs several inputs.
+        name (str, optional): Name of the job for the report. Defaults to ''.
+        default (int, optional): Number used if nothing else is set. Defaults to 4.
+
+    Returns:
+        int: Number of threads in use.
+    '''
+    if ROOT.ROOT.IsImplicitMTEnabled():
+        nthreads = ROOT.ROOT.GetThreadPoolSize() if hasattr(ROOT.ROOT,'GetThreadPoolSize') else ROOT.ROOT.GetImplicitMTPoolSize()
+        print ('%s: %s implicit-MT threads (already enabled in this process)'%(name,nthreads))
+        return nthreads
+
+    nthreads, source = NThreads(threads,filename,default)
+    if nthreads > 1:
+        ROOT.ROOT.EnableImplicitMT(nthreads)
+        print ('%s: %s implicit-MT threads (%s)'%(name,nthreads,source))
+    else:
+        nthreads = 1
+        print ('%s: single-threaded (%s)'%(name,source))
+    return nthreads
+
+def AddThreadsArgument(parser):
+    '''Adds the `-t/--threads` option to an ArgumentParser.
+
+    Args:
+        parser (ArgumentParser): Parser of the script.
+    '''
+    parser.add_argument('-t', '--threads', type=int, dest='threads', action='store', default=None,
+                        help='Number of implicit-MT threads (0 or 1 for single-threaded). Defaults to $BSTAR_NTHREADS, the Condor request_cpus, or %s'%default_threads)
@@ -0,0 +1,205 @@
+/**
+    Micro-benchmark of GenParticleTree::FindChains() with compiled
+    GenChainPattern in modules/GenMatching.cc against the previous string
+    matching (kept below as ChainFinder_old) on synthetic GenPart collections
+    of 100 to 300 particles with top and W decays. Looks for the chains
+    6>24>1:5, 6>5 and 6>24 in every event and checks that both find the
+    same chains.
+
+    The previous FindChain() could not run as it was (the `:` range parsed
+    the wrong substring, the rest of the chain was made from an empty chain
+    at the end, copies were found by comparing the pdgId pointers and
+    Extend() took the chain by value so nothing past the first particle
+    was kept), so ChainFinder_old has those lines fixed, with the range
+    inclusive like in GenChainPattern. The algorithm, which splits the chain
+    and parses the PDG IDs of every step for every particle and copies the
+    rest of the chain at every parent, is the same.
+
+    Run from the top of the repository with
+    root -l -b -q 'benchmarks/chain_bench.cc+(10000)'
+*/
+#include <chrono>
+#include <cstdio>
+#include <vector>
+#include "TRandom3.h"
+#include "../modules/GenMatching.cc"
+
+/** Previous version of GenParticleTree::FindChain() on a tree. */
+class ChainFinder_old {
+    private:
+        GenParticleTree* tree;
+        Particle NoneParticle;
+
+        bool MatchParticleToString(Particle* particle, std::string string){
+            std::vector<int> pdgIds {};
+            if (FindInString(":",string)) {
+                int startId = std::stoi( string.substr(0,string.find(':')) );
+                int stopId  = std::stoi( string.substr(string.find(':')+1) ); // fixed: was substr(1,string.find(':'))
+                pdgIds = range(startId, stopId+1); // inclusive as in GenChainPattern
+            } else if (FindInString(",",string)) {
+                auto splits = split(string,',');
+                for (int istr = 0; istr < splits.size(); istr++) {
+                    pdgIds.push_back( std::stoi(splits.at(istr)) );
+                }
+            }
+
+            bool out;
+            if (pdgIds.size() == 0) {
+                if (std::abs(*particle->pdgId) == std::stoi(string)) {
+                    out = true;
+                } else {out = false;}
+            } else {
+                if (FindInList(std::abs(*particle->pdgId), pdgIds)) {
+                    out = true;
+                } else {out = false;}
+            }
+
+            return out;
+        }
+
+        std::vector<Particle*> RunChain(Particle* node, std::vector<std::string> chain) {
+            std::vector<Particle*> nodechain {node};
+            if (chain.size() == 0) return nodechain; // fixed: chain_minus_first was made before this test
+            Particle* parent = tree->GetParent(node);
+            std::vector<std::string> chain_minus_first = {chain.begin()+1,chain.end()};
+
+            if (parent->flag == false) {
+                nodechain.push_back(&NoneParticle);
+            } else if (MatchParticleToString(parent, chain.at(0))) {
+                Extend(nodechain, RunChain(parent,chain_minus_first));
+            } else if (*parent->pdgId == *node->pdgId) { // fixed: compared the pointers
+                Extend(nodechain, RunChain(parent, chain));
+            } else {
+                nodechain.push_back(&NoneParticle);
+            }
+
+            return nodechain;
+        }
+
+    public:
+        ChainFinder_old(GenParticleTree* in_tree) : tree(in_tree) {
+            NoneParticle.flag = false;
+        };
+
+        std::vector<std::vector<Particle*>> FindChain(std::string chainstring) {
+            std::vector<std::string> reveresed_chain = split(chainstring,'>');
+            std::reverse(reveresed_chain.begin(), reveresed_chain.end());
+
+            std::vector<std::string> reveresed_chain_minus_first = {reveresed_chain.begin()+1,reveresed_chain.end()};
+
+            std::vector<Particle*> chain_result;
+            std::vector<std::vector<Particle*>> out;
+
+            std::vector<Particle*> nodes = tree->GetParticles();
+            for (int inode = 0; inode < nodes.size(); inode++) {
+                Particle* n = nodes[inode];
+                if (MatchParticleToString(n, reveresed_chain.at(0))) {
+                    chain_result = RunChain(n,reveresed_chain_minus_first);
+                    bool no_NoneParticle = true;
+                    for (int icr = 0; icr < chain_result.size(); icr++) {
+                        if (chain_result[icr]->flag == false) {
+                            no_NoneParticle = false;
+                            break;
+                        }
+                    }
+                    if (no_NoneParticle) {out.push_back(chain_result);}
+                }
+            }
+            return out;
+        }
+};
+
+/** Synthetic GenPart collection of one event. Mothers always come before
+    their daughters, mostly a few entries before as in the NanoAOD pruning.
+    Tops decay to tops (copies), Ws and b quarks and Ws to Ws and light quarks. */
+void MakeSyntheticEvent(TRandom3& rand, int nGenPart, RVec<float>& pt, RVec<float>& eta,
+                        RVec<float>& phi, RVec<float>& mass, RVec<int>& pdgId, RVec<int>& mother) {
+    const int ids[12] = {21,21,21,1,2,3,4,5,6,24,22,211};
+    const int topIds[3] = {6,24,5};
+    const int WIds[5] = {24,1,2,3,4};
+    for (auto v : {&pt,&eta,&phi,&mass}) v->resize(nGenPart);
+    pdgId.resize(nGenPart);
+    mother.resize(nGenPart);
+    for (int i = 0; i < nGenPart; i++) {
+        if (i < 2) {
+            mother[i] = -1;
+        } else if (rand.Uniform() < 0.9) {
+            mother[i] = i-1-(int)rand.Integer(std::min(i,20));
+        } else {
+            mother[i] = (int)rand.Integer(i);
+        }
+        int motherId = mother[i] >= 0 ? std::abs(pdgId[mother[i]]) : 0;
+        int sign = rand.Uniform() < 0.5 ? -1 : 1;
+        if (motherId == 6) {
+            pdgId[i] = sign*topIds[(int)rand.Integer(3)];
+        } else if (motherId == 24) {
+            pdgId[i] = sign*WIds[(int)rand.Integer(5)];
+        } else {
+            pdgId[i] = sign*ids[(int)rand.Integer(12)];
+        }
+        if (mother[i] >= 0 && std::abs(pdgId[i]) == motherId) pdgId[i] = pdgId[mother[i]]; // copies keep the sign
+        pt[i] = rand.Exp(50.);
+        eta[i] = rand.Uniform(-5,5);
+        phi[i] = rand.Uniform(-M_PI,M_PI);
+        mass[i] = 0.;
+    }
+}
+
+bool SameChains(std::vector<std::vector<Particle*>>& oldChains, std::vector<std::vector<Particle*>>& newChains) {
+    if (oldChains.size() != newChains.size()) return false;
+    for (int ic = 0; ic < newChains.size(); ic++) {
+        if (oldChains[ic].size() != newChains[ic].size()) return false;
+        for (int ip = 0; ip < newChains[ic].size(); ip++) {
+            if (oldChains[ic][ip]->index != newChains[ic][ip]->index) return false;
+        }
+    }
+    return true;
+}
+
+void chain_bench(int nEvents = 10000, unsigned int seed = 12345) {
+    TRandom3 rand(seed);
+    const std::vector<std::string> chainstrings {"6>24>1:5","6>5","6>24"};
+    std::vector<GenChainPattern> patterns;
+    for (auto chainstring : chainstrings) patterns.emplace_back(chainstring); // compiled once
+
+    GenParticleTree tree;
+    ChainFinder_old oldFinder(&tree);
+    Particle staged;
+    RVec<float> pt, eta, phi, mass;
+    RVec<int> pdgId, mother;
+
+    for (int nGenPart : {100,200,300}) {
+        double tOld = 0, tNew = 0;
+        long nChains = 0;
+        int nDiff = 0;
+        for (int ievt = 0; ievt < nEvents; ievt++) {
+            MakeSyntheticEvent(rand,nGenPart,pt,eta,phi,mass,pdgId,mother);
+            GenParticleObjs genParts(pt,eta,phi,mass,pdgId,mother);
+            tree.Reset(nGenPart);
+            for (int i = 0; i < nGenPart; i++) {
+                genParts.FillParticle(i, staged);
+                tree.AddParticle(&staged);
+            }
+
+            auto start = std::chrono::steady_clock::now();
+            std::vector<std::vector<std::vector<Particle*>>> oldChains;
+            for (auto chainstring : chainstrings) oldChains.push_back(oldFinder.FindChain(chainstring));
+            auto stop = std::chrono::steady_clock::now();
+            tOld += std::chrono::duration<double>(stop-start).count();
+
+            start = std::chrono::steady_clock::now();
+            std::vector<std::vector<std::vector<Particle*>>> newChains = tree.FindChains(patterns);
+            stop = std::chrono::steady_clock::now();
+            tNew += std::chrono::duration<double>(stop-start).count();
+
+            // Validate
+            for (int ipattern = 0; ipattern < patterns.size(); ipattern++) {
+                nChains += newChains[ipattern].size();
+                if (!SameChains(oldChains[ipattern],newChains[ipattern])) {nDiff++; break;}
+            }
+        }
+        printf("%d particles: %.2f chains/evt, events with different chains: %d\n",nGenPart,(double)nChains/nEvents,nDiff);
+        printf("%d particles: old %.3f s (%.1f us/evt), new %.3f s (%.1f us/evt), speedup x%.2f\n",
+               nGenPart, tOld, 1e6*tOld/nEvents, tNew, 1e6*tNew/nEvents, tOld/tNew);
+    }
+}
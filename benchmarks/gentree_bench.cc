@@ -0,0 +1,157 @@
+/**
+    Micro-benchmark of GenParticleTree in modules/GenMatching.cc against the
+    previous implementation (kept below as GenParticleTree_old) on synthetic
+    GenPart collections of 100 to 300 particles. Builds the tree of every event
+    and looks up the parent of every particle, as GenJetMatcher does, and
+    checks that both trees give the same parents and children.
+
+    The previous AddParticle() could not run as it was (the parent test was
+    inverted so nothing was ever linked, and it erased from an empty vector),
+    so GenParticleTree_old only has those two lines fixed. The algorithm,
+    which rebuilds the list of stored indices and scans it and the nodes for
+    every particle added, is the same.
+
+    Run from the top of the repository with
+    root -l -b -q 'benchmarks/gentree_bench.cc+(10000)'
+*/
+#include <chrono>
+#include <cstdio>
+#include <vector>
+#include "TRandom3.h"
+#include "../modules/GenMatching.cc"
+
+/** Previous version of GenParticleTree (building and navigation only). */
+class GenParticleTree_old {
+    private:
+        std::vector<Particle*> nodes;
+        std::vector<Particle*> heads;
+        Particle NoneParticle;
+
+        std::vector<int> StoredIndexes(){
+            std::vector<int> current_idxs {};
+            for (int i = 0; i < nodes.size(); i++) {
+                current_idxs.push_back(nodes.at(i)->index);
+            }
+            return current_idxs;
+        }
+
+    public:
+        GenParticleTree_old(){
+            NoneParticle.flag = false;
+        };
+
+        void AddParticle(Particle* particle) {
+            Particle* staged_node = particle;
+            std::vector<int> heads_to_delete {};
+            for (int i = 0; i < heads.size(); i++) {
+                if (heads.at(i)->parentIndex == staged_node->index) {
+                    heads_to_delete.push_back(i);
+                }
+            }
+            for (int ih = heads_to_delete.size()-1; ih >= 0; ih--) { // fixed: was heads.begin()+ih from ih = size
+                heads.erase(heads.begin()+heads_to_delete[ih]);
+            }
+            std::vector<int> indexes = StoredIndexes();
+            if (!FindInList(staged_node->parentIndex, indexes)) { // fixed: condition was inverted
+                heads.push_back(staged_node);
+                nodes.push_back(staged_node);
+            } else {
+                for (int inode = 0; inode < nodes.size(); inode++) {
+                    if (staged_node->parentIndex == nodes[inode]->index){
+                        staged_node->AddParent(inode);
+                        nodes.at(inode)->AddChild(nodes.size());
+                        nodes.push_back(staged_node);
+                    }
+                }
+            }
+        };
+
+        std::vector<Particle*> GetChildren(Particle* particle){
+            std::vector<Particle*> children {};
+            for (int i = 0; i < particle->childIndex.size(); i++) {
+                children.push_back(nodes[particle->childIndex.at(i)]);
+            }
+            return children;
+        }
+
+        Particle* GetParent(Particle* particle) {
+            if (nodes.size() > particle->parentIndex){
+                return nodes.at(particle->parentIndex);
+            } else {
+                return &NoneParticle;
+            }
+        }
+};
+
+/** Synthetic GenPart collection of one event. Mothers always come before
+    their daughters, mostly a few entries before as in the NanoAOD pruning. */
+void MakeSyntheticEvent(TRandom3& rand, int nGenPart, std::vector<Particle>& particles, RVec<int>& pdgIds) {
+    const int ids[12] = {21,21,21,1,2,3,4,5,6,24,22,211};
+    particles.assign(nGenPart,Particle());
+    pdgIds.resize(nGenPart); // not resized after the pointers are taken
+    for (int i = 0; i < nGenPart; i++) {
+        Particle& p = particles[i];
+        p.index = i;
+        pdgIds[i] = (rand.Uniform() < 0.5 ? -1 : 1)*ids[(int)rand.Integer(12)];
+        p.pdgId = &pdgIds[i];
+        if (i < 2) {
+            p.parentIndex = -1;
+        } else if (rand.Uniform() < 0.9) {
+            p.parentIndex = i-1-(int)rand.Integer(std::min(i,20));
+        } else {
+            p.parentIndex = (int)rand.Integer(i);
+        }
+        p.statusFlags = (int)rand.Integer(1<<15);
+        p.vect.SetCoordinates(rand.Exp(50.),rand.Uniform(-5,5),rand.Uniform(-M_PI,M_PI),0.);
+    }
+}
+
+void gentree_bench(int nEvents = 10000, unsigned int seed = 12345) {
+    TRandom3 rand(seed);
+    GenParticleTree tree; // reused across events as in GenJetMatcher
+    std::vector<Particle> particles, oldParticles;
+    RVec<int> pdgIds;
+
+    for (int nGenPart : {100,200,300}) {
+        double tOld = 0, tNew = 0;
+        long checkOld = 0, checkNew = 0;
+        int nDiff = 0;
+        for (int ievt = 0; ievt < nEvents; ievt++) {
+            MakeSyntheticEvent(rand,nGenPart,particles,pdgIds);
+            oldParticles = particles; // the old tree modifies the particles it is given
+
+            auto start = std::chrono::steady_clock::now();
+            GenParticleTree_old oldTree;
+            for (int i = 0; i < nGenPart; i++) oldTree.AddParticle(&oldParticles[i]);
+            for (int i = 0; i < nGenPart; i++) checkOld += oldTree.GetParent(&oldParticles[i])->flag ? oldTree.GetParent(&oldParticles[i])->index : -1;
+            auto stop = std::chrono::steady_clock::now();
+            tOld += std::chrono::duration<double>(stop-start).count();
+
+            start = std::chrono::steady_clock::now();
+            tree.Reset(nGenPart);
+            std::vector<Particle*> stored(nGenPart);
+            for (int i = 0; i < nGenPart; i++) stored[i] = tree.AddParticle(&particles[i]);
+            for (int i = 0; i < nGenPart; i++) checkNew += tree.GetParent(stored[i])->flag ? tree.GetParent(stored[i])->index : -1;
+            stop = std::chrono::steady_clock::now();
+            tNew += std::chrono::duration<double>(stop-start).count();
+
+            // Validate
+            for (int i = 0; i < nGenPart; i++) {
+                Particle* oldParent = oldTree.GetParent(&oldParticles[i]);
+                Particle* newParent = tree.GetParent(stored[i]);
+                bool same = (oldParent->flag == newParent->flag) && (!newParent->flag || oldParent->index == newParent->index);
+                std::vector<Particle*> oldChildren = oldTree.GetChildren(&oldParticles[i]);
+                std::vector<Particle*> newChildren = tree.GetChildren(stored[i]);
+                same = same && (oldChildren.size() == newChildren.size());
+                for (int ic = 0; same && ic < newChildren.size(); ic++) {
+                    same = oldChildren[ic]->index == newChildren[ic]->index;
+                }
+                if (!same) {nDiff++; break;}
+            }
+        }
+        printf("%d particles: events with different trees: %d\n",nGenPart,nDiff);
+        printf("%d particles: old %.3f s (%.1f us/evt), new %.3f s (%.1f us/evt), speedup x%.2f%s\n",
+               nGenPart, tOld, 1e6*tOld/nEvents, tNew, 1e6*tNew/nEvents, tOld/tNew,
+               checkNew == checkOld ? "" : " (CHECKSUM MISMATCH)");
+    }
+}
@@ -0,0 +1,132 @@
+/**
+    Micro-benchmark of hemispherize() in bstar.cc against the previous
+    implementation (kept below as hemispherize_old) on synthetic FatJet
+    collections. Also checks that both give the same output for every event.
+
+    Run from the top of the repository with
+    root -l -b -q 'benchmarks/hemispherize_bench.cc+(1000000)'
+*/
+#include <chrono>
+#include <cstdio>
+#include <vector>
+#include "TRandom3.h"
+#include "../bstar.cc"
+
+/** Previous version of hemispherize(), copied verbatim for comparison. */
+RVec<int> hemispherize_old(RVec<float> jet_phi, RVec<int> jet_jetId, RVec<int> index = {}) {
+    RVec<int> Jetsh0{};
+    RVec<int> Jetsh1{};
+    RVec<int> LoopIndex{}; /** Index that we actually want to loop over (ordered in real pt) */
+    int nFatJets, first, second;
+    std::vector<int> v(jet_phi.size());
+
+    // Determine if a custom index has been input
+    if (index.size() > 0) {
+        nFatJets = index.size(); // Set nFatJets if using custom index
+        LoopIndex = index; // Set loop index to custom
+    } else {
+        nFatJets = jet_phi.size(); // Set nFatJets if not using custom index
+        std::iota (std::begin(v), std::end(v), 0);
+        LoopIndex = v; // Set loop index to standard one [0,1,...n]
+    }
+
+    int highestPtIdx;
+    int thisIdx;
+    for (int i = 0; i < nFatJets; ++i) {
+        highestPtIdx = LoopIndex[0];
+        thisIdx = LoopIndex[i];
+
+        if (std::abs(ROOT::VecOps::DeltaPhi(jet_phi[highestPtIdx],jet_phi[thisIdx])) > M_PI/2.0) {
+            if ( (jet_jetId[thisIdx] & 1) == 0 ){
+                if ( (jet_jetId[thisIdx] & 2) == 0 ) {
+                } else {
+                    Jetsh1.push_back(thisIdx);
+                }
+            } else {Jetsh1.push_back(thisIdx);}
+
+        } else {
+            if ( (jet_jetId[thisIdx] & 1) == 0 ){
+                if ( (jet_jetId[thisIdx] & 2) == 0 ) {
+                } else {
+                    Jetsh0.push_back(thisIdx);
+                }
+            } else {Jetsh0.push_back(thisIdx);}
+        }
+    }
+
+    if ((Jetsh0.size() < 1) || (Jetsh1.size() < 1)) {
+        first = -1; second = -1;
+    } else {
+        first = Jetsh0[0]; second = Jetsh1[0];
+    }
+
+    RVec<int> jets{first,second};
+    return jets;
+}
+
+/** Synthetic FatJet collections. Multiplicities and jetId values roughly follow
+    what is seen after the two-jet preselection of the NanoAOD skims. */
+struct SyntheticFatJets {
+    std::vector<RVec<float>> phi;
+    std::vector<RVec<int>> jetId;
+    std::vector<RVec<int>> index;
+};
+
+SyntheticFatJets MakeSyntheticFatJets(int nEvents, unsigned int seed) {
+    SyntheticFatJets out;
+    out.phi.reserve(nEvents);
+    out.jetId.reserve(nEvents);
+    out.index.reserve(nEvents);
+    TRandom3 rand(seed);
+    const int ids[4] = {0,2,6,6}; // mostly tight+tightLepVeto, some failing
+    for (int ievt = 0; ievt < nEvents; ievt++) {
+        int nJets = 1 + rand.Poisson(2.5);
+        RVec<float> phi(nJets);
+        RVec<int> jetId(nJets), index(nJets);
+        for (int ijet = 0; ijet < nJets; ijet++) {
+            phi[ijet] = rand.Uniform(-M_PI,M_PI);
+            jetId[ijet] = ids[(int)rand.Integer(4)];
+            index[ijet] = nJets-1-ijet;
+        }
+        out.phi.push_back(phi);
+        out.jetId.push_back(jetId);
+        out.index.push_back(index);
+    }
+    return out;
+}
+
+template <typename F>
+double TimeKernel(F kernel, const SyntheticFatJets& jets, bool useIndex, long& checksum) {
+    auto start = std::chrono::steady_clock::now();
+    for (size_t ievt = 0; ievt < jets.phi.size(); ievt++) {
+        RVec<int> idx = useIndex ? kernel(jets.phi[ievt],jets.jetId[ievt],jets.index[ievt])
+                                 : kernel(jets.phi[ievt],jets.jetId[ievt],RVec<int>{});
+        checksum += idx[0]*7+idx[1];
+    }
+    auto stop = std::chrono::steady_clock::now();
+    return std::chrono::duration<double>(stop-start).count();
+}
+
+void hemispherize_bench(int nEvents = 1000000, unsigned int seed = 12345) {
+    SyntheticFatJets jets = MakeSyntheticFatJets(nEvents,seed);
+
+    // Validate
+    int nDiff = 0;
+    for (int ievt = 0; ievt < nEvents; ievt++) {
+        if (!All(hemispherize(jets.phi[ievt],jets.jetId[ievt]) == hemispherize_old(jets.phi[ievt],jets.jetId[ievt]))) nDiff++;
+        if (!All(hemispherize(jets.phi[ievt],jets.jetId[ievt],jets.index[ievt]) == hemispherize_old(jets.phi[ievt],jets.jetId[ievt],jets.index[ievt]))) nDiff++;
+    }
+    printf("Events with different output: %d\n",nDiff);
+
+    auto newKernel = [](const RVec<float>& phi, const RVec<int>& id, const RVec<int>& index) {return hemispherize(phi,id,index);};
+    auto oldKernel = [](const RVec<float>& phi, const RVec<int>& id, const RVec<int>& index) {return hemispherize_old(phi,id,index);};
+    for (bool useIndex : {false,true}) {
+        long checkNew = 0, checkOld = 0;
+        double tOld = TimeKernel(oldKernel,jets,useIndex,checkOld);
+        double tNew = TimeKernel(newKernel,jets,useIndex,checkNew);
+        printf("%s index: old %.3f s (%.1f ns/evt), new %.3f s (%.1f ns/evt), speedup x%.2f%s\n",
+               useIndex ? "custom " : "default",
+               tOld, 1e9*tOld/nEvents, tNew, 1e9*tNew/nEvents, tOld/tNew,
+               checkNew == checkOld ? "" : " (CHECKSUM MISMATCH)");
+    }
+}
@@ -0,0 +1,85 @@
+''' Benchmark of MergeOutputs.py against a serial `hadd` of the same inputs.
+
+    Writes `--files` synthetic `<setname>_16_selection_<job>.root` outputs (spread
+    over a few setnames, each with `--hists` filled 1D histograms) to
+    `benchmarks/data/merge/`, then times
+    - `hadd -f` of the files of every setname, one after the other,
+    - `MergeOutputs.Merge()` of all the files with each number of workers,
+    and checks that both give the same integrals.
+
+    Run from the top of the repository:
+    ```
+    python benchmarks/merge_bench.py --files 500 --jobs 4 8 16
+    ```
+'''
+import os, sys, glob, time, shutil, subprocess
+from argparse import ArgumentParser
+sys.path.append('./')
+import ROOT
+import MergeOutputs
+ROOT.gROOT.SetBatch(True)
+
+datadir = 'benchmarks/data/merge/'
+setnames = ['ttbar','QCDHT700','QCDHT1000','QCDHT1500','QCDHT2000','signalLH2000']
+
+def MakeInputs(nfiles,nhists,nbins=100):
+    '''Writes the synthetic selection outputs.
+
+    Args:
+        nfiles (int): Number of files (spread over the setnames).
+        nhists (int): Number of histograms per file.
+        nbins (int, optional): Number of bins of the histograms. Defaults to 100.
+    '''
+    if os.path.exists(datadir): shutil.rmtree(datadir)
+    os.makedirs(datadir)
+    ROOT.gRandom.SetSeed(12345)
+    for i in range(nfiles):
+        setname = setnames[i%len(setnames)]
+        outfile = ROOT.TFile.Open(os.path.join(datadir,'%s_16_selection_%s.root'%(setname,i)),'RECREATE')
+        for j in range(nhists):
+            h = ROOT.TH1F('%s_16_var%s'%(setname,j),'',nbins,0,1)
+            h.FillRandom('gaus',1000)
+            h.Write()
+        outfile.Close()
+
+def Integrals(filename,dirname=None):
+    '''Integral of every histogram in a file (or one of its directories).'''
+    f = ROOT.TFile.Open(filename)
+    d = f.Get(dirname) if dirname != None else f
+    out = dict([(k.GetName(),k.ReadObj().Integral()) for k in d.GetListOfKeys()])
+    f.Close()
+    return out
+
+if __name__ == "__main__":
+    parser = ArgumentParser(description='Benchmark MergeOutputs.py against serial hadd')
+    parser.add_argument('--files', type=int, dest='files', action='store', default=300,
+                        help='Number of input files. Defaults to 300')
+    parser.add_argument('--hists', type=int, dest='hists', action='store', default=20,
+                        help='Number of histograms per file. Defaults to 20')
+    parser.add_argument('--jobs', type=int, nargs='+', dest='jobs', action='store', default=[4,8],
+                        help='Numbers of worker processes of MergeOutputs. Defaults to 4 8')
+    args = parser.parse_args()
+
+    MakeInputs(args.files,args.hists)
+    inputs = glob.glob(datadir+'*_selection_*.root')
+
+    start = time.time()
+    for setname in setnames:
+        subprocess.check_call(['hadd','-f',os.path.join(datadir,'hadd_%s.root'%setname)]+
+                              [f for f in inputs if os.path.basename(f).startswith(setname+'_16_')],
+                              stdout=open(os.devnull,'w'))
+    hadd_time = time.time()-start
+    print ('serial hadd:          %6.2f s'%hadd_time)
+
+    for jobs in args.jobs:
+        start = time.time()
+        MergeOutputs.Merge(inputs,outdir=datadir,jobs=jobs)
+        merge_time = time.time()-start
+        print ('MergeOutputs -j %-4s %6.2f s  (%.1fx hadd)'%(jobs,merge_time,hadd_time/merge_time))
+
+    for setname in setnames:
+        if Integrals(os.path.join(datadir,'hadd_%s.root'%setname)) != Integrals(os.path.join(datadir,'merged_16_selection.root'),setname):
+            print ('ERROR: MergeOutputs and hadd differ for %s'%setname)
+            sys.exit(1)
+    print ('MergeOutputs and hadd agree')
+    shutil.rmtree(datadir)
@@ -0,0 +1,251 @@
+''' Benchmark of the full selection pipelines (bs_select.py, exercises/selection.py
+    and exercises/nminus1.py) on synthetic NanoAOD-like inputs.
+
+    The inputs are generated locally (no network access needed) with the FatJet,
+    SubJet, Jet, Flag and HLT branches read by the scripts and written to
+    `benchmarks/data/`. Every (pipeline, size, threads) point runs in its own
+    process and the results are written to a JSON file with, for each point,
+    - startup: seconds from launching the process to the start of the selection
+      (imports and C++ compilation),
+    - runtime: seconds spent in the selection itself (JIT and event loop),
+    - throughput: input events per second of runtime,
+    - max_rss_mb: peak resident memory of the process.
+
+    Run from the top of the repository:
+    ```
+    python benchmarks/pipeline_bench.py --sizes 10000 100000 --threads 1 4
+    ```
+'''
+import os, sys, json, time, subprocess, platform, resource, multiprocessing
+from argparse import ArgumentParser, SUPPRESS
+
+datadir = 'benchmarks/data/'
+setname = 'benchmark' # outputs are written as rootfiles/benchmark_<year>_*.root so real outputs are never overwritten
+pipelines = ['bs_select','selection','nminus1']
+
+generator_code = '''
+#include <random>
+#include "ROOT/RVec.hxx"
+namespace bstar_bench {
+using ROOT::VecOps::RVec;
+
+struct Event {
+    RVec<float> FatJet_pt, FatJet_eta, FatJet_phi, FatJet_mass, FatJet_msoftdrop,
+                FatJet_tau1, FatJet_tau2, FatJet_tau3,
+                FatJet_deepTag_TvsQCD, FatJet_deepTag_WvsQCD, FatJet_deepTagMD_TvsQCD, FatJet_deepTagMD_WvsQCD;
+    RVec<int> FatJet_jetId, FatJet_subJetIdx1, FatJet_subJetIdx2;
+    RVec<float> SubJet_pt, SubJet_btagDeepB;
+    RVec<float> Jet_pt, Jet_eta, Jet_phi, Jet_btagDeepB;
+    bool flags, trigger;
+};
+
+// Every event has its own generator seeded from the entry number so that the
+// content does not depend on the number of threads used to write it.
+Event Generate(unsigned long long entry, unsigned int seed) {
+    std::mt19937 gen(seed*1000003ULL + entry);
+    std::uniform_real_distribution<float> uni(0.,1.);
+    std::exponential_distribution<float> falling(1./250.);
+    std::poisson_distribution<int> nfat(2.0), njet(4.0);
+    Event e;
+    int nFat = 1 + nfat(gen);
+    for (int i = 0; i < nFat; i++) {
+        float pt = 300.f + falling(gen);
+        float msd = 20.f + 230.f*uni(gen);
+        float tau1 = 0.1f + 0.4f*uni(gen);
+        float tau2 = tau1*(0.2f + 0.8f*uni(gen));
+        float tau3 = tau2*(0.3f + 0.7f*uni(gen));
+        e.FatJet_pt.push_back(pt);
+        e.FatJet_eta.push_back(-2.5f + 5.f*uni(gen));
+        e.FatJet_phi.push_back(-3.14159f + 6.28318f*uni(gen));
+        e.FatJet_msoftdrop.push_back(msd);
+        e.FatJet_mass.push_back(msd*(1.f + 0.2f*uni(gen)));
+        e.FatJet_tau1.push_back(tau1);
+        e.FatJet_tau2.push_back(tau2);
+        e.FatJet_tau3.push_back(tau3);
+        e.FatJet_deepTag_TvsQCD.push_back(uni(gen));
+        e.FatJet_deepTag_WvsQCD.push_back(uni(gen));
+        e.FatJet_deepTagMD_TvsQCD.push_back(uni(gen));
+        e.FatJet_deepTagMD_WvsQCD.push_back(uni(gen));
+        e.FatJet_jetId.push_back(uni(gen) < 0.9 ? 6 : 2*(int)(uni(gen) < 0.5));
+        e.FatJet_subJetIdx1.push_back(2*i);
+        e.FatJet_subJetIdx2.push_back(2*i+1);
+        for (int j = 0; j < 2; j++) {
+            e.SubJet_pt.push_back(pt*(0.2f + 0.6f*uni(gen)));
+            e.SubJet_btagDeepB.push_back(uni(gen));
+        }
+    }
+    int nJet = njet(gen);
+    for (int i = 0; i < nJet; i++) {
+        e.Jet_pt.push_back(30.f + falling(gen));
+        e.Jet_eta.push_back(-2.5f + 5.f*uni(gen));
+        e.Jet_phi.push_back(-3.14159f + 6.28318f*uni(gen));
+        e.Jet_btagDeepB.push_back(uni(gen));
+    }
+    e.flags = uni(gen) < 0.99;
+    e.trigger = uni(gen) < 0.8;
+    return e;
+}
+}
+'''
+
+flag_branches = ["Flag_goodVertices","Flag_globalSuperTightHalo2016Filter","Flag_HBHENoiseFilter",
+                 "Flag_HBHENoiseIsoFilter","Flag_EcalDeadCellTriggerPrimitiveFilter","Flag_BadPFMuonFilter",
+                 "Flag_ecalBadCalibReducedMINIAODFilter"]
+hlt_branches = ["HLT_PFHT800","HLT_PFHT900","HLT_PFJet450","HLT_PFHT1050","HLT_PFJet500",
+                "HLT_AK8PFJet380_TrimMass30","HLT_AK8PFJet400_TrimMass30"]
+
+def InputPath(nevents,year):
+    '''Path of the synthetic input with `nevents` events.'''
+    return os.path.join(datadir,str(nevents),'%s_bstar%s.root'%(setname,year))
+
+def MakeSyntheticNanoAOD(filename,nevents,seed=12345):
+    '''Writes a synthetic NanoAOD-like file with `Events` and `Runs` trees.
+       The `Runs` tree has no genEventCount so the scripts treat the file as data (norm = 1).
+
+    Args:
+        filename (str): Output file.
+        nevents (int): Number of events.
+        seed (int, optional): Random seed. Defaults to 12345.
+    '''
+    import ROOT
+    ROOT.gInterpreter.Declare(generator_code)
+    if not os.path.exists(os.path.dirname(filename)):
+        os.makedirs(os.path.dirname(filename))
+
+    df = ROOT.RDataFrame(nevents).Define('evt','bstar_bench::Generate(rdfentry_,%s)'%seed)
+    columns = ['run','luminosityBlock','event','nFatJet','nSubJet','nJet']
+    df = df.Define('run','1u').Define('luminosityBlock','1u').Define('event','(ULong64_t)rdfentry_')
+    df = df.Define('nFatJet','(UInt_t)evt.FatJet_pt.size()').Define('nSubJet','(UInt_t)evt.SubJet_pt.size()').Define('nJet','(UInt_t)evt.Jet_pt.size()')
+    for branch in ['FatJet_pt','FatJet_eta','FatJet_phi','FatJet_mass','FatJet_msoftdrop','FatJet_tau1','FatJet_tau2','FatJet_tau3',
+                   'FatJet_deepTag_TvsQCD','FatJet_deepTag_WvsQCD','FatJet_deepTagMD_TvsQCD','FatJet_deepTagMD_WvsQCD',
+                   'FatJet_jetId','FatJet_subJetIdx1','FatJet_subJetIdx2','SubJet_pt','SubJet_btagDeepB',
+                   'Jet_pt','Jet_eta','Jet_phi','Jet_btagDeepB']:
+        df = df.Define(branch,'evt.%s'%branch)
+        columns.append(branch)
+    for branch in flag_branches:
+        df = df.Define(branch,'evt.flags')
+        columns.append(branch)
+    for branch in hlt_branches:
+        df = df.Define(branch,'evt.trigger')
+        columns.append(branch)
+
+    column_vec = ROOT.std.vector('string')()
+    for c in columns: column_vec.push_back(c)
+    df.Snapshot('Events',filename,column_vec)
+
+    opts = ROOT.RDF.RSnapshotOptions()
+    opts.fMode = 'UPDATE'
+    ROOT.RDataFrame(1).Define('run','1u').Snapshot('Runs',filename,'run',opts)
+
+def RunWorker(pipeline,nevents,year,threads,launched):
+    '''Runs one pipeline in this process and prints the measurements as JSON.
+
+    Args:
+        pipeline (str): One of bs_select, selection, nminus1.
+        nevents (int): Size of the input.
+        year (str): Year of the input.
+        threads (int): Implicit-MT threads.
+        launched (float): time.time() when the parent launched this process.
+    '''
+    sys.path.append('./')
+    sys.path.append('exercises/')
+    inputfile = InputPath(nevents,year)
+    if pipeline == 'bs_select':
+        # bs_select.py parses the command line and compiles its C++ code when it is imported
+        sys.argv = ['bs_select.py','-i',inputfile,'-y',year,'-t',str(threads)]
+        import bs_select
+        run = lambda: bs_select.run(bs_select.args)
+    else:
+        from TIMBER.Tools.Common import CompileCpp
+        from CppCache import CompileCppCached
+        module = __import__(pipeline)
+        module.redirector, module.rootfile_path = '', os.path.dirname(inputfile)
+        CompileCpp("TIMBER/Framework/include/common.h")
+        CompileCppCached('bstar.cc')
+        function = module.select if pipeline == 'selection' else module.nminus1
+        run = lambda: function(setname, year, threads=threads)
+
+    if not os.path.exists('rootfiles/'):
+        os.makedirs('rootfiles/')
+    ready = time.time()
+    run()
+    done = time.time()
+    import ROOT
+    result = {'startup':ready-launched, 'runtime':done-ready, 'throughput':nevents/(done-ready),
+              'max_rss_mb':resource.getrusage(resource.RUSAGE_SELF).ru_maxrss/1024.,
+              # ThreadPolicy caps the threads at the number of clusters in the input
+              'effective_threads':1}
+    if ROOT.ROOT.IsImplicitMTEnabled():
+        result['effective_threads'] = ROOT.ROOT.GetThreadPoolSize() if hasattr(ROOT.ROOT,'GetThreadPoolSize') else ROOT.ROOT.GetImplicitMTPoolSize()
+    print ('BENCHMARK_RESULT %s'%json.dumps(result))
+
+def Cleanup(year):
+    '''Removes the outputs the pipelines wrote for the synthetic set.'''
+    for f in ['Presel_%s_bstar%s.root'%(setname,year),
+              'rootfiles/%s_%s_selection.root'%(setname,year), 'rootfiles/%s_%s_Nminus1.root'%(setname,year),
+              'plots/%s_%s_selection_tree.dot'%(setname,year), 'plots/%s_%s_nminus1_tree.dot'%(setname,year)]:
+        if os.path.exists(f): os.remove(f)
+
+if __name__ == "__main__":
+    parser = ArgumentParser(description='Benchmark the selection pipelines on synthetic NanoAOD')
+    parser.add_argument('--pipelines', type=str, nargs='+', dest='pipelines', action='store', default=pipelines,
+                        choices=pipelines, help='Pipelines to run. Defaults to all')
+    parser.add_argument('--sizes', type=int, nargs='+', dest='sizes', action='store', default=[10000,100000],
+                        help='Numbers of events to run on. Defaults to 10000 100000')
+    parser.add_argument('--threads', type=int, nargs='+', dest='threads', action='store', default=[1,4],
+                        help='Implicit-MT thread counts. Defaults to 1 4')
+    parser.add_argument('-y', type=str, dest='year', action='store', default='16',
+                        help='Year (selects the triggers and cuts). Defaults to 16')
+    parser.add_argument('--seed', type=int, dest='seed', action='store', default=12345,
+                        help='Random seed of the synthetic inputs. Defaults to 12345')
+    parser.add_argument('--regenerate', action='store_true',
+                        help='Regenerate the synthetic inputs even if they exist')
+    parser.add_argument('-o', '--output', type=str, dest='output', action='store', default=None,
+                        help='Results file. Defaults to benchmarks/results/pipeline_<date>.json')
+    parser.add_argument('--worker', type=str, nargs=5, dest='worker', action='store', default=None,
+                        help=SUPPRESS) # internal: run one point (pipeline nevents year threads launched)
+    args = parser.parse_args()
+
+    if args.worker != None:
+        pipeline, nevents, year, threads, launched = args.worker
+        RunWorker(pipeline,int(nevents),year,int(threads),float(launched))
+        sys.exit(0)
+
+    for nevents in args.sizes:
+        if args.regenerate or not os.path.exists(InputPath(nevents,args.year)):
+            start = time.time()
+            MakeSyntheticNanoAOD(InputPath(nevents,args.year),nevents,args.seed)
+            print ('Generated %s events in %.1f s'%(nevents,time.time()-start))
+
+    import ROOT
+    results = {'host':platform.node(), 'cpus':multiprocessing.cpu_count(),
+               'python':platform.python_version(), 'root':ROOT.gROOT.GetVersion(),
+               'commit':subprocess.check_output(['git','rev-parse','HEAD']).decode().strip(),
+               'date':time.strftime('%Y-%m-%d %H:%M:%S'), 'year':args.year, 'seed':args.seed, 'points':[]}
+    # Never copy the synthetic inputs into the file cache (see FileCache.py)
+    env = dict(os.environ, BSTAR_CACHE_DIR=os.path.join(datadir,'nocache/'))
+    for pipeline in args.pipelines:
+        for nevents in args.sizes:
+            for threads in args.threads:
+                launched = time.time()
+                proc = subprocess.Popen([sys.executable,os.path.abspath(__file__),'--worker',pipeline,str(nevents),args.year,str(threads),repr(launched)],
+                                        stdout=subprocess.PIPE, stderr=subprocess.STDOUT, env=env)
+                out = proc.communicate()[0].decode()
+                point = {'pipeline':pipeline, 'events':nevents, 'threads':threads, 'wall':time.time()-launched}
+                lines = [l for l in out.splitlines() if l.startswith('BENCHMARK_RESULT ')]
+                if proc.returncode == 0 and len(lines) > 0:
+                    point.update(json.loads(lines[-1][len('BENCHMARK_RESULT '):]))
+                    print ('%-10s %8s events %3s threads: %10.0f evt/s  startup %6.1f s  runtime %7.1f s  RSS %7.0f MB'%(
+                        pipeline,nevents,threads,point['throughput'],point['startup'],point['runtime'],point['max_rss_mb']))
+                else:
+                    point['error'] = out[-2000:]
+                    print ('%-10s %8s events %3s threads: FAILED\n%s'%(pipeline,nevents,threads,point['error']))
+                results['points'].append(point)
+                Cleanup(args.year)
+
+    output = args.output if args.output != None else 'benchmarks/results/pipeline_%s.json'%time.strftime('%Y%m%d_%H%M%S')
+    if not os.path.exists(os.path.dirname(output)):
+        os.makedirs(os.path.dirname(output))
+    with open(output,'w') as f:
+        json.dump(results,f,indent=2)
+    print ('Results written to %s'%output)
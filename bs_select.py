@@ -20,9 +20,13 @@ import sys
 from TIMBER.Analyzer import *
 from TIMBER.Tools.Common import *
 import helpers
+from CppCache import CompileCppCached
+from FileCache import CachedPath
+import ThreadPolicy, Cutflow, Systematics, SignalTemplates
 # Other
 import argparse
 import time, sys
+from collections import OrderedDict
 sys.path.append('../TIMBER/')
 
 parser = argparse.ArgumentParser()
@@ -31,16 +35,16 @@ parser.add_argument('-i', '--input', type=str, action='store', default='', dest=
 parser.add_argument('-y', '--year',  type=str, action='store', default='', dest='year', help='Year')
 parser.add_argument('-c', '--config', type=str, action='store', default='bstar_config.json', dest='config', help='Configuration file in json format with xsecs, cuts, etc that is interpreted as a python dictionary') 
 parser.add_argument('--deep', default=False, action='store_true',help='DeepAK8 selection')
+parser.add_argument('-a', '--args', type=str, action='store', default='', dest='argsfile', help='Text file with one set of arguments per line (ex. `-i <file> -y 16`). All inputs are run in this one process, reusing the compiled code and config.')
+parser.add_argument('--cutflow', default=False, action='store_true',help='Write the number of events after every cut to the output and to Presel_<name>_cutflow.json/.txt')
+parser.add_argument('--templates', default=False, action='store_true',help='Run the signal inputs of the year (-y) from -a or -i together in this process and write their MtwvMtPass/Fail to templates_<year>.root')
+parser.add_argument('--syst', default=False, action='store_true',help='Also book MtwvMtPass/Fail for the JES, JER, JMS and JMR up/down variations (MC only). The nominal then uses the corrected pt and mass too')
+ThreadPolicy.AddThreadsArgument(parser)
 args = parser.parse_args()
 
 ###########################################
 # Set some global variables for later use #
 ###########################################
-# Deduce set name from input file
-setname = args.input.replace('.root','').split('/')[-1]
-outputname = setname
-setname = '_'.join(setname.split('_')[:-1])
-
 # Flags - https://twiki.cern.ch/twiki/bin/view/CMS/MissingETOptionalFiltersRun2
 flags = ["Flag_goodVertices",
         "Flag_globalSuperTightHalo2016Filter", 
@@ -51,43 +55,21 @@ flags = ["Flag_goodVertices",
         "Flag_ecalBadCalibReducedMINIAODFilter", 
     ]
 
-# Triggers
-if args.year == '16': 
-    triggers = ["HLT_PFHT800","HLT_PFHT900","HLT_PFJet450"]
-else: 
-    triggers = ["HLT_PFHT1050","HLT_PFJet500","HLT_AK8PFJet380_TrimMass30","HLT_AK8PFJet400_TrimMass30"]
-
 # Compile some C++ modules for use
 CompileCpp("TIMBER/Framework/include/common.h")
-CompileCpp('bstar.cc') # custom .cc script
-
-###########################
-# Run analyzer on file(s) #
-###########################
-def run(args):
-    ROOT.ROOT.EnableImplicitMT(4)
-    a = analyzer(args.input)
-
-    # Config loading - will have cuts, xsec, and lumi
-    config = OpenJSON(args.config)
-    cuts = config['CUTS'][args.year]
-
-    # Determine normalization weight
-    if not a.isData: 
-        norm = helpers.getNormFactor(setname,args.year,args.config)
-    else: 
-        norm = 1.
+CompileCppCached('bstar.cc') # custom .cc script
 
-    # Initial cuts
-    a.Cut('filters',a.GetFlagString(flags))
-    a.Cut('trigger',a.GetTriggerString(triggers))
-    a.Define('jetIdx','hemispherize(FatJet_phi, FatJet_jetId)') # need to calculate if we have two jets (with Id) that are back-to-back
-    a.Cut('nFatJets_cut','nFatJet > max(jetIdx[0], jetIdx[1])') # If we don't do this, we may try to access variables of jets that don't exist! (leads to seg fault)
-    a.Cut("hemis","(jetIdx[0] != -1)&&(jetIdx[1] != -1)") # cut on that calculation
-
-    # Kinematics
-    a.Cut("pt_cut","FatJet_pt[jetIdx[0]] > 400 && FatJet_pt[jetIdx[1]] > 400")
-    a.Cut("eta_cut","abs(FatJet_eta[jetIdx[0]]) < 2.4 && abs(FatJet_eta[jetIdx[1]]) < 2.4")
+##################################################
+# Build the tagging groups once per year/setting #
+##################################################
+# The VarGroups and CutGroups only depend on the year (through the cuts) and on --deep
+# so they are stored here and re-applied to every input's analyzer when running
+# several inputs in one process (see -a option above)
+tagging_groups = {}
+def BuildTaggingGroups(year,cuts,deep):
+    key = (year,deep)
+    if key in tagging_groups:
+        return tagging_groups[key]
 
     #################################
     # Build some variables for jets #
@@ -95,7 +77,7 @@ def run(args):
     # Wtagging decision logic
     # This statement returns 0 for no tag, 1 for lead tag, 2 for sublead tag, and 3 for both tag (which is equivalent to 2 for the sake of deciding what is the W)
     wtag_str = "1*Wtag(FatJet_tau2[jetIdx[0]]/FatJet_tau1[jetIdx[0]],0,{0}, FatJet_msoftdrop[jetIdx[0]],65,105) + 2*Wtag(FatJet_tau2[jetIdx[1]]/FatJet_tau1[jetIdx[1]],0,{0}, FatJet_msoftdrop[jetIdx[1]],65,105)".format(cuts['tau21'])
-    if args.deep:
+    if deep:
         wtag_str = "1*WtagDeepAK8(FatJet_deepTagMD_WvsQCD[jetIdx[0]],{0},1, FatJet_msoftdrop[jetIdx[0]],65,105) + 2*WtagDeepAK8(FatJet_deepTagMD_WvsQCD[jetIdx[1]],{0},1, FatJet_msoftdrop[jetIdx[1]],65,105)".format(cuts['deepAK8w'])
 
     jets = VarGroup('jets')
@@ -120,7 +102,7 @@ def run(args):
     tagging_vars.Add("deepAK8_MD_WvsQCD", "w_index > -1 ? FatJet_deepTagMD_WvsQCD[w_index] : -1")
 
     toptag_str = "TopTag(tau32,0,{0}, subjet_btag,{1},1, mtop,50,1000)==1".format(cuts['tau32'],cuts['sjbtag'])
-    if args.deep:
+    if deep:
         toptag_str = "TopTagDeepAK8(deepAK8_MD_TvsQCD,{0},1, mtop,50,1000)==1".format(cuts['deepAK8top']) 
     tagging_vars.Add("wtag",'wtag_bit>0')
     tagging_vars.Add("top_tag",toptag_str)
@@ -131,25 +113,172 @@ def run(args):
     jet_sel.Add("mtw_cut","mtw>1000.")
     jet_sel.Add('deltaY_cut','abs(deltaY)<1.6')
 
-    #########
-    # Apply #
-    #########
-    a.Apply([jets,tagging_vars,jet_sel])
-    a.Define('norm',str(norm))
+    tagging_groups[key] = [jets,tagging_vars,jet_sel]
+    return tagging_groups[key]
 
-    # Finally discriminate on top tag
-    final = a.Discriminate("top_tag_cut","top_tag==1")
+###################################################
+# Book the selection and the Pass/Fail histograms #
+###################################################
+def BookPresel(final,suffix,mtop,mtw):
+    '''Books the MtwvMtPass/Fail histograms of one sample.'''
+    return [final["pass"].DataFrame.Histo2D(('MtwvMtPass'+suffix,'MtwvMtPass'+suffix,60, 50, 350, 70, 500, 4000),mtop,mtw,'norm'),
+            final["fail"].DataFrame.Histo2D(('MtwvMtFail'+suffix,'MtwvMtFail'+suffix,60, 50, 350, 70, 500, 4000),mtop,mtw,'norm')]
+
+def Select(a,args,cuts,norm,book):
+    '''Books the selection on the analyzer and the histograms of the top tag pass and fail regions.
+
+    Args:
+        a (analyzer): TIMBER analyzer on the input.
+        args (Namespace): Options of the script (year, deep, syst).
+        cuts (dict): Cuts of the year from the config.
+        norm (str): Expression of the `norm` weight column.
+        book (function): Called with the Discriminate() result, the suffix of the histogram names
+            and the top and mtw mass columns. Returns the list of booked histograms.
+
+    Returns:
+        tuple: Nominal Discriminate() result and the list of all booked histograms.
+    '''
+    # Triggers
+    if args.year == '16': 
+        triggers = ["HLT_PFHT800","HLT_PFHT900","HLT_PFJet450"]
+    else: 
+        triggers = ["HLT_PFHT1050","HLT_PFJet500","HLT_AK8PFJet380_TrimMass30","HLT_AK8PFJet400_TrimMass30"]
+
+    # Initial cuts
+    a.Cut('filters',a.GetFlagString(flags))
+    a.Cut('trigger',a.GetTriggerString(triggers))
+    a.Define('jetIdx','hemispherize(FatJet_phi, FatJet_jetId)') # need to calculate if we have two jets (with Id) that are back-to-back
+    a.Cut('nFatJets_cut','nFatJet > max(jetIdx[0], jetIdx[1])') # If we don't do this, we may try to access variables of jets that don't exist! (leads to seg fault)
+    a.Cut("hemis","(jetIdx[0] != -1)&&(jetIdx[1] != -1)") # cut on that calculation
+
+    if not args.syst:
+        # Kinematics
+        a.Cut("pt_cut","FatJet_pt[jetIdx[0]] > 400 && FatJet_pt[jetIdx[1]] > 400")
+        a.Cut("eta_cut","abs(FatJet_eta[jetIdx[0]]) < 2.4 && abs(FatJet_eta[jetIdx[1]]) < 2.4")
+
+        #########
+        # Apply #
+        #########
+        a.Apply(BuildTaggingGroups(args.year,cuts,args.deep))
+        a.Define('norm',norm)
+
+        # Finally discriminate on top tag
+        final = a.Discriminate("top_tag_cut","top_tag==1")
+        hists = book(final,'','mtop','mtw')
+    else:
+        # Everything from here depends on the jet pt and mass so it is booked on its own
+        # branch for every JES/JER/JMS/JMR variation. The cuts above and the eta cut do not, so they are done once (see Systematics.py)
+        a.Cut("eta_cut","abs(FatJet_eta[jetIdx[0]]) < 2.4 && abs(FatJet_eta[jetIdx[1]]) < 2.4")
+        a.Define('norm',norm)
+        variations = Systematics.AvailableVariations(a.GetActiveNode(), Systematics.Variations() if not a.isData else ['nominal'])
+        renames = Systematics.DefineVariations(a, variations)
+        def BookVariation(variation):
+            a.Cut("pt_cut_"+variation,Systematics.Rename("FatJet_pt[jetIdx[0]] > 400 && FatJet_pt[jetIdx[1]] > 400",renames[variation]))
+            a.Apply(Systematics.RenameGroups(BuildTaggingGroups(args.year,cuts,args.deep),variation,renames[variation]))
+            final = a.Discriminate("top_tag_cut_"+variation,"top_tag_%s==1"%variation)
+            return final, book(final,'' if variation == 'nominal' else '_'+variation,'mtop_'+variation,'mtw_'+variation)
+        booked = Systematics.ForEachVariation(a, variations, BookVariation)
+        final = booked['nominal'][0]
+        hists = [h for variation in booked.keys() for h in booked[variation][1]]
+
+    return final, hists
+
+###########################
+# Run analyzer on file(s) #
+###########################
+def run(args,config=None):
+    # Deduce set name from input file
+    setname = args.input.replace('.root','').split('/')[-1]
+    outputname = setname
+    setname = '_'.join(setname.split('_')[:-1])
+
+    input_path = CachedPath(args.input)
+    ThreadPolicy.EnableMT(args.threads, input_path, setname)
+    a = analyzer(input_path)
+
+    # Config loading - will have cuts, xsec, and lumi
+    # (can be passed in already opened when running over several inputs)
+    if config == None:
+        config = OpenJSON(args.config)
+    cuts = config['CUTS'][args.year]
+
+    # Determine normalization weight
+    if not a.isData: 
+        norm = helpers.getNormFactor(setname,args.year,config)
+    else: 
+        norm = 1.
+
+    # Selection
+    final, hists = Select(a,args,cuts,str(norm),BookPresel)
 
     outfile = ROOT.TFile.Open('Presel_%s.root'%(outputname),'RECREATE')
-    hpass = final["pass"].DataFrame.Histo2D(('MtwvMtPass','MtwvMtPass',60, 50, 350, 70, 500, 4000),'mtop','mtw','norm')
-    hfail = final["fail"].DataFrame.Histo2D(('MtwvMtFail','MtwvMtFail',60, 50, 350, 70, 500, 4000),'mtop','mtw','norm')
+    if args.cutflow:
+        cutflow = Cutflow.Cutflow(final["pass"], setname, args.year, norm) # booked here so it is counted in the same event loop
     outfile.cd()
-    hpass.Write()
-    hfail.Write()
+    for h in hists:
+        h.Write()
+    if args.cutflow:
+        cutflow.Write()
+        cutflow.Save('Presel_%s_cutflow'%(outputname))
     outfile.Close()
+    a.Close()
+
+##############################################
+# Run analyzer on the whole signal mass grid #
+##############################################
+def run_templates(args,inputs,config=None):
+    if config == None:
+        config = OpenJSON(args.config)
+    cuts = config['CUTS'][args.year]
+
+    # The signal inputs of the year grouped by setname (deduced from the file names as in run())
+    files = OrderedDict([(setname,[]) for setname in SignalTemplates.SignalSets(config,args.year)])
+    for input_file in inputs:
+        setname = '_'.join(input_file.replace('.root','').split('/')[-1].split('_')[:-1])
+        if setname in files:
+            files[setname].append(CachedPath(input_file))
+    files = OrderedDict([(setname,setfiles) for setname,setfiles in files.items() if len(setfiles) > 0])
+    if len(files) == 0:
+        raise ValueError('No signal input for year %s'%args.year)
+    # Several inputs so the number of threads is not capped by the clusters of one of them
+    ThreadPolicy.EnableMT(args.threads, None, 'signal_{}'.format(args.year))
+
+    # One analyzer (and norm) per sample, all booked before their event loops run together
+    analyzers, results = [], OrderedDict()
+    for setname,setfiles in files.items():
+        a = analyzer(setfiles)
+        norm = helpers.getNormFactor(setname,args.year,config)
+        final, results[setname] = Select(a,args,cuts,str(norm),BookPresel)
+        analyzers.append(a)
+    SignalTemplates.RunAll(results)
+
+    SignalTemplates.WriteTemplates('templates_%s.root'%(args.year),results)
+    for a in analyzers:
+        a.Close()
 
 if __name__ == "__main__":
     start_time = time.time()
-    run(args)
+    if args.templates:
+        if args.year == '' or args.cutflow:
+            parser.error('--templates needs -y and does not make cutflows')
+        if args.argsfile != '':
+            inputs = [input_args.input for input_args in helpers.ReadArgsFile(args.argsfile,parser) if input_args.year == args.year]
+        elif args.input.endswith('.txt'):
+            inputs = [line.strip() for line in open(args.input) if line.strip() != '']
+        else:
+            inputs = [args.input]
+        run_templates(args,inputs)
+    elif args.argsfile != '':
+        config = OpenJSON(args.config)
+        defaults = argparse.Namespace(**vars(args))
+        defaults.argsfile = ''
+        ThreadPolicy.EnableMT(args.threads, None, args.argsfile) # for all the inputs, not capped by the first one
+        for input_args in helpers.ReadArgsFile(args.argsfile,parser,defaults):
+            input_start = time.time()
+            print ('Running %s'%input_args.input)
+            run(input_args,config)
+            print ("%s time: "%input_args.input+str((time.time()-input_start)/60.) + ' min')
+    else:
+        run(args)
 
     print ("Total time: "+str((time.time()-start_time)/60.) + ' min')
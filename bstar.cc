@@ -2,67 +2,125 @@
 
 #include <cmath>
 #include <tuple>
+#include <numeric>
+#include <algorithm>
 #include "ROOT/RVec.hxx"
+#include "Math/Vector4D.h"
+
+using namespace ROOT::VecOps;
 
 //using namespace analyzer;
 //namespace analyzer {
 /**
-    Checks for jets in opposite hemispheres (of phi) that also pass a jetId. 
-    Can optionally provide an index that reorders the jets if jet energy
-    corrections have altered the pt ordering.
+    Finds the first jet (passing jetId) in the hemisphere of the leading jet
+    and the first one in the opposite hemisphere. Shared by hemispherize()
+    and DijetPreselection().
     @param jet_phi \f$\phi\f$ of each jet in the event.
     @param jet_jetId Jet ID of each jet in the event.
-    @param index Alternate indexing of the jets if they need to be re-ordered
+    @param index Alternate indexing of the jets. Empty to use [0,1,...n].
+    @param first Set to the jet index in the leading jet hemisphere.
+    @param second Set to the jet index in the opposite hemisphere.
+        Both are set to -1 if either hemisphere has no jet.
 */
-RVec<int> hemispherize(RVec<float> jet_phi, RVec<int> jet_jetId, RVec<int> index = {}) {
-    RVec<int> Jetsh0{};
-    RVec<int> Jetsh1{};
-    RVec<int> LoopIndex{}; /** Index that we actually want to loop over (ordered in real pt) */
-    int nFatJets, first, second;
-    std::vector<int> v(jet_phi.size());
-
-    // Determine if a custom index has been input
-    if (index.size() > 0) {
-        nFatJets = index.size(); // Set nFatJets if using custom index
-        LoopIndex = index; // Set loop index to custom
-    } else {
-        nFatJets = jet_phi.size(); // Set nFatJets if not using custom index
-        std::iota (std::begin(v), std::end(v), 0);
-        LoopIndex = v; // Set loop index to standard one [0,1,...n]
-    }
+void HemisphereIndices(const RVec<float>& jet_phi, const RVec<int>& jet_jetId, const RVec<int>& index, int& first, int& second) {
+    const bool useIndex = index.size() > 0; /** Loop over the custom index (ordered in real pt) if provided */
+    const int nFatJets = useIndex ? index.size() : jet_phi.size();
+    first = -1; second = -1;
+    if (nFatJets == 0) return;
 
-    int highestPtIdx;
+    const int highestPtIdx = useIndex ? index[0] : 0;
     int thisIdx;
-    for (int i = 0; i < nFatJets; ++i) {
-        highestPtIdx = LoopIndex[0];
-        thisIdx = LoopIndex[i];
-
-        if (abs(ROOT::VecOps::DeltaPhi(jet_phi[highestPtIdx],jet_phi[thisIdx])) > M_PI/2.0) {
-            if ( (jet_jetId[thisIdx] & 1) == 0 ){
-                if ( (jet_jetId[thisIdx] & 2) == 0 ) {                  
-                } else {
-                    Jetsh1.push_back(thisIdx);
-                }
-            } else {Jetsh1.push_back(thisIdx);}
+    for (int i = 0; (i < nFatJets) && ((first == -1) || (second == -1)); ++i) {
+        thisIdx = useIndex ? index[i] : i;
+        // Jet needs to pass either of the first two ID bits
+        if ((jet_jetId[thisIdx] & 3) == 0) continue;
 
+        if (std::abs(ROOT::VecOps::DeltaPhi(jet_phi[highestPtIdx],jet_phi[thisIdx])) > M_PI/2.0) {
+            if (second == -1) second = thisIdx;
         } else {
-            if ( (jet_jetId[thisIdx] & 1) == 0 ){
-                if ( (jet_jetId[thisIdx] & 2) == 0 ) {                  
-                } else {
-                    Jetsh0.push_back(thisIdx);
-                }
-            } else {Jetsh0.push_back(thisIdx);}
+            if (first == -1) first = thisIdx;
         }
     }
 
-    if ((Jetsh0.size() < 1) || (Jetsh1.size() < 1)) {
+    if ((first == -1) || (second == -1)) {
         first = -1; second = -1;
-    } else {
-        first = Jetsh0[0]; second = Jetsh1[0];
     }
-    
-    RVec<int> jets{first,second};
-    return jets;
+}
+
+/**
+    Checks for jets in opposite hemispheres (of phi) that also pass a jetId. 
+    Can optionally provide an index that reorders the jets if jet energy
+    corrections have altered the pt ordering.
+    Only the first passing jet of each hemisphere is needed so the scan stops
+    as soon as both are found and no intermediate vectors are built
+    (see HemisphereIndices()).
+    @param jet_phi \f$\phi\f$ of each jet in the event.
+    @param jet_jetId Jet ID of each jet in the event.
+    @param index Alternate indexing of the jets if they need to be re-ordered
+    @return Two element vector with the indices of the jet in the hemisphere of
+        the leading jet and of the jet in the opposite hemisphere ({-1,-1} if
+        either is missing).
+*/
+RVec<int> hemispherize(const RVec<float>& jet_phi, const RVec<int>& jet_jetId, const RVec<int>& index = {}) {
+    int first, second;
+    HemisphereIndices(jet_phi, jet_jetId, index, first, second);
+    return RVec<int>{first,second};
+}
+
+/** Compact result of DijetPreselection() */
+struct DijetSelection {
+    bool pass = false; /**< Event passes the full preselection */
+    int lead_idx = -1; /**< FatJet index of the jet in the leading jet hemisphere */
+    int sublead_idx = -1; /**< FatJet index of the jet in the opposite hemisphere */
+    float mtw = -1; /**< Invariant mass of the two jets (using softdrop masses) */
+    float deltaY = 0; /**< Rapidity difference, lead - sublead */
+    float lead_tau21 = -1, sublead_tau21 = -1; /**< \f$\tau_{2}/\tau_{1}\f$, -1 if \f$\tau_{1}\f$ is 0 */
+    float lead_tau32 = -1, sublead_tau32 = -1; /**< \f$\tau_{3}/\tau_{2}\f$, -1 if \f$\tau_{2}\f$ is 0 */
+};
+
+/**
+    Performs the full dijet preselection in one call instead of one RDataFrame
+    node per step: hemispherize(), the check that both jets exist and the pt and
+    |eta| cuts on both jets, plus the softdrop mass cut on both jets and the
+    dijet invariant mass cut when msdMin and mtwMin are given. Also computes
+    the invariant mass and the other variables needed right after the selection.
+    @param FatJet_pt, FatJet_eta, FatJet_phi, FatJet_msoftdrop FatJet kinematics.
+    @param FatJet_tau1, FatJet_tau2, FatJet_tau3 N-subjettiness values.
+    @param FatJet_jetId Jet ID of each jet.
+    @param ptMin Minimum pt of both jets.
+    @param etaMax Maximum |eta| of both jets.
+    @param msdMin Minimum softdrop mass of both jets. Negative (default) to skip the cut.
+    @param mtwMin Minimum dijet invariant mass. Negative (default) to skip the cut.
+    @return DijetSelection with the pass flag, the two jet indices and the derived variables.
+        Derived variables are only filled when both jets are found.
+*/
+DijetSelection DijetPreselection(const RVec<float>& FatJet_pt, const RVec<float>& FatJet_eta,
+                                 const RVec<float>& FatJet_phi, const RVec<float>& FatJet_msoftdrop,
+                                 const RVec<float>& FatJet_tau1, const RVec<float>& FatJet_tau2,
+                                 const RVec<float>& FatJet_tau3, const RVec<int>& FatJet_jetId,
+                                 float ptMin = 400, float etaMax = 2.4, float msdMin = -1, float mtwMin = -1) {
+    DijetSelection out;
+    int i0, i1;
+    HemisphereIndices(FatJet_phi, FatJet_jetId, RVec<int>{}, i0, i1);
+    if ((i0 == -1) || (i1 == -1)) return out;
+    if ((int)FatJet_pt.size() <= std::max(i0,i1)) return out;
+    out.lead_idx = i0;
+    out.sublead_idx = i1;
+
+    ROOT::Math::PtEtaPhiMVector lead_vect(FatJet_pt[i0], FatJet_eta[i0], FatJet_phi[i0], FatJet_msoftdrop[i0]);
+    ROOT::Math::PtEtaPhiMVector sublead_vect(FatJet_pt[i1], FatJet_eta[i1], FatJet_phi[i1], FatJet_msoftdrop[i1]);
+    out.mtw = (lead_vect+sublead_vect).M();
+    out.deltaY = lead_vect.Rapidity() - sublead_vect.Rapidity();
+    out.lead_tau21    = FatJet_tau1[i0] > 0 ? FatJet_tau2[i0]/FatJet_tau1[i0] : -1;
+    out.sublead_tau21 = FatJet_tau1[i1] > 0 ? FatJet_tau2[i1]/FatJet_tau1[i1] : -1;
+    out.lead_tau32    = FatJet_tau2[i0] > 0 ? FatJet_tau3[i0]/FatJet_tau2[i0] : -1;
+    out.sublead_tau32 = FatJet_tau2[i1] > 0 ? FatJet_tau3[i1]/FatJet_tau2[i1] : -1;
+
+    out.pass = (FatJet_pt[i0] > ptMin) && (FatJet_pt[i1] > ptMin) &&
+               (std::abs(FatJet_eta[i0]) < etaMax) && (std::abs(FatJet_eta[i1]) < etaMax) &&
+               ((msdMin < 0) || ((FatJet_msoftdrop[i0] > msdMin) && (FatJet_msoftdrop[i1] > msdMin))) &&
+               ((mtwMin < 0) || (out.mtw > mtwMin));
+    return out;
 }
 
 int Wtag(float tau21_val, float tau21_min, float tau21_max, float mass_val, float mass_min, float mass_max) {
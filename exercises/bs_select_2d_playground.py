@@ -21,6 +21,9 @@ from TIMBER.Analyzer import *
 from TIMBER.Tools.Common import *
 from TIMBER.Tools.Plot import *
 import helpers
+from CppCache import CompileCppCached
+from FileCache import CachedPath
+import ThreadPolicy
 # Other
 import argparse
 import time, sys
@@ -66,7 +69,7 @@ flags = ["Flag_goodVertices",
 
 # Compile some C++ modules for use
 CompileCpp("TIMBER/Framework/include/common.h")
-CompileCpp('bstar.cc') # custom .cc script
+CompileCppCached('bstar.cc') # custom .cc script
 
 varnames2d = {
         'softdrop_lead_sublead_mass_v_mass':['lead_softdrop_mass',"sublead_softdrop_mass"],
@@ -118,51 +121,86 @@ def run(args):
     else: 
         triggers = ["HLT_PFHT1050","HLT_PFJet500","HLT_AK8PFJet380_TrimMass30","HLT_AK8PFJet400_TrimMass30"]
 
-    ROOT.ROOT.EnableImplicitMT(4)
-    # a = analyzer(args.input)
-    file_path = '{redirector}{rootfile_path}/{setname}_bstar{year}.root'.format(
-    redirector=redirector, rootfile_path=rootfile_path, setname=setname, year=year
-    )
-    a = analyzer(file_path)
-
     # Config loading - will have cuts, xsec, and lumi
     config = OpenJSON(args.config)
     cuts = config['CUTS'][args.year]
 
-    # Determine normalization weight
-    if not a.isData: 
-        norm = helpers.getNormFactor(setname,args.year,args.config)
-    else: 
-        norm = 1.
-
-    # Initial cuts
-    a.Cut('filters',a.GetFlagString(flags))
-    a.Cut('trigger',a.GetTriggerString(triggers))
-    a.Define('jetIdx','hemispherize(FatJet_phi, FatJet_jetId)') # need to calculate if we have two jets (with Id) that are back-to-back
-    a.Cut('nFatJets_cut','nFatJet > max(jetIdx[0], jetIdx[1])') # If we don't do this, we may try to access variables of jets that don't exist! (leads to seg fault)
-    a.Cut("hemis","(jetIdx[0] != -1)&&(jetIdx[1] != -1)") # cut on that calculation
-
-    # Kinematics
-    a.Cut("pt_cut","FatJet_pt[jetIdx[0]] > 400 && FatJet_pt[jetIdx[1]] > 400")
-    a.Cut("eta_cut","abs(FatJet_eta[jetIdx[0]]) < 2.4 && abs(FatJet_eta[jetIdx[1]]) < 2.4")
-
-    #---#
-    a.SubCollection('Dijet', 'FatJet', 'jetIdx', useTake=True)
-    # We can now cut on the values of the Dijet collection and simply index 0 (lead) or 1 (sublead) to get the information about the appropriate jet
-    a.Cut('pt_cut',   'Dijet_pt[0] > 400 && Dijet_pt[1] > 400')
-    a.Cut('eta_cut',  'abs(Dijet_eta[0]) < 2.4 && abs(Dijet_eta[1]) < 2.4')
-    a.Cut('mjet_cut', 'Dijet_msoftdrop[0] > 50 && Dijet_msoftdrop[1] > 50')
-    a.Define('lead_vector',    'hardware::TLvector(Dijet_pt[0], Dijet_eta[0], Dijet_phi[0], Dijet_msoftdrop[0])')
-    a.Define('sublead_vector', 'hardware::TLvector(Dijet_pt[1], Dijet_eta[1], Dijet_phi[1], Dijet_msoftdrop[1])')
-    a.Define('invariantMass','hardware::InvariantMass({lead_vector,sublead_vector})')
-    a.Cut('mtw_cut','invariantMass > 1200')
+    if args.fromskim:
+        # The skim (see selection.py --skim) holds the events passing the pt and eta cuts with the Dijet_* columns, norm,
+        # invariantMass, nbjet_* and the decisions of the last two cuts of the preselection, which are made here
+        ThreadPolicy.EnableMT(args.threads, helpers.SkimPath(setname, year), '{}_{}'.format(setname, year))
+        a = analyzer(helpers.SkimPath(setname, year))
+        a.Cut('mjet_cut', 'mjet_pass')
+        a.Cut('mtw_cut',  'mtw_pass')
+    else:
+        # a = analyzer(args.input)
+        file_path = '{redirector}{rootfile_path}/{setname}_bstar{year}.root'.format(
+        redirector=redirector, rootfile_path=rootfile_path, setname=setname, year=year
+        )
+        file_path = CachedPath(file_path)
+        ThreadPolicy.EnableMT(args.threads, file_path, '{}_{}'.format(setname, year))
+        a = analyzer(file_path)
+
+        # Determine normalization weight
+        if not a.isData: 
+            norm = helpers.getNormFactor(setname,args.year,args.config)
+        else: 
+            norm = 1.
+
+        # Initial cuts
+        a.Cut('filters',a.GetFlagString(flags))
+        a.Cut('trigger',a.GetTriggerString(triggers))
+        if args.fused:
+            # One compiled function (DijetPreselection() in bstar.cc) replaces the hemisphere search, the cuts and the vectors below
+            # with one Define and one Cut, and stores the jet indices, invariant mass, deltaY and tau ratios in the `dijet` column.
+            # jetIdx and the Dijet_* collection (one Define per FatJet branch) are still built for the rest of the script
+            helpers.FusedDijetPreselection(a, ptcut=400, etacut=2.4, msdcut=50, mtwcut=1200)
+            a.Define('invariantMass','dijet.mtw')
+        else:
+            a.Define('jetIdx','hemispherize(FatJet_phi, FatJet_jetId)') # need to calculate if we have two jets (with Id) that are back-to-back
+            a.Cut('nFatJets_cut','nFatJet > max(jetIdx[0], jetIdx[1])') # If we don't do this, we may try to access variables of jets that don't exist! (leads to seg fault)
+            a.Cut("hemis","(jetIdx[0] != -1)&&(jetIdx[1] != -1)") # cut on that calculation
+
+            # Kinematics
+            a.Cut("pt_cut","FatJet_pt[jetIdx[0]] > 400 && FatJet_pt[jetIdx[1]] > 400")
+            a.Cut("eta_cut","abs(FatJet_eta[jetIdx[0]]) < 2.4 && abs(FatJet_eta[jetIdx[1]]) < 2.4")
+
+            #---#
+            a.SubCollection('Dijet', 'FatJet', 'jetIdx', useTake=True)
+            # We can now cut on the values of the Dijet collection and simply index 0 (lead) or 1 (sublead) to get the information about the appropriate jet
+            a.Cut('pt_cut',   'Dijet_pt[0] > 400 && Dijet_pt[1] > 400')
+            a.Cut('eta_cut',  'abs(Dijet_eta[0]) < 2.4 && abs(Dijet_eta[1]) < 2.4')
+            a.Cut('mjet_cut', 'Dijet_msoftdrop[0] > 50 && Dijet_msoftdrop[1] > 50')
+            a.Define('lead_vector',    'hardware::TLvector(Dijet_pt[0], Dijet_eta[0], Dijet_phi[0], Dijet_msoftdrop[0])')
+            a.Define('sublead_vector', 'hardware::TLvector(Dijet_pt[1], Dijet_eta[1], Dijet_phi[1], Dijet_msoftdrop[1])')
+            a.Define('invariantMass','hardware::InvariantMass({lead_vector,sublead_vector})')
+            a.Cut('mtw_cut','invariantMass > 1200')
+
+        # The b jet counting needs the full Jet collection so it is done before the skim
+        bcut = []
+        if args.year == '16' :
+            bcut = [0.2217,0.6321,0.8953]
+        elif args.year == '17' :
+            bcut = [0.1522,0.4941,0.8001]
+        elif args.year == '18' :
+            bcut = [0.1241,0.4184,0.7571]
+        a.Define('nbjet_loose',  'Sum(Jet_btagDeepB > '+str(bcut[0])+')') # DeepCSV loose WP
+        a.Define('nbjet_medium', 'Sum(Jet_btagDeepB > '+str(bcut[1])+')') # DeepCSV medium WP
+        a.Define('nbjet_tight',  'Sum(Jet_btagDeepB > '+str(bcut[2])+')') # DeepCSV tight WP
+        a.Define('norm',str(norm))
 
     # Now, we can define the variables we're interested in plotting (see varnames dictionary in global definitions above)
     a.Define('deltaphi','hardware::DeltaPhi(Dijet_phi[0], Dijet_phi[1])')
-    a.Define('lead_tau32',    'Dijet_tau2[0] > 0 ? Dijet_tau3[0]/Dijet_tau2[0] : -1') # Conditional to make sure tau2 != 0 for division
-    a.Define('sublead_tau32', 'Dijet_tau2[1] > 0 ? Dijet_tau3[1]/Dijet_tau2[1] : -1') # condition ? <do if true> : <do if false>
-    a.Define('lead_tau21',    'Dijet_tau1[0] > 0 ? Dijet_tau2[0]/Dijet_tau1[0] : -1') # Conditional to make sure tau2 != 0 for division
-    a.Define('sublead_tau21', 'Dijet_tau1[1] > 0 ? Dijet_tau2[1]/Dijet_tau1[1] : -1') # condition ? <do if true> : <do if false>
+    if args.fused and not args.fromskim:
+        a.Define('lead_tau32',    'dijet.lead_tau32')
+        a.Define('sublead_tau32', 'dijet.sublead_tau32')
+        a.Define('lead_tau21',    'dijet.lead_tau21')
+        a.Define('sublead_tau21', 'dijet.sublead_tau21')
+    else:
+        a.Define('lead_tau32',    'Dijet_tau2[0] > 0 ? Dijet_tau3[0]/Dijet_tau2[0] : -1') # Conditional to make sure tau2 != 0 for division
+        a.Define('sublead_tau32', 'Dijet_tau2[1] > 0 ? Dijet_tau3[1]/Dijet_tau2[1] : -1') # condition ? <do if true> : <do if false>
+        a.Define('lead_tau21',    'Dijet_tau1[0] > 0 ? Dijet_tau2[0]/Dijet_tau1[0] : -1') # Conditional to make sure tau2 != 0 for division
+        a.Define('sublead_tau21', 'Dijet_tau1[1] > 0 ? Dijet_tau2[1]/Dijet_tau1[1] : -1') # condition ? <do if true> : <do if false>
     a.Define('lead_deepAK8_TvsQCD',    'Dijet_deepTag_TvsQCD[0]')
     a.Define('sublead_deepAK8_TvsQCD', 'Dijet_deepTag_TvsQCD[1]')
     a.Define('lead_deepAK8_WvsQCD',    'Dijet_deepTag_WvsQCD[0]')
@@ -173,16 +211,6 @@ def run(args):
     a.Define('lead_deepAK8_WvsQCD_MD',    'Dijet_deepTagMD_WvsQCD[0]')
     a.Define('sublead_deepAK8_WvsQCD_MD', 'Dijet_deepTagMD_WvsQCD[1]')
 
-    bcut = []
-    if args.year == '16' :
-        bcut = [0.2217,0.6321,0.8953]
-    elif args.year == '17' :
-        bcut = [0.1522,0.4941,0.8001]
-    elif args.year == '18' :
-        bcut = [0.1241,0.4184,0.7571]
-    a.Define('nbjet_loose',  'Sum(Jet_btagDeepB > '+str(bcut[0])+')') # DeepCSV loose WP
-    a.Define('nbjet_medium', 'Sum(Jet_btagDeepB > '+str(bcut[1])+')') # DeepCSV medium WP
-    a.Define('nbjet_tight',  'Sum(Jet_btagDeepB > '+str(bcut[2])+')') # DeepCSV tight WP
     a.Define('lead_jetPt',   'Dijet_pt[0]')
     a.Define('sublead_jetPt','Dijet_pt[1]')
     a.Define('lead_softdrop_mass',   'Dijet_msoftdrop[0]')
@@ -237,7 +265,6 @@ def run(args):
     # Apply #
     #########
     # a.Apply([jets,tagging_vars,jet_sel])
-    a.Define('norm',str(norm))
 
     # Finally discriminate on top tag
     # final = a.Discriminate("top_tag_cut","top_tag==1")
@@ -260,47 +287,20 @@ def run(args):
     # )
 
     # Now we are ready to save histograms (in a HistGroup)
-    out = HistGroup("%s_%s"%(setname,year))
+    # (everything is booked first and filled together in a single event loop by out.Run())
+    out = helpers.LazyHistGroup("%s_%s"%(setname,year))
+    # Binning for every variable (and so every 2D pair) is stored in the BINNING section of the config
+    binning = helpers.GetBinningRegistry(args.config)
+    models1d = binning.Models1D(varnames1d.keys(), prefix='%s_%s_'%(setname,year))
+    models2d = binning.Models2D(varnames2d, prefix='%s_%s_'%(setname,year))
     for varname in varnames1d.keys():
         print('\t{}'.format(varname))
-        histname = '%s_%s_%s'%(setname,year,varname)
-        # Arguments for binning that you would normally pass to a TH1 (histname, histname, number of bins, min bin, max bin)
-        if "nbjet" in varname :
-            hist_tuple = (histname,histname, 10,0,10)
-        elif "tau" in varname :
-            hist_tuple = (histname,histname,20,0,1)
-        elif "Pt" in varname :
-            hist_tuple = (histname,histname,30,400,1000)
-        elif "phi" in varname :
-            hist_tuple = (histname,histname,30,-3.2,3.2)
-        elif "softdrop_mass" in varname :
-            hist_tuple = (histname,histname,30,0,300)
-        elif "invariantMass" in varname :
-            hist_tuple = (histname,histname,400,0,4000)
-        else:
-            hist_tuple = (histname,histname,20,0,1)
-        hist = a.GetActiveNode().DataFrame.Histo1D(hist_tuple,varname,'norm') # Project dataframe into a histogram (hist name/binning tuple, variable to plot from dataframe, weight)
-        hist.GetValue() # This gets the actual TH1 instead of a pointer to the TH1
-        out.Add(varname,hist) # Add it to our group
+        out.Book1D(varname,a.GetActiveNode(),models1d[varname],varname,'norm') # Book a projection of the dataframe into a histogram (binning model, variable to plot from dataframe, weight)
     for varname,varval in varnames2d.items():
         print('\t{}'.format(varname))
-        histname = '%s_%s_%s'%(setname,year,varname)
-        # Arguments for binning that you would normally pass to a TH1 (histname, histname, number of bins, min bin, max bin)
-        if "mass_v_score" in varname :
-            hist_tuple = (histname,histname, 30, 0, 300, 20, 0, 1)
-        elif "mass_v_t" in varname :
-            hist_tuple = (histname,histname, 30, 0, 300, 20, 0, 1)
-        elif "mass_v_mass" in varname :
-            hist_tuple = (histname,histname,30, 0, 300, 30, 0, 300)
-        else:
-            hist_tuple = (histname,histname,30, 0, 300, 30, 0, 300)
-        name1 = varval[0]
-        name2 = varval[1]
-        # print(hist_tuple, name1,name2,'norm')
-        # print("1","2","3","4")
-        hist = a.GetActiveNode().DataFrame.Histo2D(hist_tuple, name1,name2,'norm') # Project dataframe into a histogram (hist name/binning tuple, variable to plot from dataframe, weight)
-        hist.GetValue() # This gets the actual TH1 instead of a pointer to the TH1
-        out.Add(varname,hist) # Add it to our group
+        out.Book2D(varname,a.GetActiveNode(),models2d[varname],varval[0],varval[1],'norm') # Book a projection of the dataframe into a histogram (binning model, variables to plot from dataframe, weight)
+
+    out.Run() # This is when the event loop runs and fills every histogram booked above
 
     outFile.cd()
     out.Do('Write') # This will call TH1.Write() for all of the histograms in the group
@@ -323,6 +323,9 @@ if __name__ == "__main__":
     parser.add_argument('-y', '--year',   type=str, action='store', default='', dest='year', help='Year')
     parser.add_argument('-c', '--config', type=str, action='store', default='bstar_config.json', dest='config', help='Configuration file in json format with xsecs, cuts, etc that is interpreted as a python dictionary') 
     parser.add_argument('--deep', default=False, action='store_true',help='DeepAK8 selection')
+    parser.add_argument('--fused', default=False, action='store_true',help='Do the dijet preselection in one compiled function instead of the chain of cuts')
+    parser.add_argument('--fromSkim', default=False, action='store_true', dest='fromskim', help='Run on the skim written by selection.py --skim instead of the full file')
+    ThreadPolicy.AddThreadsArgument(parser)
     args = parser.parse_args()
 
     run(args)
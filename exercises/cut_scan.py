@@ -0,0 +1,356 @@
+''' Scan of the W and top tagging working points of the b*->tW selection
+    (`tau21`, `tau32` and `sjbtag`, or `deepAK8w` and `deepAK8top` with --deep,
+    which are fixed per year in bstar_config.json).
+
+    Every sample is read in one event loop after the preselection of bs_select.py
+    and the mtw and deltaY cuts. The tagging variables of both jets are converted
+    to the index of the tightest working point of the grid they pass and are
+    counted in NumPy histograms with one axis per variable, split by which
+    jet is the W (the sub-leading one if it is tagged, otherwise the leading one):
+    - A: (W tag of jet 1, top tag variables of jet 0)
+    - B: (W tag of jet 1, W tag of jet 0, top tag variables of jet 1)
+    Cumulative sums of those give the number of events passing every working point of
+    the grid at once, so thousands of working points are evaluated without another pass
+    over the data. The histograms are saved in `rootfiles/cutscan/<setname>_<year>_<mode>.npz`
+    and samples that were already filled are not read again (unless --refill).
+
+    The backgrounds and signals given with -s are combined into the expected S/sqrt(B)
+    (or the Asimov significance with --metric asimov) of each working point and each signal,
+    and the ranked working points are written to `rootfiles/cutscan_<year>_<mode>.txt/.json`.
+
+    Usage (from the top of the repository):
+    ```
+    python exercises/cut_scan.py -y 16 -s ttbar QCDHT700 QCDHT1000 QCDHT1500 QCDHT2000 singletop_tW singletop_tWB signalLH2000 signalLH3000
+    python exercises/cut_scan.py -y 16 -s ... --deep --metric asimov
+    ```
+'''
+import ROOT, sys, os, json, time
+sys.path.append('./')
+from collections import OrderedDict
+from argparse import ArgumentParser
+import numpy
+from TIMBER.Analyzer import analyzer
+from TIMBER.Tools.Common import CompileCpp, OpenJSON
+import helpers
+from CppCache import CompileCppCached
+from FileCache import CachedPath
+import ThreadPolicy
+ROOT.gROOT.SetBatch(True)
+
+redirector = 'root://cmsxrootd.fnal.gov/'
+rootfile_path = '/store/user/cmsdas/2021/long_exercises/BstarTW/rootfiles'
+scandir = 'rootfiles/cutscan/'
+
+# Flags - https://twiki.cern.ch/twiki/bin/view/CMS/MissingETOptionalFiltersRun2
+flags = ["Flag_goodVertices",
+        "Flag_globalSuperTightHalo2016Filter",
+        "Flag_HBHENoiseFilter",
+        "Flag_HBHENoiseIsoFilter",
+        "Flag_EcalDeadCellTriggerPrimitiveFilter",
+        "Flag_BadPFMuonFilter"
+        "Flag_ecalBadCalibReducedMINIAODFilter",
+    ]
+
+##########################################################################
+# Tagging variables: per-jet expression, cut direction and default grid  #
+##########################################################################
+# 'upper' cuts keep values below the working point, 'lower' cuts keep values above it.
+# The working points of the config are always added to the grids.
+variables = {
+    'tau21':      ('FatJet_tau2[{0}]/FatJet_tau1[{0}]', 'upper', numpy.arange(0.25,0.7001,0.025)),
+    'tau32':      ('FatJet_tau3[{0}]/FatJet_tau2[{0}]', 'upper', numpy.arange(0.45,0.8501,0.025)),
+    'sjbtag':     ('max(FatJet_subJetIdx1[{0}] >= 0 ? SubJet_btagDeepB[FatJet_subJetIdx1[{0}]] : -1.f, '
+                   'FatJet_subJetIdx2[{0}] >= 0 ? SubJet_btagDeepB[FatJet_subJetIdx2[{0}]] : -1.f)', 'lower', numpy.arange(0.05,0.8001,0.05)),
+    'deepAK8w':   ('FatJet_deepTagMD_WvsQCD[{0}]', 'lower', numpy.arange(0.5,0.9901,0.01)),
+    'deepAK8top': ('FatJet_deepTagMD_TvsQCD[{0}]', 'lower', numpy.arange(0.5,0.9901,0.01)),
+}
+# W tag variable and top tag variables of each mode (as in BuildTaggingGroups() of bs_select.py)
+modes = {
+    'tau':  ('tau21', ['tau32','sjbtag']),
+    'deep': ('deepAK8w', ['deepAK8top']),
+}
+# Softdrop mass windows of the W and top tags
+wmass = (65, 105)
+topmass = (50, 1000)
+
+def Grids(mode,cuts):
+    '''Working points of every variable of a mode, ordered from the tightest to the loosest.
+
+    Args:
+        mode (str): tau or deep.
+        cuts (dict): Cuts of the year in bstar_config.json (added to the grids).
+
+    Returns:
+        OrderedDict: {variable: numpy.ndarray}
+    '''
+    wvar, topvars = modes[mode]
+    grids = OrderedDict()
+    for var in [wvar]+topvars:
+        expression, direction, grid = variables[var]
+        grid = numpy.unique(numpy.round(numpy.append(grid,cuts[var]),4))
+        grids[var] = grid if direction == 'upper' else grid[::-1]
+    return grids
+
+def CutIndex(values,var,grid,valid=None):
+    '''Index of the tightest working point that each value passes,
+       len(grid) if it passes none.
+
+    Args:
+        values (numpy.ndarray): Values of the variable.
+        var (str): Name of the variable.
+        grid (numpy.ndarray): Working points from the tightest to the loosest.
+        valid (numpy.ndarray, optional): Values failing every working point when False. Defaults to None.
+
+    Returns:
+        numpy.ndarray: Indices.
+    '''
+    values = numpy.asarray(values,dtype=numpy.float64)
+    if variables[var][1] == 'upper':
+        index = numpy.searchsorted(grid,values,side='right')
+    else:
+        index = len(grid) - numpy.searchsorted(grid[::-1],values,side='left')
+    fails = numpy.isnan(values) if valid is None else (numpy.isnan(values) | ~numpy.asarray(valid,dtype=bool))
+    return numpy.where(fails,len(grid),index)
+
+def Histogram(indices,shape):
+    '''Counts of each combination of indices.
+
+    Args:
+        indices (list(numpy.ndarray)): One array of indices per axis.
+        shape (tuple): Number of bins of each axis.
+
+    Returns:
+        numpy.ndarray: Counts.
+    '''
+    if len(indices[0]) == 0: return numpy.zeros(shape)
+    flat = numpy.ravel_multi_index(indices,shape)
+    return numpy.bincount(flat,minlength=int(numpy.prod(shape))).reshape(shape).astype(numpy.float64)
+
+def ScanPath(setname,year,mode):
+    '''File with the scan histograms of a sample.'''
+    return os.path.join(scandir,'%s_%s_%s.npz'%(setname,year,mode))
+
+def Fill(setname,year,mode,config,threads=None):
+    '''Runs the event loop of one sample and saves its scan histograms.
+
+    Args:
+        setname (str): Name of the set.
+        year (str): 16, 17, 18.
+        mode (str): tau or deep.
+        config (dict): Opened bstar_config.json.
+        threads (int, optional): Implicit-MT threads. Defaults to None (see ThreadPolicy).
+
+    Returns:
+        str: Output file.
+    '''
+    grids = Grids(mode,config['CUTS'][year])
+    wvar, topvars = modes[mode]
+
+    file_path = '{redirector}{rootfile_path}/{setname}_bstar{year}.root'.format(
+        redirector=redirector, rootfile_path=rootfile_path, setname=setname, year=year)
+    file_path = CachedPath(file_path)
+    ThreadPolicy.EnableMT(threads, file_path, '{}_{}'.format(setname, year))
+    a = analyzer(file_path)
+    norm = helpers.getNormFactor(setname,year,config) if not a.isData else 1.
+
+    if year == '16':
+        triggers = ["HLT_PFHT800","HLT_PFHT900","HLT_PFJet450"]
+    else:
+        triggers = ["HLT_PFHT1050","HLT_PFJet500","HLT_AK8PFJet380_TrimMass30","HLT_AK8PFJet400_TrimMass30"]
+
+    # Preselection of bs_select.py
+    a.Cut('filters',a.GetFlagString(flags))
+    a.Cut('trigger',a.GetTriggerString(triggers))
+    a.Define('jetIdx','hemispherize(FatJet_phi, FatJet_jetId)')
+    a.Cut('nFatJets_cut','nFatJet > max(jetIdx[0], jetIdx[1])')
+    a.Cut("hemis","(jetIdx[0] != -1)&&(jetIdx[1] != -1)")
+    a.Cut("pt_cut","FatJet_pt[jetIdx[0]] > 400 && FatJet_pt[jetIdx[1]] > 400")
+    a.Cut("eta_cut","abs(FatJet_eta[jetIdx[0]]) < 2.4 && abs(FatJet_eta[jetIdx[1]]) < 2.4")
+    # Cuts of the selection that do not depend on the tagging
+    a.Define("lead_vect",   "hardware::TLvector(FatJet_pt[jetIdx[0]],FatJet_eta[jetIdx[0]],FatJet_phi[jetIdx[0]],FatJet_msoftdrop[jetIdx[0]])")
+    a.Define("sublead_vect","hardware::TLvector(FatJet_pt[jetIdx[1]],FatJet_eta[jetIdx[1]],FatJet_phi[jetIdx[1]],FatJet_msoftdrop[jetIdx[1]])")
+    a.Define("deltaY",      "lead_vect.Rapidity()-sublead_vect.Rapidity()")
+    a.Define("mtw",         "hardware::InvariantMass({lead_vect,sublead_vect})")
+    a.Cut("mtw_cut","mtw>1000.")
+    a.Cut('deltaY_cut','abs(deltaY)<1.6')
+
+    # Tagging variables of both jets
+    columns = []
+    for j in [0,1]:
+        jet = 'jetIdx[%s]'%j
+        a.Define('scan_wmass_%s'%j,'FatJet_msoftdrop[{0}] > {1} && FatJet_msoftdrop[{0}] < {2}'.format(jet,*wmass))
+        a.Define('scan_topmass_%s'%j,'FatJet_msoftdrop[{0}] > {1} && FatJet_msoftdrop[{0}] < {2}'.format(jet,*topmass))
+        columns.extend(['scan_wmass_%s'%j,'scan_topmass_%s'%j])
+        for var in grids.keys():
+            a.Define('scan_%s_%s'%(var,j),variables[var][0].format(jet))
+            columns.append('scan_%s_%s'%(var,j))
+
+    start = time.time()
+    arrays = a.GetActiveNode().DataFrame.AsNumpy(columns)
+    print ('%s %s: read %s events in %.1f s'%(setname,year,len(arrays[columns[0]]),time.time()-start))
+
+    windex = [CutIndex(arrays['scan_%s_%s'%(wvar,j)],wvar,grids[wvar],arrays['scan_wmass_%s'%j]) for j in [0,1]]
+    topindex = []
+    for j in [0,1]:
+        # The top mass window is applied through the first top variable
+        topindex.append([CutIndex(arrays['scan_%s_%s'%(var,j)],var,grids[var],arrays['scan_topmass_%s'%j] if i == 0 else None)
+                         for i,var in enumerate(topvars)])
+    wbins = len(grids[wvar])+1
+    topbins = tuple([len(grids[var])+1 for var in topvars])
+    # A: jet 1 is the W, jet 0 the top. B: jet 1 is not the W, jet 0 is and jet 1 is the top
+    histA = Histogram([windex[1]]+topindex[0],(wbins,)+topbins)
+    histB = Histogram([windex[1],windex[0]]+topindex[1],(wbins,wbins)+topbins)
+
+    if not os.path.exists(scandir):
+        os.makedirs(scandir)
+    out = ScanPath(setname,year,mode)
+    numpy.savez_compressed(out, A=histA, B=histB, norm=norm, nevents=len(arrays[columns[0]]),
+                           **dict([('grid_'+var,grid) for var,grid in grids.items()]))
+    a.Close()
+    return out
+
+def PassCounts(histA,histB):
+    '''Number of events passing every working point of the grid.
+
+    Args:
+        histA (numpy.ndarray): Histogram A (see above).
+        histB (numpy.ndarray): Histogram B (see above).
+
+    Returns:
+        numpy.ndarray: Counts with one axis per variable (W tag first), indexed by working point.
+    '''
+    # Events passing working point k of a variable are those with index <= k
+    cumA = histA
+    for axis in range(histA.ndim):
+        cumA = numpy.cumsum(cumA,axis=axis)
+    cumB = histB
+    for axis in range(1,histB.ndim):
+        cumB = numpy.cumsum(cumB,axis=axis)
+    # For B, jet 1 must fail the W working point that jet 0 passes: index of jet 1 > k
+    failB = numpy.cumsum(cumB[::-1],axis=0)[::-1]
+    nw = histA.shape[0]-1
+    k = numpy.arange(nw)
+    passB = failB[k+1,k]
+    wps = tuple([slice(0,n-1) for n in histA.shape])
+    return cumA[wps] + passB[wps]
+
+def Significance(s,b,metric='soverb',minbkg=0.):
+    '''Expected significance (0 where the background is below minbkg).
+
+    Args:
+        s (numpy.ndarray): Expected signal.
+        b (numpy.ndarray): Expected background.
+        metric (str, optional): soverb for S/sqrt(B) or asimov for sqrt(2((S+B)ln(1+S/B)-S)). Defaults to 'soverb'.
+        minbkg (float, optional): Minimum expected background. Defaults to 0.
+
+    Returns:
+        numpy.ndarray
+    '''
+    filled = (b > 0) & (b >= minbkg)
+    safe_b = numpy.where(filled,b,1.)
+    if metric == 'asimov':
+        z = numpy.sqrt(numpy.maximum(2*((s+safe_b)*numpy.log1p(s/safe_b)-s),0.))
+    else:
+        z = s/numpy.sqrt(safe_b)
+    return numpy.where(filled,z,0.)
+
+def Rank(setnames,year,mode,cuts,metric='soverb',minbkg=0.,ntop=20):
+    '''Combines the scans of the samples and ranks the working points for every signal.
+
+    Args:
+        setnames (list(str)): Signals (setnames containing 'signal') and backgrounds.
+        year (str): 16, 17, 18.
+        mode (str): tau or deep.
+        cuts (dict): Cuts of the year in bstar_config.json (the reference working point).
+        metric (str, optional): soverb or asimov. Defaults to 'soverb'.
+        minbkg (float, optional): Minimum expected background of a working point. Defaults to 0.
+        ntop (int, optional): Number of working points in the table. Defaults to 20.
+
+    Returns:
+        tuple(OrderedDict,OrderedDict): Grids of the variables and {signal: {'config': working point of the config,
+            'ranked': list of the best working points}} where each working point is a dict of the cuts, S, B and significance.
+    '''
+    grids, expected = None, {}
+    for setname in setnames:
+        scan = numpy.load(ScanPath(setname,year,mode))
+        these = OrderedDict([(var,scan['grid_'+var]) for var in [modes[mode][0]]+modes[mode][1]])
+        if grids != None and any([not numpy.array_equal(grids[v],these[v]) for v in grids]):
+            raise ValueError('The grid of %s differs from the other samples. Run again with --refill.'%setname)
+        grids = these
+        expected[setname] = PassCounts(scan['A'],scan['B'])*float(scan['norm'])
+    signals = [s for s in setnames if 'signal' in s]
+    bkg = sum([expected[s] for s in setnames if s not in signals])
+
+    # The config working point is always in the grids (see Grids())
+    config_wp = tuple([int(numpy.argmin(abs(grids[var]-cuts[var]))) for var in grids.keys()])
+    ranking = OrderedDict()
+    for signal in signals:
+        z = Significance(expected[signal],bkg,metric,minbkg)
+        row = lambda wp: OrderedDict([(var,float(grids[var][i])) for var,i in zip(grids.keys(),wp)]+
+                                     [('S',float(expected[signal][wp])),('B',float(bkg[wp])),(metric,float(z[wp]))])
+        ranking[signal] = {'config':row(config_wp),
+                           'ranked':[row(numpy.unravel_index(flat,z.shape)) for flat in numpy.argsort(z,axis=None)[::-1][:ntop]]}
+    return grids, ranking
+
+def FormatRanking(ranking,grids,year,mode,metric):
+    '''Text table of the ranked working points of every signal, after the working point of the config.'''
+    lines = []
+    for signal,rows in ranking.items():
+        lines.append('%s 20%s (%s tagging), ranked by %s'%(signal,year,mode,metric))
+        lines.append('  %6s '%'rank'+' '.join(['%10s'%var for var in grids.keys()])+' %12s %12s %10s'%('S','B',metric))
+        for rank,row in [('config',rows['config'])]+[(i+1,r) for i,r in enumerate(rows['ranked'])]:
+            lines.append('  %6s '%rank+' '.join(['%10.4g'%row[var] for var in grids.keys()])+' %12.4g %12.4g %10.4f'%(row['S'],row['B'],row[metric]))
+        lines.append('')
+    return '\n'.join(lines)
+
+if __name__ == "__main__":
+    parser = ArgumentParser(description='Scan the tagging working points and rank them by expected significance')
+    parser.add_argument('-s', type=str, dest='setnames', nargs='+', action='store', required=True,
+                        help='Signals and backgrounds. E.g. ttbar QCDHT700 QCDHT1000 QCDHT1500 QCDHT2000 singletop_tW singletop_tWB signalLH2000')
+    parser.add_argument('-y', type=str, dest='years', nargs='+', action='store', required=True,
+                        help='Years to scan (16, 17, 18). One ranking is made per year')
+    parser.add_argument('-c', '--config', type=str, dest='config', action='store', default='bstar_config.json',
+                        help='Configuration file with the cuts, xsecs and lumi. Defaults to bstar_config.json')
+    parser.add_argument('--deep', action='store_true',
+                        help='Scan the DeepAK8 working points instead of tau21, tau32 and the subjet b tag')
+    parser.add_argument('--metric', type=str, dest='metric', action='store', default='soverb', choices=['soverb','asimov'],
+                        help='Significance used for the ranking. Defaults to soverb (S/sqrt(B))')
+    parser.add_argument('--min-bkg', type=float, dest='minbkg', action='store', default=1.,
+                        help='Minimum expected background of a working point. Defaults to 1')
+    parser.add_argument('-n', type=int, dest='ntop', action='store', default=20,
+                        help='Number of working points in the table of each signal. Defaults to 20')
+    parser.add_argument('--refill', action='store_true',
+                        help='Read the samples again even if their scan histograms exist')
+    ThreadPolicy.AddThreadsArgument(parser)
+    args = parser.parse_args()
+
+    if any([s.startswith('data') for s in args.setnames]):
+        parser.error('The scan only uses simulation (the signal region is blinded)')
+    if not any(['signal' in s for s in args.setnames]):
+        parser.error('Give at least one signal with -s')
+    mode = 'deep' if args.deep else 'tau'
+    config = OpenJSON(args.config)
+
+    CompileCpp("TIMBER/Framework/include/common.h")
+    CompileCppCached('bstar.cc')
+    if len(args.years)*len(args.setnames) > 1:
+        ThreadPolicy.EnableMT(args.threads, None, 'cut scan') # for all the samples, not capped by the first one
+
+    for year in args.years:
+        for setname in args.setnames:
+            if args.refill or not os.path.exists(ScanPath(setname,year,mode)):
+                Fill(setname,year,mode,config,args.threads)
+        start = time.time()
+        grids, ranking = Rank(args.setnames,year,mode,config['CUTS'][year],args.metric,args.minbkg,args.ntop)
+        nwps = numpy.prod([len(g) for g in grids.values()])
+        table = FormatRanking(ranking,grids,year,mode,args.metric)
+        print (table)
+        print ('Evaluated %s working points for %s signals in %.2f s'%(nwps,len(ranking),time.time()-start))
+        outname = 'rootfiles/cutscan_%s_%s'%(year,mode)
+        with open(outname+'.txt','w') as f:
+            f.write(table)
+        with open(outname+'.json','w') as f:
+            json.dump({'year':year, 'mode':mode, 'metric':args.metric, 'setnames':args.setnames,
+                       'grids':OrderedDict([(var,[float(x) for x in grid]) for var,grid in grids.items()]),
+                       'ranking':ranking},f,indent=2)
+        print ('Ranking written to %s.txt/.json'%outname)
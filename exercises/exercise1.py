@@ -11,6 +11,9 @@ from TIMBER.Analyzer import analyzer, HistGroup
 from TIMBER.Tools.Common import CompileCpp
 from TIMBER.Tools.Plot import *
 import helpers
+from CppCache import CompileCppCached
+from FileCache import CachedPath
+import ThreadPolicy
 
 ROOT.gROOT.SetBatch(True) 
 
@@ -24,6 +27,10 @@ parser.add_option('--select', metavar='BOOL', action='store_true',
                 default   =   False,
                 dest      =   'select',
                 help      =   'Whether to run the selection. If False, will attempt to recycle previous run histograms.')
+parser.add_option('-t', '--threads', metavar='N', type='int', action='store',
+                default   =   None,
+                dest      =   'threads',
+                help      =   'Number of implicit-MT threads. Defaults to $BSTAR_NTHREADS, the Condor request_cpus, or 2')
 (options, args) = parser.parse_args()
 
 ###########################################
@@ -38,7 +45,7 @@ config = 'bstar_config.json' # holds luminosities and cross sections
 
 # common c++ functions that we will need when looping of the RDataFrame
 CompileCpp("TIMBER/Framework/include/common.h") 
-CompileCpp('bstar.cc') 
+CompileCppCached('bstar.cc') 
 
 # define sample sets that we want to process, label them and define colors
 # here we are only going to work with a single signal dataset
@@ -74,10 +81,10 @@ varnames = {
 # Define function for actual processing #
 #########################################
 def select(setname,year):
-    ROOT.ROOT.EnableImplicitMT(2) # Just use two threads - no need to kill the interactive nodes
-
     # Initialize TIMBER analyzer
     file_path = '%s/%s_bstar%s.root' %(rootfile_path,setname, year)
+    file_path = CachedPath(file_path)
+    ThreadPolicy.EnableMT(options.threads, file_path, '%s_%s'%(setname,year), default=2) # Just use two threads by default - no need to kill the interactive nodes
     a = analyzer(file_path)
 
     # Determine normalization weight
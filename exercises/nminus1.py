@@ -5,6 +5,9 @@ from TIMBER.Analyzer import analyzer, HistGroup, VarGroup, CutGroup
 from TIMBER.Tools.Common import CompileCpp, OpenJSON
 from TIMBER.Tools.Plot import *
 import helpers
+from CppCache import CompileCppCached
+from FileCache import CachedPath
+import ThreadPolicy, NodeProfiler, Cutflow
 ROOT.gROOT.SetBatch(True)
 
 ###########################################
@@ -50,7 +53,7 @@ varnames = {
 #########################################
 # Define function for actual processing #
 #########################################
-def nminus1(setname, year):
+def nminus1(setname, year, fused=False, fromskim=False, threads=None, profile=False, cutflow=False):
     '''Performs the N minus 1 selection and plotting by
  	(1) Making some basic kinematic selections
 	(2) Creating a few TIMBER VarGroups to store variables we're interested in studying
@@ -59,33 +62,54 @@ def nminus1(setname, year):
     Args:
 	setname (str): name of input dataset
 	year    (str): 16, 17, 18
+	fused   (bool): Use the single compiled preselection (DijetPreselection() in bstar.cc) instead of the chain of cuts
+	fromskim (bool): Run on the skim written by `selection.py --skim` instead of the full file
+	threads (int): Number of implicit-MT threads. None to follow the policy in ThreadPolicy.py
+	profile (bool): Also write the event counts and timing of every node (see NodeProfiler.py)
+	cutflow (bool): Also write the number of events after every cut of the full selection (see Cutflow.py)
     '''
     # Open the JSON config file and grab information we will need
     config = OpenJSON('bstar_config.json')
     cuts = config['CUTS'][year]
 
-    # Initialize TIMBER analyzer
-    file_path = '{redirector}{rootfile_path}/{setname}_bstar{year}.root'.format(
-        redirector=redirector, rootfile_path=rootfile_path, setname=setname, year=year
-    )
-    a = analyzer(file_path)
-
-    # Determine normalization weight
-    if not a.isData:
-        norm = helpers.getNormFactor(setname,year,config)
+    if fromskim:
+        # The skim (see selection.py --skim) has the events passing the pt and eta cuts with the Dijet_* columns, jetIdx and norm
+        ThreadPolicy.EnableMT(threads, helpers.SkimPath(setname, year), '{}_{}'.format(setname, year))
+        a = analyzer(helpers.SkimPath(setname, year))
+        if 'mjet_pass' not in NodeProfiler.ColumnNames(a.GetActiveNode()):
+            # Skims written before the mjet and mtw decisions were stored have those cuts applied, which would bias the N-1
+            raise ValueError('%s was written after the mjet_cut and mtw_cut, re-run selection.py --skim'%helpers.SkimPath(setname, year))
     else:
-        norm = 1
-
-    # Book actions on the RDataFrame
-    a.Cut('filters',a.GetFlagString(flags))
-    a.Cut('trigger',a.GetTriggerString(triggers[year]))
-    a.Define('jetIdx',    'hemispherize(FatJet_phi, FatJet_jetId)') # need to calculate if we have two jets (with Id) that are back-to-back
-    a.Cut('nFatJets_cut', 'nFatJet > max(jetIdx[0], jetIdx[1])')    # If we don't do this, we may try to access variables of jets that don't exist! (leads to seg fault)
-    a.Cut('hemis',        '(jetIdx[0] != -1)&&(jetIdx[1] != -1)')   # cut on that calculation
-    a.SubCollection('Dijet', 'FatJet', 'jetIdx', useTake=True)
-    a.Cut('pt_cut',  'Dijet_pt[0] > 400 && Dijet_pt[1] > 400')
-    a.Cut('eta_cut', 'abs(Dijet_eta[0]) < 2.4 && abs(Dijet_eta[1]) < 2.4')
-    a.Define('norm',str(norm))
+        # Initialize TIMBER analyzer
+        file_path = '{redirector}{rootfile_path}/{setname}_bstar{year}.root'.format(
+            redirector=redirector, rootfile_path=rootfile_path, setname=setname, year=year
+        )
+        file_path = CachedPath(file_path)
+        ThreadPolicy.EnableMT(threads, file_path, '{}_{}'.format(setname, year))
+        a = analyzer(file_path)
+
+        # Determine normalization weight
+        if not a.isData:
+            norm = helpers.getNormFactor(setname,year,config)
+        else:
+            norm = 1
+
+        # Book actions on the RDataFrame
+        a.Cut('filters',a.GetFlagString(flags))
+        a.Cut('trigger',a.GetTriggerString(triggers[year]))
+        if fused:
+            # One compiled function (DijetPreselection() in bstar.cc) replaces the hemisphere search and the cuts below with one Define
+            # and one Cut, and stores the jet indices, invariant mass, deltaY and tau ratios in the `dijet` column.
+            # jetIdx and the Dijet_* collection (one Define per FatJet branch) are still built for the rest of the script
+            helpers.FusedDijetPreselection(a, ptcut=400, etacut=2.4)
+        else:
+            a.Define('jetIdx',    'hemispherize(FatJet_phi, FatJet_jetId)') # need to calculate if we have two jets (with Id) that are back-to-back
+            a.Cut('nFatJets_cut', 'nFatJet > max(jetIdx[0], jetIdx[1])')    # If we don't do this, we may try to access variables of jets that don't exist! (leads to seg fault)
+            a.Cut('hemis',        '(jetIdx[0] != -1)&&(jetIdx[1] != -1)')   # cut on that calculation
+            a.SubCollection('Dijet', 'FatJet', 'jetIdx', useTake=True)
+            a.Cut('pt_cut',  'Dijet_pt[0] > 400 && Dijet_pt[1] > 400')
+            a.Cut('eta_cut', 'abs(Dijet_eta[0]) < 2.4 && abs(Dijet_eta[1]) < 2.4')
+        a.Define('norm',str(norm))
 
     #################################
     # Build some variables for jets #
@@ -101,10 +125,14 @@ def nminus1(setname, year):
     jets.Add('top_index',   'top_bit >= 0 ? jetIdx[top_bit] : -1')
     jets.Add('w_index',     'top_index == 0 ? jetIdx[1] : top_index == 1 ? jetIdx[0] : -1')
     # Calculate some new comlumns that we'd like to cut on (that were costly to do before the other filtering)
-    jets.Add("lead_vect",   "hardware::TLvector(Dijet_pt[0], Dijet_eta[0], Dijet_phi[0], Dijet_msoftdrop[0])")
-    jets.Add("sublead_vect","hardware::TLvector(Dijet_pt[1], Dijet_eta[1], Dijet_phi[1], Dijet_msoftdrop[1])")
-    jets.Add("deltaY",      "abs(lead_vect.Rapidity() - sublead_vect.Rapidity())")
-    jets.Add("mtw",         "hardware::InvariantMass({lead_vect + sublead_vect})")
+    if fused and not fromskim:
+        jets.Add("deltaY",      "abs(dijet.deltaY)")
+        jets.Add("mtw",         "dijet.mtw")
+    else:
+        jets.Add("lead_vect",   "hardware::TLvector(Dijet_pt[0], Dijet_eta[0], Dijet_phi[0], Dijet_msoftdrop[0])")
+        jets.Add("sublead_vect","hardware::TLvector(Dijet_pt[1], Dijet_eta[1], Dijet_phi[1], Dijet_msoftdrop[1])")
+        jets.Add("deltaY",      "abs(lead_vect.Rapidity() - sublead_vect.Rapidity())")
+        jets.Add("mtw",         "hardware::InvariantMass({lead_vect + sublead_vect})")
 
     ######################################
     # Build some variables for the N - 1 #
@@ -125,30 +153,40 @@ def nminus1(setname, year):
     # Organize N-1 of tagging variables when assuming top is always leading
     nodeToPlot = a.Apply([jets,plotting_vars])
     nminus1Nodes = a.Nminus1(N_cuts, node=nodeToPlot) # constructs N nodes with a different N-1 selection for each
-    nminus1Hists = HistGroup('nminus1Hists')
+    nminus1Hists = helpers.LazyHistGroup('nminus1Hists')
+    if profile:
+        # Booked first so that its timers are the first to evaluate every node (see NodeProfiler.py)
+        nodeprofile = NodeProfiler.NodeProfile(list(nminus1Nodes.values()))
+        for action in nodeprofile.actions: nminus1Hists.AddAction(action)
 
     # Add hists to group and write out
     outFile = ROOT.TFile.Open('rootfiles/{}_{}_Nminus1.root'.format(setname,year),'RECREATE')
     outFile.cd()
-    binning = {
-        'mtop': [25,50,300],
-        'mW': [25,30,270],
-        'tau32': [20,0,1],
-        'tau21': [20,0,1],
-        'deltaY': [20,0,2.0]
-    }
+    binning = helpers.GetBinningRegistry('bstar_config.json') # binning of each variable from the BINNING section of the config
     print('Plotting:')
     for nkey in nminus1Nodes.keys():
         if nkey == 'full': continue
 	print('\t{}'.format(nkey))
         var = nkey.replace('_cut','').replace('minus_','')
-        hist_tuple = (var,var,binning[var][0],binning[var][1],binning[var][2])
-        hist = nminus1Nodes[nkey].DataFrame.Histo1D(hist_tuple,var,'norm')
-        hist.GetValue()
-        nminus1Hists.Add(var,hist)
+        nminus1Hists.Book1D(var,nminus1Nodes[nkey],binning.Model1D(var,var),var,'norm')
+
+    if cutflow:
+        # Cutflow of the full selection (all N cuts), counted in the same event loop as the histograms
+        cuts = Cutflow.Cutflow(nminus1Nodes['full'], setname, year, 1. if fromskim else norm)
+        for action in cuts.actions: nminus1Hists.AddAction(action)
+
+    # Fill all of the N-1 histograms in one event loop
+    nminus1Hists.Run()
 
     # Now, perform TH1.Write() on all TH1s in our HistGroup
     nminus1Hists.Do('Write')
+    if cutflow:
+        cuts.Write()
+        cuts.Save('rootfiles/{}_{}_Nminus1_cutflow'.format(setname,year))
+
+    if profile:
+        nodeprofile.Save('rootfiles/{}_{}_Nminus1_profile.json'.format(setname,year),
+                         plotdir+'/{}_{}_nminus1_profile.dot'.format(setname,year))
 
     # Save the NodeTree so we can see how it works under the hood
     a.PrintNodeTree(plotdir+'/{}_{}_nminus1_tree.dot'.format(setname,year), verbose=True)
@@ -167,11 +205,20 @@ if __name__ == "__main__":
     parser.add_argument('-y', type=str, dest='year',
                         action='store', required=True,
                         help='Year of set (16, 17, 18).')
+    parser.add_argument('--fused', action='store_true',
+                        help='If flag passed, do the dijet preselection in one compiled function instead of the chain of cuts')
+    parser.add_argument('--fromSkim', action='store_true', dest='fromskim',
+                        help='If flag passed, run on the skim written by selection.py --skim instead of the full file')
+    parser.add_argument('--profile', action='store_true',
+                        help='If flag passed, write the event counts and timing of every node to rootfiles/<setname>_<year>_Nminus1_profile.json')
+    parser.add_argument('--cutflow', action='store_true',
+                        help='If flag passed, write the number of events after every cut to the output and to rootfiles/<setname>_<year>_Nminus1_cutflow.json/.txt')
+    ThreadPolicy.AddThreadsArgument(parser)
     args = parser.parse_args()
 
     # Compile some of the C++ macros we'll need for our selection
     CompileCpp("TIMBER/Framework/include/common.h")
-    CompileCpp('bstar.cc')      # Contains hemispherize() function for identifying back-to-back jets
+    CompileCppCached('bstar.cc')      # Contains hemispherize() function for identifying back-to-back jets
 
     # Run our N - 1 script
-    nminus1(args.setname, args.year)
+    nminus1(args.setname, args.year, args.fused, args.fromskim, args.threads, args.profile, args.cutflow)
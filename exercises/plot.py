@@ -1,7 +1,9 @@
-import ROOT
+import ROOT, sys, os, json, time, multiprocessing
+sys.path.append('./')
 from TIMBER.Analyzer import analyzer, HistGroup
 from TIMBER.Tools.Plot import *
 from collections import OrderedDict
+import PlotCache
 
 ROOT.gROOT.SetBatch(True)
 
@@ -67,110 +69,157 @@ varnames = {
 
 ########################################################################
 
+# Samples read from rootfiles/ (the groups are summed from them by PlotCache)
+plotted = [s for s in samples.keys() if s not in PlotCache.groups]
+# Plots already rendered and the inputs they were made from
+stampfile = 'plots/plot_stamps.json'
+# Histograms of every (year, kind), loaded in the parent process. The worker processes
+# are forked after they are loaded so they use them without re-reading any file
+loaded = {}
+
+def LoadYear(year,nminus1,rebuild=False):
+    '''Histograms of a year (from the plot cache), loaded once per process.'''
+    kind = 'Nminus1' if nminus1 else 'selection'
+    if (year,kind) not in loaded:
+        loaded[(year,kind)] = PlotCache.LoadHists(plotted, year, kind, rebuild=rebuild)
+    return loaded[(year,kind)]
+
+def PlotFilename(varname,year,nminus1,logy,soverb):
+    '''Name of the plot of a variable.'''
+    return 'plots/{}_{}{}{}{}.png'.format(varname, year, '_Nminus1' if nminus1 else '','_SoverB' if soverb else '', '_logy' if logy else '')
+
+def MakePlot(task):
+    '''Draws one variable of one year. Meant to be run in a worker process.
+
+    Args:
+        task (tuple): (varname, year, nminus1, logy, soverb)
+
+    Returns:
+        str: Name of the plot.
+    '''
+    varname, year, nminus1, logy, soverb = task
+    histgroups = LoadYear(year, nminus1)
+    plot_filename = PlotFilename(varname, year, nminus1, logy, soverb)
+    # Setup ordered dictionaries so processes plot in the order we specify.
+    # The histograms are cloned because the same ones are used for the other variants.
+    bkg_hists, signal_hists = OrderedDict(), OrderedDict()
+    # First do bkgs, plotting largest first (QCD and singletop are already summed in the cache)
+    for bkg in ['QCD','ttbar','singletop']:
+        if bkg not in histgroups.keys(): continue   # ensures user doesn't have to modify above list
+        bkg_hists[bkg] = histgroups[bkg][varname].Clone()
+        bkg_hists[bkg].SetTitle('{} 20{}'.format(varname, year))
+    # Now, add the signals
+    for sig in samples.keys():
+        if 'signal' not in sig or sig not in histgroups.keys(): continue
+        signal_hists[sig] = histgroups[sig][varname].Clone()
+
+    # QCD has a *LOT* more entries than the other backgrounds, so normalize to ttbar before plotting
+    QCDint = bkg_hists['QCD'].Integral()
+    TTint = bkg_hists['ttbar'].Integral()
+    ratio = TTint/QCDint
+    bkg_hists['QCD'].Scale(ratio)
+
+    # Plot everything together!
+    CompareShapes(
+        outfilename = plot_filename,
+        year = year,
+        prettyvarname = varnames[varname],
+        bkgs = bkg_hists,
+        signals = signal_hists,
+        colors = colors,
+        names = samples,
+        logy = logy,
+        doSoverB = soverb,
+        stackBkg = True
+    )
+    return plot_filename
+
 if __name__ == "__main__":
     from argparse import ArgumentParser
     parser = ArgumentParser()
-    parser.add_argument('-y', type=str, dest='year',
+    parser.add_argument('-y', type=str, dest='years', nargs='+',
                         action='store', required=True,
-                        help='Year of set (16, 17, 18).')
+                        help='Year(s) of set (16, 17, 18).')
     parser.add_argument('--nminus1',
-			action='store_true',
-			help='If flag passed, plot N-1 distributions instead of selection')
+                        action='store_true',
+                        help='If flag passed, plot N-1 distributions instead of selection')
     parser.add_argument('--logy',
                         action='store_true',
                         help='If flag passed, plot logarithmic distributions')
     parser.add_argument('--soverb',
                         action='store_true',
                         help='If flag passed, add a sub pad with signal/sqrt(background) calculation')
+    parser.add_argument('--all', action='store_true', dest='allvariants',
+                        help='If flag passed, make every combination of selection/N-1, linear/log and with/without S/sqrt(B)')
+    parser.add_argument('-j', '--jobs', type=int, dest='jobs',
+                        action='store', default=1,
+                        help='Number of processes drawing the plots in parallel. Defaults to 1')
+    parser.add_argument('--force',
+                        action='store_true',
+                        help='If flag passed, redraw the plots even if their inputs did not change since they were drawn')
+    parser.add_argument('--rebuild',
+                        action='store_true',
+                        help='If flag passed, re-read the input files even if the plot cache is up to date')
     args = parser.parse_args()
 
-    # Store all of the histograms we want to track
-    histgroups = {}
-
-    # Open the rootfiles we created previously
-    # Syntax is either <setname>_<year>.root for selection distributions
-    # or <setname>_<year>_Nminus1.root for N-1 distributions
-    for sample in samples.keys():
-	if (sample=='QCD') or (sample=='singletop'): 
-	    # These are just stored to concatenate the QCD/singletop backgrounds, ignore
-	    continue
-	inFile = ROOT.TFile.Open('rootfiles/{}_{}{}.root'.format(sample, args.year, '_Nminus1' if args.nminus1 else '_selection'))
-	if inFile == None:
-	    #print('WARNING: rootfiles/{}_{}{}.root does not exist, please create first\n'.format(sample, args.year, '_Nminus1' if args.nminus1 else ''))
-	    continue	
-
-	# Put histograms into the HistGroups
-	histgroups[sample] = HistGroup(sample)
-	for key in inFile.GetListOfKeys():	# loop over histograms in the file
-	    keyname = key.GetName()
-	    # Selection and N-1 file histograms are named slightly differently
-	    if args.nminus1:
-		varname = keyname
-	    else:
-		if sample not in keyname: continue  # should never happen, but just in case
-		varname = keyname[len(sample+'_'+args.year)+1:] # get the variable name, e.g. lead_tau32
-	    inhist = inFile.Get(key.GetName()) # get it from the file
-	    inhist.SetDirectory(0) # set the directory so hist is stored in memory and not as reference to TFile (this way it doesn't get tossed by python garbage collection when infile changes)
-	    histgroups[sample].Add(varname,inhist) # add to our group
-	    print('Added {} distribution for sample {}'.format(varname, sample))
-
-	# Close the input ROOT file
-	inFile.Close()
-
-    ''' # You can treat the histgroup just like a nested dictionary, i.e. 
-    for i in histgroups.keys():		# this will print the sample name (e.g. 'ttbar', 'QCDHT700', etc)
-	print(i)
-	for j in histgroups[i].keys():	# this will print the variable name (e.g. lead_tau32)
-	    print(j)
-    '''
-
-    # Get the variable names list. The following format ensures that, as long as one file has been processed, 
-    # the proper variable names will be found without the user having to specify anything additional.
-    ExistingVarnames = histgroups[list(histgroups.keys())[0]].keys()
+    if args.allvariants:
+        variants = [(nminus1,logy,soverb) for nminus1 in [False,True] for logy in [False,True] for soverb in [False,True]]
+    else:
+        variants = [(args.nminus1,args.logy,args.soverb)]
+
+    if not os.path.exists('plots/'):
+        os.makedirs('plots/')
+    stamps = {}
+    if os.path.exists(stampfile):
+        with open(stampfile) as f:
+            stamps = json.load(f)
+
+    tasks, keys, nskipped = [], {}, 0
+    for year in args.years:
+        for nminus1,logy,soverb in variants:
+            # Histograms of every sample and of the QCD and single top groups. They are read and summed
+            # once per year and kept in rootfiles/plotcache_<year>_<kind>.root until one of the inputs changes
+            key = PlotCache.CacheKey(plotted, year, 'Nminus1' if nminus1 else 'selection')
+            if len(key) == 0:
+                print('WARNING: no {} inputs for 20{} in rootfiles/, please create them first'.format('N-1' if nminus1 else 'selection', year))
+                continue
+            histgroups = LoadYear(year, nminus1, args.rebuild)
+
+            ''' # You can treat the histgroup just like a nested dictionary, i.e. 
+            for i in histgroups.keys():		# this will print the sample name (e.g. 'ttbar', 'QCDHT700', etc)
+                print(i)
+                for j in histgroups[i].keys():	# this will print the variable name (e.g. lead_tau32)
+                    print(j)
+            '''
+
+            # Get the variable names list. The following format ensures that, as long as one file has been processed, 
+            # the proper variable names will be found without the user having to specify anything additional.
+            ExistingVarnames = histgroups[list(histgroups.keys())[0]].keys()
+            for varname in ExistingVarnames:
+                plot_filename = PlotFilename(varname, year, nminus1, logy, soverb)
+                # Skip plots drawn from exactly the same inputs
+                if not args.force and os.path.exists(plot_filename) and stamps.get(plot_filename) == key:
+                    nskipped += 1
+                    continue
+                tasks.append((varname, year, nminus1, logy, soverb))
+                keys[plot_filename] = key
 
     # Now plot the variables up in the global definitions above
-    for varname in ExistingVarnames:
-	plot_filename = 'plots/{}_{}{}{}{}.png'.format(varname, args.year, '_Nminus1' if args.nminus1 else '','_SoverB' if args.soverb else '', '_logy' if args.logy else '')
-	# Setup ordered dictionaries so processes plot in the order we specify
-	bkg_hists, signal_hists = OrderedDict(), OrderedDict()
-	# First do bkgs, plotting largest first
-	for bkg in ['QCDHT700','QCDHT1000','QCDHT1500','QCDHT2000','ttbar','singletop_tW','singletop_tWB']:
-	    if bkg not in histgroups.keys(): continue	# ensures user doesn't have to modify above list
-	    histgroups[bkg][varname].SetTitle('{} 20{}'.format(varname, args.year))
-	    if 'QCD' in bkg:
-		if 'QCD' not in bkg_hists.keys():
-		    bkg_hists['QCD'] = histgroups[bkg][varname].Clone('QCD_'+varname)
-		else:
-		    bkg_hists['QCD'].Add(histgroups[bkg][varname])
-	    elif 'singletop' in bkg:
-		if 'singletop' not in bkg_hists.keys():
-		    bkg_hists['singletop'] = histgroups[bkg][varname].Clone('singletop_'+varname)
-		else:
-		    bkg_hists['singletop'].Add(histgroups[bkg][varname])
-	    else:
-		# Only bkg left is ttbar, which doesn't get concatenated
-		bkg_hists[bkg] = histgroups[bkg][varname]
-	# Now, add the signals
-	for sig in samples.keys():
-	    if 'signal' not in sig: continue
-	    signal_hists[sig] = histgroups[sig][varname]
-
-	# QCD has a *LOT* more entries than the other backgrounds, so normalize to ttbar before plotting
-	QCDint = bkg_hists['QCD'].Integral()
-	TTint = bkg_hists['ttbar'].Integral()
-	ratio = TTint/QCDint
-	bkg_hists['QCD'].Scale(ratio)
-
-	# Plot everything together!
-	CompareShapes(
-	    outfilename = plot_filename,
-	    year = args.year,
-	    prettyvarname = varnames[varname],
-	    bkgs = bkg_hists,
-	    signals = signal_hists,
-	    colors = colors,
-	    names = samples,
-	    logy = args.logy,
-	    doSoverB = args.soverb,
-	    stackBkg = True
-	)
+    start = time.time()
+    try:
+        if args.jobs > 1 and len(tasks) > 1:
+            pool = multiprocessing.Pool(args.jobs)
+            try:
+                for plot_filename in pool.imap_unordered(MakePlot, tasks):
+                    stamps[plot_filename] = keys[plot_filename]
+            finally:
+                pool.close()
+                pool.join()
+        else:
+            for task in tasks:
+                plot_filename = MakePlot(task)
+                stamps[plot_filename] = keys[plot_filename]
+    finally:
+        with open(stampfile,'w') as f:
+            json.dump(stamps, f, indent=2)
+    print('Drew {} plots in {:.1f} s ({} unchanged plots skipped)'.format(len(tasks), time.time()-start, nskipped))
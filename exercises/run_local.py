@@ -0,0 +1,200 @@
+''' Runs selection.py and/or nminus1.py for many samples and years on one
+    (large) interactive machine instead of through Condor.
+
+    Every (step, setname, year) is a task run in its own worker process (at most
+    `-j` at a time), each with its own number of implicit-MT threads, so that
+    jobs x threads covers the machine. A worker that dies without returning
+    (ex. a segfault or abort in ROOT) is reported as a failed task with its exit
+    code instead of stopping the run. The outputs are the usual
+    `rootfiles/{setname}_{year}_selection.root` and `rootfiles/{setname}_{year}_Nminus1.root`
+    that `exercises/plot.py` expects.
+
+    Usage (from the top of the repository):
+    ```
+    python exercises/run_local.py -a condor/2016_args.txt condor/2017_args.txt -j 16 -t 4
+    python exercises/run_local.py -s ttbar signalLH2000 -y 16 17 18 --steps selection
+    ```
+'''
+import ROOT, sys, os, time, traceback, multiprocessing
+sys.path.append('./')
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+from argparse import ArgumentParser
+from TIMBER.Tools.Common import CompileCpp
+import helpers
+from CppCache import CompileCppCached
+import ThreadPolicy
+from selection import select
+from nminus1 import nminus1
+ROOT.gROOT.SetBatch(True)
+
+steps = {
+    'selection': select,
+    'nminus1':   nminus1,
+}
+
+def RunTask(task):
+    '''Runs one step for one set and year. Meant to be run in a worker process.
+
+    Args:
+        task (tuple): (step, setname, year, threads, options) where options is a dict
+            of extra keyword arguments for the step (ex. fused).
+
+    Returns:
+        tuple: (step, setname, year, time in seconds, traceback or None if successful)
+    '''
+    step, setname, year, threads, options = task
+    start = time.time()
+    try:
+        steps[step](setname, year, threads=threads, **options)
+        error = None
+    except Exception:
+        error = traceback.format_exc()
+    return (step, setname, year, time.time()-start, error)
+
+def Worker(task,conn):
+    '''Runs a task in a child process and sends its result to the parent.
+
+    Args:
+        task (tuple): Task for RunTask().
+        conn (Connection): Sending end of the pipe to the parent.
+    '''
+    conn.send(RunTask(task))
+    conn.close()
+
+def ExitStatus(exitcode):
+    '''Readable exit status of a worker process.'''
+    if exitcode != None and exitcode < 0:
+        return 'killed by signal %s'%(-exitcode)
+    return 'exit code %s'%exitcode
+
+def RunTasks(tasks,jobs,poll=0.2):
+    '''Runs the tasks in at most `jobs` worker processes at a time, one process per task
+       so every task starts from a clean ROOT state. The processes are watched so that
+       one that dies without returning a result is recorded as failed.
+
+    Args:
+        tasks (list(tuple)): Tasks for RunTask().
+        jobs (int): Number of worker processes at a time.
+        poll (float, optional): Seconds between checks of the workers. Defaults to 0.2.
+
+    Yields:
+        tuple: Result of RunTask() of every task, in the order they finish.
+    '''
+    pending = list(tasks)
+    running = [] # [process, connection, task, start time, result]
+    try:
+        while len(pending) > 0 or len(running) > 0:
+            while len(pending) > 0 and len(running) < jobs:
+                task = pending.pop(0)
+                recv_conn, send_conn = multiprocessing.Pipe(False)
+                process = multiprocessing.Process(target=Worker, args=(task,send_conn))
+                process.start()
+                send_conn.close() # only the child writes, so recv() gets EOFError if it dies
+                running.append([process, recv_conn, task, time.time(), None])
+            time.sleep(poll)
+            for worker in list(running):
+                process, conn, task, start, result = worker
+                # Read while the worker runs so it never blocks on a full pipe
+                if result == None and conn.poll():
+                    try:
+                        worker[4] = result = conn.recv()
+                    except EOFError:
+                        pass
+                if process.is_alive(): continue
+                process.join()
+                if result == None and conn.poll():
+                    try:
+                        result = conn.recv()
+                    except EOFError:
+                        pass
+                conn.close()
+                running.remove(worker)
+                if result == None:
+                    step, setname, year = task[:3]
+                    result = (step, setname, year, time.time()-start,
+                              'Worker process died without returning a result (%s)'%ExitStatus(process.exitcode))
+                yield result
+    finally:
+        for process, conn, task, start, result in running:
+            if process.is_alive(): process.terminate()
+            process.join()
+
+def MakeTasks(args):
+    '''Builds the list of tasks from the argument files and/or the setnames and years.
+
+    Args:
+        args (Namespace): Command line arguments.
+
+    Returns:
+        list(tuple): Tasks for RunTask().
+    '''
+    line_parser = ArgumentParser()
+    line_parser.add_argument('-s', type=str, dest='setname', action='store', required=True)
+    line_parser.add_argument('-y', type=str, dest='year', action='store', required=True)
+    jobs = []
+    for argsfile in args.argsfiles:
+        jobs.extend([(job.setname,job.year) for job in helpers.ReadArgsFile(argsfile,line_parser)])
+    for setname in args.setnames:
+        for year in args.years:
+            jobs.append((setname,year))
+
+    tasks = []
+    for step in args.steps:
+        options = {'fused':args.fused, 'cutflow':args.cutflow}
+        if step == 'selection': options['skim'] = args.skim
+        if args.fromskim: options['fromskim'] = True
+        for setname,year in jobs:
+            tasks.append((step, setname, year, args.threads, options))
+    return tasks
+
+if __name__ == "__main__":
+    parser = ArgumentParser(description='Run the selection and N-1 steps for many samples in parallel on one machine')
+    parser.add_argument('-a', '--args', type=str, dest='argsfiles', nargs='+', action='store', default=[],
+                        help='Condor-style argument files with one "-s <setname> -y <year>" per line. E.g. condor/2016_args.txt')
+    parser.add_argument('-s', type=str, dest='setnames', nargs='+', action='store', default=[],
+                        help='Setnames to process (for each year given with -y). E.g. ttbar signalLH2000 QCDHT700')
+    parser.add_argument('-y', type=str, dest='years', nargs='+', action='store', default=['16','17','18'],
+                        help='Years of the setnames given with -s. Defaults to 16 17 18')
+    parser.add_argument('--steps', type=str, dest='steps', nargs='+', action='store', default=['selection','nminus1'],
+                        choices=sorted(steps.keys()), help='Steps to run for every set. Defaults to selection nminus1')
+    parser.add_argument('-j', '--jobs', type=int, dest='jobs', action='store', default=None,
+                        help='Number of worker processes. Defaults to the number of CPUs divided by the threads per worker')
+    parser.add_argument('-t', '--threads', type=int, dest='threads', action='store', default=1,
+                        help='Implicit-MT threads in each worker. Defaults to 1')
+    parser.add_argument('--fused', action='store_true',
+                        help='Do the dijet preselection in one compiled function instead of the chain of cuts')
+    parser.add_argument('--cutflow', action='store_true',
+                        help='Also write the cutflow of every task (merge them with Cutflow.py)')
+    parser.add_argument('--skim', action='store_true',
+                        help='Also write the skim of each set in the selection step')
+    parser.add_argument('--fromSkim', action='store_true', dest='fromskim',
+                        help='Run on the skims written by a previous --skim run instead of the full files')
+    args = parser.parse_args()
+
+    tasks = MakeTasks(args)
+    if len(tasks) == 0:
+        parser.error('Nothing to run. Give argument files with -a and/or setnames with -s.')
+    if args.jobs == None:
+        args.jobs = max(1, ThreadPolicy.AvailableCpus()//max(1,args.threads))
+    if not os.path.exists('rootfiles/'):
+        os.makedirs('rootfiles/')
+
+    # Compile once here. The workers are forked from this process so they start with the code already loaded.
+    CompileCpp("TIMBER/Framework/include/common.h")
+    CompileCppCached('bstar.cc')
+
+    print ('Running %s tasks on %s workers x %s threads'%(len(tasks),args.jobs,args.threads))
+    start = time.time()
+    results = []
+    for step, setname, year, seconds, error in RunTasks(tasks, args.jobs):
+        status = 'OK' if error == None else 'FAILED'
+        print ('[%s/%s] %-10s %-20s %s  %8.1f s  %s'%(len(results)+1,len(tasks),step,setname,year,seconds,status))
+        results.append((step, setname, year, seconds, error))
+
+    failed = [r for r in results if r[4] != None]
+    for step, setname, year, seconds, error in failed:
+        print ('\n%s failed for %s %s:\n%s'%(step,setname,year,error))
+    print ('\n%s/%s tasks succeeded. Total time: %.1f min (%.1f min of task time)'%(
+        len(results)-len(failed), len(tasks), (time.time()-start)/60., sum([r[3] for r in results])/60.))
+    if len(failed) > 0:
+        sys.exit(1)
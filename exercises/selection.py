@@ -5,6 +5,9 @@ from TIMBER.Analyzer import analyzer, HistGroup
 from TIMBER.Tools.Common import CompileCpp
 from TIMBER.Tools.Plot import *
 import helpers
+from CppCache import CompileCppCached
+from FileCache import CachedPath
+import ThreadPolicy, NodeProfiler, Cutflow
 ROOT.gROOT.SetBatch(True)
 
 ###########################################
@@ -62,7 +65,7 @@ varnames = {
 ############################################
 # Define functions for the event selection #
 ############################################
-def select(setname, year):
+def select(setname, year, fused=False, skim=False, fromskim=False, threads=None, profile=False, cutflow=False):
     '''Function to perform the event selection on a specified dataset by: 
 	 (1) Applying MET filters and trigger selection to dataset
 	 (2) Identifying events with at least two back-to-back FatJets
@@ -71,96 +74,146 @@ def select(setname, year):
     Args:
 	setname  (str): name of input dataset (signal, background)
 	year     (str): 16, 17, 18
+	fused    (bool): Use the single compiled preselection (DijetPreselection() in bstar.cc) instead of the chain of cuts
+	skim     (bool): Also write the events passing the pt and eta cuts to a slim skim (see helpers.BookSkim())
+	fromskim (bool): Run on the skim written by a previous `skim` run instead of the full file (skips steps 1-3)
+	threads  (int): Number of implicit-MT threads. None to follow the policy in ThreadPolicy.py
+	profile  (bool): Also write the event counts and timing of every node (see NodeProfiler.py)
+	cutflow  (bool): Also write the number of events after every cut (see Cutflow.py)
     '''
-    # Initialize TIMBER analyzer
-    file_path = '{redirector}{rootfile_path}/{setname}_bstar{year}.root'.format(
-	redirector=redirector, rootfile_path=rootfile_path, setname=setname, year=year
-    )
-    a = analyzer(file_path)
-
-    # Determine normalization weight
-    if not a.isData:
-	norm = helpers.getNormFactor(setname,year,config)
+    if fromskim:
+        # The skim holds the events passing the pt and eta cuts with the Dijet_* columns, norm, invariantMass, nbjet_*
+        # and the decisions of the last two cuts of the preselection, which are made here
+        ThreadPolicy.EnableMT(threads, helpers.SkimPath(setname, year), '{}_{}'.format(setname, year))
+        a = analyzer(helpers.SkimPath(setname, year))
+        a.Cut('mjet_cut', 'mjet_pass')
+        a.Cut('mtw_cut',  'mtw_pass')
     else:
-	norm = 1
-
-    # Book actions on the RDataFrame
-    a.Cut('filters',a.GetFlagString(flags))
-    a.Cut('trigger',a.GetTriggerString(triggers[year]))		# Apply different triggers based on the year
-    a.Define('jetIdx','hemispherize(FatJet_phi, FatJet_jetId)') # need to calculate if we have two jets (with Id) that are back-to-back
-    a.Cut('nFatJets_cut','nFatJet > max(jetIdx[0],jetIdx[1])') 	# If we don't do this, we may try to access variables of jets that don't exist! (leads to seg fault)
-    a.Cut("hemis","(jetIdx[0] != -1)&&(jetIdx[1] != -1)") 	# cut on that calculation
-
-    # Having determined which events have two candidate jets meeting our criteria, let's make a collection specific to them
-    # Then, every event will have a two-element long column Dijet_<variable> corresponding to the values of the jets which passed our back-to-back criteria
-    a.SubCollection('Dijet', 'FatJet', 'jetIdx', useTake=True)
-
-    # We can now cut on the values of the Dijet collection and simply index 0 (lead) or 1 (sublead) to get the information about the appropriate jet
-    a.Cut('pt_cut',   'Dijet_pt[0] > 400 && Dijet_pt[1] > 400')
-    a.Cut('eta_cut',  'abs(Dijet_eta[0]) < 2.4 && abs(Dijet_eta[1]) < 2.4')
-    a.Cut('mjet_cut', 'Dijet_msoftdrop[0] > 50 && Dijet_msoftdrop[1] > 50')
-    a.Define('lead_vector',    'hardware::TLvector(Dijet_pt[0], Dijet_eta[0], Dijet_phi[0], Dijet_msoftdrop[0])')
-    a.Define('sublead_vector', 'hardware::TLvector(Dijet_pt[1], Dijet_eta[1], Dijet_phi[1], Dijet_msoftdrop[1])')
-    a.Define('invariantMass','hardware::InvariantMass({lead_vector,sublead_vector})')
-    a.Cut('mtw_cut','invariantMass > 1200')
+        # Initialize TIMBER analyzer
+        file_path = '{redirector}{rootfile_path}/{setname}_bstar{year}.root'.format(
+            redirector=redirector, rootfile_path=rootfile_path, setname=setname, year=year
+        )
+        file_path = CachedPath(file_path)
+        ThreadPolicy.EnableMT(threads, file_path, '{}_{}'.format(setname, year))
+        a = analyzer(file_path)
+
+        # Determine normalization weight
+        if not a.isData:
+            norm = helpers.getNormFactor(setname,year,config)
+        else:
+            norm = 1
+
+        # Book actions on the RDataFrame
+        a.Cut('filters',a.GetFlagString(flags))
+        a.Cut('trigger',a.GetTriggerString(triggers[year]))		# Apply different triggers based on the year
+        # With a skim the mass and mtw cuts are made after the skim (it keeps the events passing the pt and eta cuts),
+        # otherwise they are made with the rest of the preselection
+        if fused:
+            # One compiled function (DijetPreselection() in bstar.cc) replaces the hemisphere search, the cuts and the vectors below
+            # with one Define and one Cut, and stores the jet indices, invariant mass, deltaY and tau ratios in the `dijet` column.
+            # jetIdx and the Dijet_* collection (one Define per FatJet branch) are still built for the rest of the script
+            if skim:
+                helpers.FusedDijetPreselection(a, ptcut=400, etacut=2.4)
+            else:
+                helpers.FusedDijetPreselection(a, ptcut=400, etacut=2.4, msdcut=50, mtwcut=1200)
+            a.Define('invariantMass','dijet.mtw')
+        else:
+            a.Define('jetIdx','hemispherize(FatJet_phi, FatJet_jetId)') # need to calculate if we have two jets (with Id) that are back-to-back
+            a.Cut('nFatJets_cut','nFatJet > max(jetIdx[0],jetIdx[1])') 	# If we don't do this, we may try to access variables of jets that don't exist! (leads to seg fault)
+            a.Cut("hemis","(jetIdx[0] != -1)&&(jetIdx[1] != -1)") 	# cut on that calculation
+
+            # Having determined which events have two candidate jets meeting our criteria, let's make a collection specific to them
+            # Then, every event will have a two-element long column Dijet_<variable> corresponding to the values of the jets which passed our back-to-back criteria
+            a.SubCollection('Dijet', 'FatJet', 'jetIdx', useTake=True)
+
+            # We can now cut on the values of the Dijet collection and simply index 0 (lead) or 1 (sublead) to get the information about the appropriate jet
+            a.Cut('pt_cut',   'Dijet_pt[0] > 400 && Dijet_pt[1] > 400')
+            a.Cut('eta_cut',  'abs(Dijet_eta[0]) < 2.4 && abs(Dijet_eta[1]) < 2.4')
+            if not skim:
+                a.Cut('mjet_cut', 'Dijet_msoftdrop[0] > 50 && Dijet_msoftdrop[1] > 50')
+            a.Define('lead_vector',    'hardware::TLvector(Dijet_pt[0], Dijet_eta[0], Dijet_phi[0], Dijet_msoftdrop[0])')
+            a.Define('sublead_vector', 'hardware::TLvector(Dijet_pt[1], Dijet_eta[1], Dijet_phi[1], Dijet_msoftdrop[1])')
+            a.Define('invariantMass','hardware::InvariantMass({lead_vector,sublead_vector})')
+            if not skim:
+                a.Cut('mtw_cut', 'invariantMass > 1200')
+
+        # The b jet counting needs the full Jet collection so it is done before the skim
+        bcut = []
+        if year == '16' :
+            bcut = [0.2217,0.6321,0.8953]
+        elif year == '17' :
+            bcut = [0.1522,0.4941,0.8001]
+        elif year == '18' :
+            bcut = [0.1241,0.4184,0.7571]
+        a.Define('nbjet_loose',  'Sum(Jet_btagDeepB > '+str(bcut[0])+')') # DeepCSV loose WP
+        a.Define('nbjet_medium', 'Sum(Jet_btagDeepB > '+str(bcut[1])+')') # DeepCSV medium WP
+        a.Define('nbjet_tight',  'Sum(Jet_btagDeepB > '+str(bcut[2])+')') # DeepCSV tight WP
+        a.Define('norm',str(norm))
+        if skim:
+            # Decisions of the last two cuts, stored in the skim so that the N-1 (which does not make them) can run on it too
+            a.Define('mjet_pass', 'Dijet_msoftdrop[0] > 50 && Dijet_msoftdrop[1] > 50')
+            a.Define('mtw_pass',  'invariantMass > 1200')
+            skim_node = a.GetActiveNode() # the skim is written from here, in the same event loop as the histograms
+            a.Cut('mjet_cut', 'mjet_pass')
+            a.Cut('mtw_cut',  'mtw_pass')
 
     # Now, we can define the variables we're interested in plotting (see varnames dictionary in global definitions above)
     a.Define('deltaphi','hardware::DeltaPhi(Dijet_phi[0], Dijet_phi[1])')
-    a.Define('lead_tau32',    'Dijet_tau2[0] > 0 ? Dijet_tau3[0]/Dijet_tau2[0] : -1') # Conditional to make sure tau2 != 0 for division
-    a.Define('sublead_tau32', 'Dijet_tau2[1] > 0 ? Dijet_tau3[1]/Dijet_tau2[1] : -1') # condition ? <do if true> : <do if false>
-    a.Define('lead_tau21',    'Dijet_tau1[0] > 0 ? Dijet_tau2[0]/Dijet_tau1[0] : -1') # Conditional to make sure tau2 != 0 for division
-    a.Define('sublead_tau21', 'Dijet_tau1[1] > 0 ? Dijet_tau2[1]/Dijet_tau1[1] : -1') # condition ? <do if true> : <do if false>
+    if fused and not fromskim:
+        a.Define('lead_tau32',    'dijet.lead_tau32')
+        a.Define('sublead_tau32', 'dijet.sublead_tau32')
+        a.Define('lead_tau21',    'dijet.lead_tau21')
+        a.Define('sublead_tau21', 'dijet.sublead_tau21')
+    else:
+        a.Define('lead_tau32',    'Dijet_tau2[0] > 0 ? Dijet_tau3[0]/Dijet_tau2[0] : -1') # Conditional to make sure tau2 != 0 for division
+        a.Define('sublead_tau32', 'Dijet_tau2[1] > 0 ? Dijet_tau3[1]/Dijet_tau2[1] : -1') # condition ? <do if true> : <do if false>
+        a.Define('lead_tau21',    'Dijet_tau1[0] > 0 ? Dijet_tau2[0]/Dijet_tau1[0] : -1') # Conditional to make sure tau2 != 0 for division
+        a.Define('sublead_tau21', 'Dijet_tau1[1] > 0 ? Dijet_tau2[1]/Dijet_tau1[1] : -1') # condition ? <do if true> : <do if false>
     a.Define('lead_deepAK8_TvsQCD',    'Dijet_deepTag_TvsQCD[0]')
     a.Define('sublead_deepAK8_TvsQCD', 'Dijet_deepTag_TvsQCD[1]')
     a.Define('lead_deepAK8_WvsQCD',    'Dijet_deepTag_WvsQCD[0]')
     a.Define('sublead_deepAK8_WvsQCD', 'Dijet_deepTag_WvsQCD[1]')
-    bcut = []
-    if year == '16' :
-        bcut = [0.2217,0.6321,0.8953]
-    elif year == '17' :
-        bcut = [0.1522,0.4941,0.8001]
-    elif year == '18' :
-        bcut = [0.1241,0.4184,0.7571]
-    a.Define('nbjet_loose',  'Sum(Jet_btagDeepB > '+str(bcut[0])+')') # DeepCSV loose WP
-    a.Define('nbjet_medium', 'Sum(Jet_btagDeepB > '+str(bcut[1])+')') # DeepCSV medium WP
-    a.Define('nbjet_tight',  'Sum(Jet_btagDeepB > '+str(bcut[2])+')') # DeepCSV tight WP
     a.Define('lead_jetPt',   'Dijet_pt[0]')
     a.Define('sublead_jetPt','Dijet_pt[1]')
     a.Define('lead_softdrop_mass',   'Dijet_msoftdrop[0]')
     a.Define('sublead_softdrop_mass','Dijet_msoftdrop[1]')
-    a.Define('norm',str(norm))
 
     # Before finishing up, create plots of the variables stored in the varnames dictionary
     print('Plotting the following variables:')
     outFile = ROOT.TFile.Open('rootfiles/{}_{}_selection.root'.format(setname, year),'RECREATE')
     outFile.cd()
     # Book a group to save the histograms
-    hists = HistGroup('{}_{}'.format(setname, year))
+    # (all histograms are booked first and filled together in a single event loop by hists.Run())
+    hists = helpers.LazyHistGroup('{}_{}'.format(setname, year))
+    if profile:
+        # Booked first so that its timers are the first to evaluate every node (see NodeProfiler.py)
+        nodeprofile = NodeProfiler.NodeProfile([a.GetActiveNode()])
+        for action in nodeprofile.actions: hists.AddAction(action)
+    # Binning for every variable is stored in the BINNING section of the config
+    models = helpers.GetBinningRegistry(config).Models1D(varnames.keys(), prefix='{}_{}_'.format(setname, year))
     for varname in varnames.keys():
 	print('\t{}'.format(varname))
-        histname = '{}_{}_{}'.format(setname, year, varname)
-        # Arguments for binning that you would normally pass to a TH1
-        if "nbjet" in varname :
-            hist_tuple = (histname,histname, 10,0,10)
-        elif "tau" in varname :
-            hist_tuple = (histname,histname,20,0,1)
-        elif "Pt" in varname :
-            hist_tuple = (histname,histname,30,400,1000)
-        elif "phi" in varname :
-            hist_tuple = (histname,histname,30,-3.2,3.2)
-        elif "softdrop_mass" in varname :
-            hist_tuple = (histname,histname,30,0,300)
-        elif "invariantMass" in varname :
-            hist_tuple = (histname,histname,400,0,4000)
-        else:
-            hist_tuple = (histname,histname,20,0,1)
-	# Project dataframe into a histogram (hist name/binning tuple, variable to plot from dataframe, weight)
-	hist = a.GetActiveNode().DataFrame.Histo1D(hist_tuple,varname,'norm')
-	hist.GetValue()  		# this gets the actual TH1 instead of a pointer to the TH1. Here is when all the booked actions are performed, so may take a while for larger datasets (e.g. QCD)
-	hists.Add(varname, hist)	# add the TH1 to our HistGroup
+	# Book a projection of the dataframe into a histogram (binning model, variable to plot from dataframe, weight)
+	hists.Book1D(varname, a.GetActiveNode(), models[varname], varname, 'norm')
+    if skim and not fromskim:
+        hists.AddAction(helpers.BookSkim(a, setname, year, node=skim_node))
+    if cutflow:
+        # Counted in the same event loop as the histograms
+        cuts = Cutflow.Cutflow(a.GetActiveNode(), setname, year, 1. if fromskim else norm)
+        for action in cuts.actions: hists.AddAction(action)
+
+    # Here is when all the booked actions are performed, so may take a while for larger datasets (e.g. QCD)
+    hists.Run()
 
     # Now, perform TH1.Write() on all TH1s in our HistGroup
     hists.Do('Write')
+    if cutflow:
+        cuts.Write()
+        cuts.Save('rootfiles/{}_{}_selection_cutflow'.format(setname, year))
+
+    if profile:
+        nodeprofile.Save('rootfiles/{}_{}_selection_profile.json'.format(setname, year),
+                         '{}/{}_{}_selection_profile.dot'.format(plotdir, setname, year))
 
     # For fun, print the TIMBER node tree for a visualization of your selection
     a.PrintNodeTree('{}/{}_{}_selection_tree.dot'.format(plotdir,setname, year), verbose=True)
@@ -179,11 +232,22 @@ if __name__ == "__main__":
     parser.add_argument('-y', type=str, dest='year',
                         action='store', required=True,
                         help='Year of set (16, 17, 18).')
+    parser.add_argument('--fused', action='store_true',
+                        help='If flag passed, do the dijet preselection in one compiled function instead of the chain of cuts')
+    parser.add_argument('--skim', action='store_true',
+                        help='If flag passed, also write the events passing the pt and eta cuts to rootfiles/<setname>_<year>_skim.root')
+    parser.add_argument('--fromSkim', action='store_true', dest='fromskim',
+                        help='If flag passed, run on the skim written by a previous --skim run instead of the full file')
+    parser.add_argument('--profile', action='store_true',
+                        help='If flag passed, write the event counts and timing of every node to rootfiles/<setname>_<year>_selection_profile.json')
+    parser.add_argument('--cutflow', action='store_true',
+                        help='If flag passed, write the number of events after every cut to the output and to rootfiles/<setname>_<year>_selection_cutflow.json/.txt')
+    ThreadPolicy.AddThreadsArgument(parser)
     args = parser.parse_args()
 
     # Compile some of the C++ macros we'll need for our selection
     CompileCpp("TIMBER/Framework/include/common.h")
-    CompileCpp('bstar.cc')	# Contains hemispherize() function for identifying back-to-back jets
+    CompileCppCached('bstar.cc')	# Contains hemispherize() function for identifying back-to-back jets
 
     # Run our selection script.
-    select(args.setname, args.year)
+    select(args.setname, args.year, args.fused, args.skim, args.fromskim, args.threads, args.profile, args.cutflow)
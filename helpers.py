@@ -1,5 +1,7 @@
 from TIMBER.Tools.Common import OpenJSON
-import math, ROOT, collections
+from TIMBER.Analyzer import HistGroup
+import math, ROOT, collections, copy, array, os
+import numpy
 from collections import OrderedDict
 from TIMBER.Tools.CMS import CMS_lumi
 
@@ -27,6 +29,284 @@ def getNormFactor(setname,year,configPath):
 
     return norm
 
+def ReadArgsFile(argsfile,parser,defaults=None):
+    '''Parses a Condor-style argument file (ex. condor/2016_args.txt)
+       where each non-empty line holds the command line arguments of one job.
+       Lines starting with `#` are skipped.
+
+    Args:
+        argsfile (str): Path to the text file with one set of arguments per line.
+        parser (ArgumentParser): Parser used to interpret each line.
+        defaults (Namespace, optional): Options from the actual command line which apply
+            to every line unless the line sets them itself. Defaults to None.
+
+    Returns:
+        list(Namespace): One set of parsed arguments per line.
+    '''
+    out = []
+    with open(argsfile) as f:
+        for line in f:
+            line = line.strip()
+            if (line == '') or line.startswith('#'): continue
+            namespace = copy.copy(defaults) if defaults != None else None
+            out.append(parser.parse_args(line.split(),namespace=namespace))
+    return out
+
+def FusedDijetPreselection(a,ptcut=400,etacut=2.4,msdcut=-1,mtwcut=-1):
+    '''Books the dijet preselection as one compiled call (DijetPreselection() in bstar.cc)
+       instead of the chain of hemispherize(), nFatJets_cut, hemis, pt_cut, eta_cut, the two TLvectors
+       and InvariantMass. mjet_cut and mtw_cut are fused too when msdcut and mtwcut are given.
+       The result is stored in the `dijet` column with fields pass, lead_idx, sublead_idx, mtw
+       (filled whether or not mtwcut is given), deltaY (signed), lead_tau21, sublead_tau21, lead_tau32 and sublead_tau32.
+
+       The nodes booked are a Define (`dijet`), a Cut (`dijet_presel`), a Define (`jetIdx`) and the
+       SubCollection of `Dijet_*` (one Define per FatJet branch, as in the standard chain), so only
+       the hemisphere search, the cuts and the mass computation are fused, not the whole preselection.
+
+    Args:
+        a (analyzer): TIMBER analyzer with the filters and trigger already applied.
+        ptcut (float, optional): Minimum pt of both jets. Defaults to 400.
+        etacut (float, optional): Maximum |eta| of both jets. Defaults to 2.4.
+        msdcut (float, optional): Minimum softdrop mass of both jets. Negative to skip. Defaults to -1.
+        mtwcut (float, optional): Minimum dijet invariant mass. Negative to skip. Defaults to -1.
+
+    Returns:
+        Node: The active node after the preselection.
+    '''
+    a.Define('dijet','DijetPreselection(FatJet_pt, FatJet_eta, FatJet_phi, FatJet_msoftdrop, FatJet_tau1, FatJet_tau2, FatJet_tau3, FatJet_jetId, %s, %s, %s, %s)'%(ptcut,etacut,msdcut,mtwcut))
+    a.Cut('dijet_presel','dijet.pass')
+    a.Define('jetIdx','ROOT::VecOps::RVec<int>{dijet.lead_idx, dijet.sublead_idx}')
+    a.SubCollection('Dijet','FatJet','jetIdx',useTake=True)
+    return a.GetActiveNode()
+
+#############################################
+# Skim of the post-preselection Dijet tree  #
+#############################################
+# Columns written to the skim on top of Dijet_*. These are the ones that can not
+# be rebuilt from the Dijet_* columns alone (nbjet_* need the full Jet collection)
+# and the decisions of the cuts made after the skim (mjet_cut and mtw_cut of selection.py).
+skim_columns = ['jetIdx','norm','invariantMass','nbjet_loose','nbjet_medium','nbjet_tight','mjet_pass','mtw_pass']
+
+def SkimPath(setname,year,skimdir='rootfiles/'):
+    '''Path of the skim for a set and year.
+
+    Args:
+        setname (str): Name of the set (signal, background).
+        year (str): 16, 17, 18.
+        skimdir (str, optional): Directory of the skims. Defaults to `rootfiles/`.
+
+    Returns:
+        str: Path to the skim.
+    '''
+    return os.path.join(skimdir,'%s_%s_skim.root'%(setname,year))
+
+def BookSkim(a,setname,year,columns=skim_columns,skimdir='rootfiles/',node=None):
+    '''Books (but does not run) a Snapshot of the events at the active node
+       into a slim `Events` TTree holding only the `Dijet_*` columns plus `columns`.
+       The snapshot is lazy so that it is written in the same event loop as the histograms
+       (pass the result to LazyHistGroup.AddAction()). The downstream scripts can then run
+       on the skim (see SkimPath()) instead of the full NanoAOD file.
+
+    Args:
+        a (analyzer): TIMBER analyzer after the pt and eta cuts of the preselection.
+        setname (str): Name of the set (signal, background).
+        year (str): 16, 17, 18.
+        columns (list(str), optional): Columns to keep on top of Dijet_*. Defaults to skim_columns.
+        skimdir (str, optional): Directory of the skims. Defaults to `rootfiles/`.
+        node (Node, optional): Node to write instead of the active node. Defaults to None.
+
+    Returns:
+        RResultPtr: Lazy result of the Snapshot.
+    '''
+    if not os.path.exists(skimdir):
+        os.makedirs(skimdir)
+    if node == None: node = a.GetActiveNode()
+    column_vec = ROOT.std.vector('string')()
+    for c in node.DataFrame.GetColumnNames():
+        if str(c).startswith('Dijet_'): column_vec.push_back(str(c))
+    for c in columns:
+        column_vec.push_back(c)
+
+    opts = ROOT.RDF.RSnapshotOptions()
+    opts.fLazy = True
+    opts.fMode = 'RECREATE'
+    return node.DataFrame.Snapshot('Events',SkimPath(setname,year,skimdir),column_vec,opts)
+
+class BinningRegistry(object):
+    '''Histogram binning for every variable, read once from the `BINNING` section
+       of the config. Each entry is keyed by the variable (column) name and is either
+       `[nbins, min, max]` for fixed-width bins or `{"edges": [...]}` for variable-width bins.
+       Variables without an entry use `default`. 2D histograms take the binning of their
+       two axis variables unless the 2D histogram name has its own `{"x": ..., "y": ...}` entry.
+       Use GetBinningRegistry() to share one instance per config.
+    '''
+    def __init__(self,config='bstar_config.json'):
+        if isinstance(config,str): config = OpenJSON(config)
+        self.binning = config['BINNING']
+
+    def Axis(self,var):
+        '''Binning entry for a variable (or `default`).'''
+        return self.binning[var] if var in self.binning else self.binning['default']
+
+    def _AxisArgs(self,axis):
+        if isinstance(axis,dict):
+            edges = array.array('d',axis['edges'])
+            return [len(edges)-1, edges]
+        return [int(axis[0]), float(axis[1]), float(axis[2])]
+
+    def Model1D(self,histname,var):
+        '''TH1DModel for a variable.
+
+        Args:
+            histname (str): Name and title of the histogram.
+            var (str): Variable to look up.
+
+        Returns:
+            ROOT.RDF.TH1DModel
+        '''
+        return ROOT.RDF.TH1DModel(histname,histname,*self._AxisArgs(self.Axis(var)))
+
+    def Model2D(self,histname,xvar,yvar,name2d=None):
+        '''TH2DModel for a pair of variables.
+
+        Args:
+            histname (str): Name and title of the histogram.
+            xvar (str): Variable on the x-axis.
+            yvar (str): Variable on the y-axis.
+            name2d (str, optional): Name of the 2D entry to use instead of the axis variables, if it exists. Defaults to None.
+
+        Returns:
+            ROOT.RDF.TH2DModel
+        '''
+        if (name2d != None) and (name2d in self.binning):
+            xaxis, yaxis = self.binning[name2d]['x'], self.binning[name2d]['y']
+        else:
+            xaxis, yaxis = self.Axis(xvar), self.Axis(yvar)
+        return ROOT.RDF.TH2DModel(histname,histname,*(self._AxisArgs(xaxis)+self._AxisArgs(yaxis)))
+
+    def Models1D(self,varnames,prefix=''):
+        '''Builds the TH1DModels for all variables at once.
+
+        Args:
+            varnames (list(str)): Variables.
+            prefix (str, optional): Prepended to each variable to make the histogram name. Defaults to ''.
+
+        Returns:
+            OrderedDict: {variable: TH1DModel}
+        '''
+        return OrderedDict([(var,self.Model1D(prefix+var,var)) for var in varnames])
+
+    def Models2D(self,varpairs,prefix=''):
+        '''Builds the TH2DModels for all 2D histograms at once.
+
+        Args:
+            varpairs (dict): {2D histogram name: [xvar, yvar]}.
+            prefix (str, optional): Prepended to each 2D name to make the histogram name. Defaults to ''.
+
+        Returns:
+            OrderedDict: {2D histogram name: TH2DModel}
+        '''
+        return OrderedDict([(name,self.Model2D(prefix+name,pair[0],pair[1],name)) for name,pair in varpairs.items()])
+
+binning_registries = {}
+def GetBinningRegistry(config='bstar_config.json'):
+    '''Returns the BinningRegistry for a config path, loading it only the first time.'''
+    if config not in binning_registries:
+        binning_registries[config] = BinningRegistry(config)
+    return binning_registries[config]
+
+class LazyHistGroup(HistGroup):
+    '''HistGroup which books all of its histograms on the RDataFrame first
+       and only then runs the event loop, once, to fill all of them together.
+       Histograms can be booked on any node of the same analyzer.
+
+       Usage:
+       ```
+       hists = LazyHistGroup('name')
+       hists.Book1D('lead_tau32', a.GetActiveNode(), (hname,hname,20,0,1), 'lead_tau32', 'norm')
+       hists.Book2D(...)
+       hists.Run()          # one event loop for everything
+       hists.Do('Write')
+       ```
+    '''
+    def __init__(self,name):
+        super(LazyHistGroup,self).__init__(name)
+        self.booked = OrderedDict()
+        self.actions = []
+        self.nLoops = None
+
+    def Book1D(self,name,node,model,var,weight=None):
+        '''Books (but does not fill) a TH1 from a node.
+
+        Args:
+            name (str): Name to store the histogram under in the group.
+            node (Node): TIMBER node to project from.
+            model (tuple): Arguments for the TH1 (name, title, nbins, min, max) or a TH1DModel.
+            var (str): Column to plot.
+            weight (str, optional): Weight column. Defaults to None.
+        '''
+        if weight == None:
+            self.booked[name] = node.DataFrame.Histo1D(model,var)
+        else:
+            self.booked[name] = node.DataFrame.Histo1D(model,var,weight)
+        self._dataframe = node.DataFrame
+
+    def Book2D(self,name,node,model,xvar,yvar,weight=None):
+        '''Books (but does not fill) a TH2 from a node.
+
+        Args:
+            name (str): Name to store the histogram under in the group.
+            node (Node): TIMBER node to project from.
+            model (tuple): Arguments for the TH2 (name, title, nxbins, xmin, xmax, nybins, ymin, ymax) or a TH2DModel.
+            xvar (str): Column for the x-axis.
+            yvar (str): Column for the y-axis.
+            weight (str, optional): Weight column. Defaults to None.
+        '''
+        if weight == None:
+            self.booked[name] = node.DataFrame.Histo2D(model,xvar,yvar)
+        else:
+            self.booked[name] = node.DataFrame.Histo2D(model,xvar,yvar,weight)
+        self._dataframe = node.DataFrame
+
+    def AddAction(self,result):
+        '''Adds another lazy result (e.g. a Snapshot from BookSkim()) to be run
+           in the same event loop as the histograms. It is not added to the group.
+
+        Args:
+            result (RResultPtr): Lazy result booked on the same analyzer.
+        '''
+        self.actions.append(result)
+
+    def Run(self):
+        '''Runs the event loop once to fill every booked histogram and adds
+           the filled histograms to the group. Stores the number of event loops
+           that actually ran in `nLoops` (None if this ROOT version can not tell).
+
+        Returns:
+            int: Number of event loops run.
+        '''
+        if len(self.booked) == 0: return 0
+        counter = getattr(self._dataframe,'GetNRuns',None)
+        runs_before = counter() if counter != None else None
+
+        results = list(self.booked.values())
+        if hasattr(ROOT.RDF,'RunGraphs'):
+            ROOT.RDF.RunGraphs(results+self.actions)
+        else:
+            # All histograms hang off the same computation graph so the first
+            # GetValue() fills all of them (and runs the other actions) in the same loop
+            results[0].GetValue()
+        self.actions = []
+
+        for name,result in self.booked.items():
+            self.Add(name,result.GetValue())
+        self.booked = OrderedDict()
+
+        if counter != None:
+            self.nLoops = counter() - runs_before
+            print ('%s: filled %s histograms in %s event loop(s)'%(self.name,len(results),self.nLoops))
+        return self.nLoops
+
 def CompareShapesWithSoverB(outfilename,year,prettyvarname,bkgs={},signals={},names={},colors={},scale=True,stackBkg=True):
     '''Create a plot that compares the shapes of backgrounds versus signal.
        Backgrounds will be stacked together and signals will be plot separately.
@@ -213,87 +493,161 @@ def MakeSoverB(stack_of_bkgs,signal):
     signal peak and build the cumulative distributions backwards
     to the left of the peak and forwards to the right of the peak.
 
+    The calculation is done on arrays by SoverBMatrix().
+
     Args:
-        pad (TPad): TPad that's already built
         stack_of_bkgs (THStack): Stack of backgrounds, already normalized
             together, and as a sum normalized to 1.
-        signal (TH1): One histogram for signal. Can only calculate
-            s/sqrt(b) one signal at a time.
+        signal (TH1): One histogram for signal (use SoverBMatrix()
+            for several signals at once).
 
     Returns:
-        None
+        tuple(TH1,float): S/sqrt(B) histogram and the low edge of the
+            signal peak bin (False if not a mass-like distribution).
     '''
-    # Check where signal peak is relative to distribution
     total_bkgs = stack_of_bkgs.GetStack().Last()
+    matrix, peak_bin_edges = SoverBMatrix(total_bkgs,[signal])
+    print ('Mass-like distribution.' if peak_bin_edges[0] is not False else 'Not a mass distribution.')
+
+    # Clone and empty one for binning structure
+    s_over_b = total_bkgs.Clone(signal.GetName()+'_soverb')
+    s_over_b.Reset()
+    SetBinContents(s_over_b,numpy.concatenate([[0.],matrix[0],[0.]]))
+    return s_over_b, peak_bin_edges[0]
+
+def SoverBMatrix(total_bkgs,signals):
+    '''S/sqrt(B) of many signal hypotheses (ex. mass points) against the same background
+       at once, following the conventions of MakeSoverB(): forward or backward cumulative
+       distributions for distributions starting at 0 and split at the peak of each signal otherwise.
+    
+    Args:
+        total_bkgs (TH1): Sum of the backgrounds.
+        signals (list(TH1)): Signal histograms with the binning of total_bkgs.
+
+    Returns:
+        tuple(numpy.ndarray,list): S/sqrt(B) with one row per signal and one column per bin
+            (0 where there is no background), and the low edge of the peak bin of each
+            signal (False if not a mass-like distribution).
+    '''
     nbins = total_bkgs.GetNbinsX()
-    peak_bin = signal.GetMaximumBin()
+    bkg = BinContents(total_bkgs)[1:nbins+1]
+    sig = numpy.array([BinContents(signal)[1:nbins+1] for signal in signals])
+    peak_bins = numpy.argmax(sig,axis=1)+1
 
     if total_bkgs.GetXaxis().GetXmin() == 0:
-        if peak_bin == nbins:
-            forward = False
-        elif peak_bin == 1:
-            forward = True
-        else:
-            forward = True
-        peak_bin = False
-        print 'Not a mass distribution. Forward = %s'%forward
-    # If peak is non-zero, do background cumulative scan to left of peak
-    # and forward scan to right  
+        # Cut from below unless the signal peaks in the last bin
+        forward = (peak_bins != nbins)[:,None]
+        sig_int = numpy.where(forward,CumulativeSums(sig,True),CumulativeSums(sig,False))
+        bkg_int = numpy.where(forward,CumulativeSums(bkg,True),CumulativeSums(bkg,False))
+        peak_bin_edges = [False]*len(signals)
     else:
-        forward = None
-        print 'Mass-like distribution.'
-        # Clone original distirbution, set new range around peak, get cumulative
-        bkg_int_low  = MakeCumulative(total_bkgs,1,       peak_bin,forward=False)
-        bkg_int_high = MakeCumulative(total_bkgs,peak_bin,nbins+1, forward=True)
-
-        sig_int_low  = MakeCumulative(signal,1,       peak_bin,forward=False)
-        sig_int_high = MakeCumulative(signal,peak_bin,nbins+1, forward=True)
-
-        # Make empty versions of original histograms
-        bkg_int = total_bkgs.Clone()
-        bkg_int.Reset()
-        sig_int = signal.Clone()
-        sig_int.Reset()     
-
-        bkg_int.Add(bkg_int_low)
-        bkg_int.Add(bkg_int_high)
-        sig_int.Add(sig_int_low)
-        sig_int.Add(sig_int_high)
-
-    if forward != None:
-        # if forward == False:
-        #     total_bkgs.GetXaxis().SetRange(0,total_bkgs.GetNbinsX())
-        #     signal.GetXaxis().SetRange(0,signal.GetNbinsX())
-        bkg_int = MakeCumulative(total_bkgs,1, total_bkgs.GetNbinsX()+1,forward)
-        sig_int = MakeCumulative(signal,    1, signal.GetNbinsX()+1,    forward)
-        
-    # Clone and empty one for binning structure
-    s_over_b = bkg_int.Clone()
-    s_over_b.Reset()
+        sig_int = CumulativeSums(sig,peak_bins=peak_bins)
+        bkg_int = CumulativeSums(bkg,peak_bins=peak_bins)
+        peak_bin_edges = [total_bkgs.GetBinLowEdge(int(b)) for b in peak_bins]
 
-    # Build s/sqrt(b) per-bin
-    for ix in range(1,nbins+1):
-        if bkg_int.GetBinContent(ix) != 0:
-            val = sig_int.GetBinContent(ix)/math.sqrt(bkg_int.GetBinContent(ix))
-            s_over_b.SetBinContent(ix,val)
-        else:
-            s_over_b.SetBinContent(ix,0)
-            print ('WARNING: Background is empty for bin %s'%ix)
-        
-    peak_bin_edge = False
-    if peak_bin != False:
-        peak_bin_edge = bkg_int.GetBinLowEdge(peak_bin)
+    filled = bkg_int > 0
+    s_over_b = numpy.where(filled, sig_int/numpy.sqrt(numpy.where(filled,bkg_int,1.)), 0.)
+    if not filled.all():
+        print ('WARNING: Background is empty for %s of %s bins'%(numpy.count_nonzero(~filled),filled.size))
+    return s_over_b, peak_bin_edges
+
+def MakeSoverB2D(total_bkgs,signals,masses,name='soverb'):
+    '''S/sqrt(B) of many signal hypotheses as a TH2D with the variable on x
+       and one bin per signal (labelled by its mass) on y.
+
+    Args:
+        total_bkgs (TH1): Sum of the backgrounds.
+        signals (list(TH1)): Signal histograms with the binning of total_bkgs.
+        masses (list): Mass (or name) of each signal.
+        name (str, optional): Name of the histogram. Defaults to 'soverb'.
+
+    Returns:
+        TH2D
+    '''
+    matrix = SoverBMatrix(total_bkgs,signals)[0]
+    xaxis = total_bkgs.GetXaxis()
+    edges = array.array('d',[xaxis.GetBinLowEdge(i) for i in range(1,xaxis.GetNbins()+2)])
+    out = ROOT.TH2D(name,';%s;signal'%xaxis.GetTitle(),len(edges)-1,edges,len(masses),0,len(masses))
+    for i,mass in enumerate(masses):
+        out.GetYaxis().SetBinLabel(i+1,str(mass))
+    # Bins of a TH2 are stored row by row (x fastest) with the under/overflows around
+    contents = numpy.zeros((len(masses)+2,len(edges)+1))
+    contents[1:-1,1:-1] = matrix
+    SetBinContents(out,contents.ravel())
+    return out
+
+def BinContents(hist):
+    '''Contents of every bin of a histogram (under/overflows included) read in one go.
 
-    return s_over_b, peak_bin_edge
+    Args:
+        hist (TH1): Histogram.
+
+    Returns:
+        numpy.ndarray: float64 contents in the order of the global bin numbers.
+    '''
+    ncells = hist.GetNcells()
+    for histtype,dtype in [('TArrayD','f8'),('TArrayF','f4'),('TArrayI','i4'),('TArrayS','i2'),('TArrayC','i1')]:
+        if hist.InheritsFrom(histtype):
+            buf = hist.GetArray()
+            if hasattr(buf,'SetSize'): buf.SetSize(ncells) # buffers of older PyROOT do not know their length
+            return numpy.frombuffer(buf,dtype=dtype,count=ncells).astype(numpy.float64)
+    return numpy.array([hist.GetBinContent(i) for i in range(ncells)],dtype=numpy.float64)
+
+def SetBinContents(hist,contents):
+    '''Sets the contents of every bin of a histogram (under/overflows included) in one call.
+
+    Args:
+        hist (TH1): Histogram.
+        contents (numpy.ndarray): Contents in the order of the global bin numbers.
+    '''
+    hist.SetContent(numpy.ascontiguousarray(contents,dtype=numpy.float64))
+
+def CumulativeSums(values,forward=True,peak_bins=None):
+    '''Cumulative sums of bin contents.
+
+    Args:
+        values (numpy.ndarray): Contents of bins 1 to N, one row per histogram (or one 1D array).
+        forward (bool, optional): Sum from the first bin up (True) or from the last bin down (False). Defaults to True.
+        peak_bins (numpy.ndarray, optional): Peak bin (1 to N) for each row. If given, sums backward to the
+            left of the peak and forward from the peak to the right, and a single row of values is
+            used for every peak. Defaults to None.
+
+    Returns:
+        numpy.ndarray: Cumulative sums (one row per peak if peak_bins is given).
+    '''
+    values = numpy.asarray(values,dtype=numpy.float64)
+    if peak_bins is None:
+        if forward: return numpy.cumsum(values,axis=-1)
+        return numpy.cumsum(values[...,::-1],axis=-1)[...,::-1]
+
+    values = numpy.atleast_2d(values)
+    peaks = numpy.asarray(peak_bins)-1
+    rows = numpy.arange(len(peaks)) if len(values) == len(peaks) else numpy.zeros(len(peaks),dtype=int)
+    nbins = values.shape[1]
+    forward_sums = numpy.cumsum(values,axis=1)
+    backward_sums = numpy.cumsum(values[:,::-1],axis=1)[:,::-1]
+    # Sums of the bins before the peak and from the peak on
+    before_peak = numpy.concatenate([numpy.zeros((len(values),1)),forward_sums],axis=1)[rows,peaks][:,None]
+    from_peak = numpy.concatenate([backward_sums,numpy.zeros((len(values),1))],axis=1)[rows,peaks][:,None]
+    right = numpy.arange(nbins)[None,:] >= peaks[:,None]
+    return numpy.where(right, forward_sums[rows]-before_peak, backward_sums[rows]-from_peak)
 
 def MakeCumulative(hist,low,high,forward=True):
+    '''Cumulative distribution of the bins low to high-1 of a histogram
+       (the other bins are empty).
+
+    Args:
+        hist (TH1): Histogram.
+        low (int): First bin.
+        high (int): One past the last bin.
+        forward (bool, optional): Sum from low up (True) or from high-1 down (False). Defaults to True.
+
+    Returns:
+        TH1: Cumulative histogram named <name>_cumul.
+    '''
     out = hist.Clone(hist.GetName()+'_cumul')
     out.Reset()
-    prev = 0
-    if forward: to_scan = range(low,high)
-    else: to_scan = range(high-1,low-1,-1)
-    for ix in to_scan:
-        val = prev + hist.GetBinContent(ix)
-        out.SetBinContent(ix,val)
-        prev = val
+    contents = numpy.zeros(hist.GetNcells())
+    contents[low:high] = CumulativeSums(BinContents(hist)[low:high],forward)
+    SetBinContents(out,contents)
     return out
@@ -8,8 +8,8 @@ float Particle::DeltaR(LVector input_vector) {
     return ROOT::Math::VectorUtil::DeltaR(vect,input_vector);
 };
 
-/**Constructor which takes in all info from the GenPart collection in NanoAOD 
- * Just assigns the inputs to internal variables.
+/**Constructor which takes in all info from the GenPart collection in NanoAOD.
+ * Only keeps pointers to the data of the columns (no copy).
  * @param in_pt $\f p_{T} $\f
  * @param in_eta $\f \eta $\f
  * @param in_phi $\f \phi $\f
@@ -19,137 +19,223 @@ float Particle::DeltaR(LVector input_vector) {
  * @param in_statusFlags Status flags
  * @param in_genPartIdxMother Mother indices
  * */
-GenParticleObjs::GenParticleObjs(RVec<float> in_pt, 
-                RVec<float> in_eta, RVec<float> in_phi, 
-                RVec<float> in_m, RVec<int> in_pdgId, 
-                RVec<int> in_status, RVec<int> in_statusFlags, 
-                RVec<int> in_genPartIdxMother) {
-
-    GenPartCollection.RVecInt = { 
-        {"pdgId",&in_pdgId},
-        {"status",&in_status},
-        {"statusFlags",&in_statusFlags},
-        {"genPartIdxMother",&in_genPartIdxMother}
-    };
-    GenPartCollection.RVecFloat = { 
-        {"pt",&in_pt},
-        {"eta",&in_eta},
-        {"phi",&in_phi},
-        {"m",&in_m}
-    };
-
-    // Settings for the "set" particle
-    particle.index = -1;
+GenParticleObjs::GenParticleObjs(const RVec<float>& in_pt, 
+                const RVec<float>& in_eta, const RVec<float>& in_phi, 
+                const RVec<float>& in_m, const RVec<int>& in_pdgId, 
+                const RVec<int>& in_status, const RVec<int>& in_statusFlags, 
+                const RVec<int>& in_genPartIdxMother) :
+    GenParticleObjs(in_pt, in_eta, in_phi, in_m, in_pdgId, in_genPartIdxMother) {
+    status = in_status.data();
+    statusFlags = in_statusFlags.data();
+}
 
+/**Constructor with only the kinematics, PDG IDs and mothers
+ * (ex. for matching). The status and status flags are not available. */
+GenParticleObjs::GenParticleObjs(const RVec<float>& in_pt, 
+                const RVec<float>& in_eta, const RVec<float>& in_phi, 
+                const RVec<float>& in_m, const RVec<int>& in_pdgId, 
+                const RVec<int>& in_genPartIdxMother) {
+    n = in_pt.size();
+    pt = in_pt.data();
+    eta = in_eta.data();
+    phi = in_phi.data();
+    m = in_m.data();
+    pdgId = in_pdgId.data();
+    genPartIdxMother = in_genPartIdxMother.data();
 }
 
 /**Constructor which takes in a pre-built collection.
  * @param genParts @ref Collection object filled with GenPart branches from NanoAOD.
  */
-GenParticleObjs::GenParticleObjs(Collection genParts) {
-    GenPartCollection = genParts;
+GenParticleObjs::GenParticleObjs(Collection genParts) :
+    GenParticleObjs(*genParts.RVecFloat["pt"], *genParts.RVecFloat["eta"],
+                    *genParts.RVecFloat["phi"], *genParts.RVecFloat["m"],
+                    *genParts.RVecInt["pdgId"], *genParts.RVecInt["status"],
+                    *genParts.RVecInt["statusFlags"], *genParts.RVecInt["genPartIdxMother"]) {
 };
 
-/**Sets the status flags for the current particle.
- * Called by \ref SetIndex. */
-void GenParticleObjs::SetStatusFlags(int particleIndex){
-    for (auto it = GenParticleStatusFlags.begin(); it != GenParticleStatusFlags.end(); ++it) {
-        particle.statusFlags[it->first] = BitChecker(it->second, GenPartCollection.RVecInt["statusFlags"]->at(particleIndex));
-    }
+/**Handle to a particle.
+ * @param idx The index in the collection.
+ * @return GenParticle */
+GenParticle GenParticleObjs::Get(int idx) const {
+    return GenParticle(this, idx);
+}
+
+/**Fills a tree node with a particle (see \ref GenParticleTree::AddParticle).
+ * @param idx The index in the collection.
+ * @param particle Particle to fill. Its children are not changed. */
+void GenParticleObjs::FillParticle(int idx, Particle& particle) const {
+    particle.index = idx;
+    particle.pdgId = const_cast<int*>(&pdgId[idx]); // only read
+    particle.status = status != nullptr ? const_cast<int*>(&status[idx]) : nullptr;
+    particle.statusFlags = statusFlags != nullptr ? statusFlags[idx] : 0;
+    particle.parentIndex = genPartIdxMother[idx];
+    particle.vect.SetCoordinates(pt[idx], eta[idx], phi[idx], m[idx]);
 }
 
 // ************************ //
 // Physics member functions //
 // ************************ //
 
+/**Calculates $\f\Delta R$\f between the particle and input vector.
+ * @param input_vector The vector to compare against the particle. 
+ * @return $\f\Delta R$\f value. */
+float GenParticle::DeltaR(LVector input_vector) const {
+    return ROOT::Math::VectorUtil::DeltaR(vect(),input_vector);
+}
 
-/**Compares set particle to a provided vector 
- * @param vect The vector to compare against the current particle. 
- * @return Map with keys "sameHemisphere" (phi<pi), "deltaR" 
- * (deltaR < 0.8), "deltaM" (|delta m|/m_gen < 0.05) which 
- * all return bools. */
-std::map< std::string, bool> 
-    GenParticleObjs::CompareToVector(LVector vect) {
-    std::map< std::string, bool> out;
-    out["sameHemisphere"] = (ROOT::Math::VectorUtil::DeltaPhi(particle.vect,vect) < M_PI);
-    out["deltaR"] = (particle.DeltaR(vect) < 0.8);
-    out["deltaM"] = (std::abs(vect.M() - particle.vect.M())/particle.vect.M() < 0.05);
+/**Compares the particle to a provided vector 
+ * @param vect The vector to compare against the particle. 
+ * @return GenVectorComparison with sameHemisphere (phi<pi), deltaR 
+ * (deltaR < 0.8) and deltaM (|delta m|/m_gen < 0.05). */
+GenVectorComparison GenParticle::CompareToVector(LVector vect) const {
+    LVector gen = this->vect();
+    GenVectorComparison out;
+    out.sameHemisphere = (ROOT::Math::VectorUtil::DeltaPhi(gen,vect) < M_PI);
+    out.deltaR = (ROOT::Math::VectorUtil::DeltaR(gen,vect) < 0.8);
+    out.deltaM = (std::abs(vect.M() - gen.M())/gen.M() < 0.05);
     return out;
-};
-
-// ******************************* //
-// Organizational member functions //
-// ******************************* //
-/**Sets the index of the lookup particle 
- * @param idx The index in the collection 
- * @return None */
-Particle GenParticleObjs::SetIndex(int idx) {
-    particle.index = idx;
-    particle.pdgId = &GenPartCollection.RVecInt["pdgId"]->at(idx);
-    SetStatusFlags(idx);
-    particle.parentIndex = GenPartCollection.RVecInt["genPartIdxMother"]->at(idx);
-    particle.vect.SetCoordinates(
-        GenPartCollection.RVecFloat["pt"]->at(idx),
-        GenPartCollection.RVecFloat["eta"]->at(idx),
-        GenPartCollection.RVecFloat["phi"]->at(idx),
-        GenPartCollection.RVecFloat["m"]->at(idx)
-        );
+}
 
-    return particle;
-};   
-/**Returns the bool for the flag name provided
- * @param  flagName*/
-int GenParticleObjs::GetStatusFlag(std::string flagName){
-    return particle.statusFlags[flagName];
-};
+//////////////////////////////////////
+// GenChainPattern Member Functions //
+//////////////////////////////////////
+/**Compiles a chain string.
+ * @param chainstring Chain (ex. `6>24>1:5`, see \ref GenChainPattern).
+ * @throw std::invalid_argument if a step is empty or not made of integers. */
+GenChainPattern::GenChainPattern(std::string chainstring) : chainstring(chainstring) {
+    std::vector<std::string> steps = split(chainstring,'>');
+    if (steps.size() == 0) throw std::invalid_argument("Empty decay chain");
+    std::reverse(steps.begin(), steps.end());
+    stepStart.push_back(0);
+    for (int istep = 0; istep < steps.size(); istep++) {
+        std::vector<std::string> items = split(steps[istep],',');
+        if (items.size() == 0) throw std::invalid_argument("Empty step in decay chain "+chainstring);
+        for (int iitem = 0; iitem < items.size(); iitem++) {
+            std::string item = items[iitem];
+            size_t colon = item.find(':');
+            try {
+                if (colon == std::string::npos) {
+                    lows.push_back(std::abs(std::stoi(item)));
+                    highs.push_back(lows.back());
+                } else {
+                    int start = std::abs(std::stoi(item.substr(0,colon)));
+                    int stop = std::abs(std::stoi(item.substr(colon+1)));
+                    lows.push_back(std::min(start,stop));
+                    highs.push_back(std::max(start,stop));
+                }
+            } catch (const std::logic_error&) {
+                throw std::invalid_argument("Could not parse step "+steps[istep]+" of decay chain "+chainstring);
+            }
+        }
+        stepStart.push_back(lows.size());
+    }
+}
 
 //////////////////////////////////////
 // GenParticleTree Member Functions //
 //////////////////////////////////////
-std::vector<int> GenParticleTree::StoredIndexes(){
-    std::vector<int> current_idxs {};
+/**Makes room for nParticles nodes. Growing the storage moves the
+ * particles so the node pointers are set again.
+ * @param nParticles Number of nodes needed. */
+void GenParticleTree::Reserve(int nParticles) {
+    if (nParticles <= (int)storage.size()) return;
+    storage.resize(std::max(nParticles, 2*(int)storage.size()));
     for (int i = 0; i < nodes.size(); i++) {
-        current_idxs.push_back(nodes.at(i)->index);
+        nodes[i] = &storage[i];
     }
-    return current_idxs;
 }
 
-void GenParticleTree::AddParticle(Particle* particle) {
-    Particle* staged_node = particle;
-
-    // First check if current heads don't have new parents and 
-    // remove them from heads if they do
-    std::vector<int> heads_to_delete {};
-    for (int i = 0; i < heads.size(); i++) {
-        if (heads.at(i)->parentIndex == staged_node->index) {
-            heads_to_delete.push_back(i);
-        }
+/**Empties the tree for a new event, keeping the memory of the previous ones.
+ * The pointers returned by the tree stay valid until the next call
+ * as long as no more than nParticles particles are added.
+ * @param nParticles Number of particles that will be added (ex. nGenPart). */
+void GenParticleTree::Reset(int nParticles) {
+    for (int i = 0; i < nodes.size(); i++) {
+        nodeIndex[nodes[i]->index] = -1;
     }
-    // Need to delete indices in reverse order so as not to shift 
-    // indices after a deletion
-    for (int ih = heads_to_delete.size(); ih >= 0; ih--) {
-        heads.erase(heads.begin()+ih);
-    }
-   
-    // Next identify staged node has no parent (heads)
-    // If no parent, no other infor we can get from this particle
-    std::vector<int> indexes = StoredIndexes();
-    if (FindInList(staged_node->parentIndex, indexes)) {
-        heads.push_back(staged_node);
-        nodes.push_back(staged_node);
+    nodes.clear();
+    heads.clear();
+    orphans.clear();
+    Reserve(nParticles);
+    if (nodeIndex.size() < nParticles) nodeIndex.resize(nParticles,-1);
+}
+
+/**Node of a particle from its index in the collection.
+ * @param index Index in the collection.
+ * @return Position in nodes or -1 if the particle is not in the tree. */
+int GenParticleTree::NodeOf(int index) {
+    if (index < 0 || index >= nodeIndex.size()) return -1;
+    return nodeIndex[index];
+}
+
+/**Copies a particle into a stored one, without children
+ * (which keeps the memory of the children vector of the storage).
+ * @param from Particle to copy.
+ * @param to Particle of the storage. */
+void GenParticleTree::CopyParticle(Particle* from, Particle* to) {
+    to->flag = from->flag;
+    to->index = from->index;
+    to->pdgId = from->pdgId;
+    to->status = from->status;
+    to->statusFlags = from->statusFlags;
+    to->parentIndex = from->parentIndex;
+    to->vect = from->vect;
+    to->childIndex.clear();
+}
+
+/**Adds a copy of a particle to the tree and links it to its parent
+ * (and to its children if they were added before it).
+ * @param particle Particle to add (ex. filled by GenParticleObjs::FillParticle).
+ * @return The copy stored in the tree. */
+Particle* GenParticleTree::AddParticle(Particle* particle) {
+    int inode = nodes.size();
+    Reserve(inode+1);
+    Particle* staged_node = &storage[inode];
+    CopyParticle(particle, staged_node);
+    nodes.push_back(staged_node);
+    if (staged_node->index >= nodeIndex.size()) nodeIndex.resize(staged_node->index+1,-1);
+    nodeIndex[staged_node->index] = inode;
+
+    // Link to the parent if it is already in the tree
+    int parent_node = NodeOf(staged_node->parentIndex);
+    if (parent_node >= 0) {
+        nodes[parent_node]->AddChild(inode);
     } else {
-        for (int inode = 0; inode < nodes.size(); inode++) {
-            if (staged_node->parentIndex == nodes[inode]->index){
-                staged_node->AddParent(inode);
-                nodes.at(inode)->AddChild(nodes.size());
-                nodes.push_back(staged_node);
-            }
-        }        
+        heads.push_back(inode);
+        if (staged_node->parentIndex >= 0) orphans.push_back(inode);
     }
+
+    // Adopt the nodes that were added before this one, their parent.
+    // Never happens when the collection is added in order since
+    // mothers always come before their daughters in NanoAOD.
+    if (orphans.size() > 0) {
+        auto adopted = std::remove_if(orphans.begin(), orphans.end(), [&](int orphan) {
+            if (nodes[orphan]->parentIndex != staged_node->index) return false;
+            staged_node->AddChild(orphan);
+            return true;
+        });
+        if (adopted != orphans.end()) {
+            orphans.erase(adopted, orphans.end());
+            heads.erase(std::remove_if(heads.begin(), heads.end(), [&](int head) {
+                return NodeOf(nodes[head]->parentIndex) >= 0;
+            }), heads.end());
+        }
+    }
+    return staged_node;
 };
 
+/**Particle in the tree from its index in the collection.
+ * @param index Index in the collection.
+ * @return The particle or a particle with flag == false if it is not in the tree. */
+Particle* GenParticleTree::GetParticle(int index) {
+    int inode = NodeOf(index);
+    return inode >= 0 ? nodes[inode] : &NoneParticle;
+}
+
 std::vector<Particle*> GenParticleTree::GetChildren(Particle* particle){
     std::vector<Particle*> children {};
+    children.reserve(particle->childIndex.size());
     for (int i = 0; i < particle->childIndex.size(); i++) {
         children.push_back(nodes[particle->childIndex.at(i)]);
     }
@@ -157,83 +243,232 @@ std::vector<Particle*> GenParticleTree::GetChildren(Particle* particle){
 }
 
 Particle* GenParticleTree::GetParent(Particle* particle) {
-    if (nodes.size() > particle->parentIndex){
-        return nodes.at(particle->parentIndex);
-    } else {
-        return &NoneParticle;
-    }
-    
+    return GetParticle(particle->parentIndex);
 }
 
-bool GenParticleTree::MatchParticleToString(Particle* particle, std::string string){
-    std::vector<int> pdgIds {}; 
-    if (FindInString(":",string)) {
-        int startId = std::stoi( string.substr(0,string.find(':')) );
-        int stopId  = std::stoi( string.substr(1,string.find(':')) );
-        pdgIds = range(startId, stopId);
-    } else if (FindInString(",",string)) {
-        auto splits = split(string,',');
-        for (int istr = 0; istr < splits.size(); istr++) {
-            pdgIds.push_back( std::stoi(splits.at(istr)) );
+/**Number of particles in the chain that ends with a particle
+ * (walking up the parents, copies of a particle with the same PDG ID
+ * are part of the chain). Nothing is allocated.
+ * @param node Last particle of the chain.
+ * @param pattern Compiled chain.
+ * @return Number of particles in the chain or 0 if it does not match. */
+int GenParticleTree::ChainLength(Particle* node, const GenChainPattern& pattern) {
+    if (!pattern.Matches(0, *node->pdgId)) return 0;
+    int length = 1;
+    for (int step = 1; step < pattern.size(); length++) {
+        Particle* parent = GetParent(node);
+        if (parent->flag == false) {
+            return 0;
+        } else if (pattern.Matches(step, *parent->pdgId)) {
+            step++;
+        } else if (*parent->pdgId != *node->pdgId) {
+            return 0;
         }
+        node = parent;
     }
+    return length;
+}
 
-    bool out;
-    if (pdgIds.size() == 0) {
-        if (std::abs(*particle->pdgId) == std::stoi(string)) {
-            out = true;
-        } else {out = false;}
-    } else {
-        if (FindInList(std::abs(*particle->pdgId), pdgIds)) {
-            out = true;
-        } else {out = false;}
+/**Fills a chain found by \ref ChainLength.
+ * @param node Last particle of the chain.
+ * @param length Number of particles in the chain.
+ * @param chain Output, from the last particle to the ancestor. */
+void GenParticleTree::FillChain(Particle* node, int length, std::vector<Particle*>& chain) {
+    chain.resize(length);
+    chain[0] = node;
+    for (int i = 1; i < length; i++) {
+        chain[i] = GetParent(chain[i-1]);
+    }
+}
+
+/**Finds the decay chains in the tree.
+ * @param chainstring Chain (ex. `6>24>1:5`, see \ref GenChainPattern).
+ * Compile it once with GenChainPattern when searching every event.
+ * @return Every chain found, from the last particle to the ancestor. */
+std::vector<std::vector<Particle*>> GenParticleTree::FindChain(std::string chainstring) {
+    return FindChain(GenChainPattern(chainstring));
+}
+
+/**Finds the decay chains in the tree.
+ * @param pattern Compiled chain.
+ * @return Every chain found, from the last particle to the ancestor. */
+std::vector<std::vector<Particle*>> GenParticleTree::FindChain(const GenChainPattern& pattern) {
+    std::vector<std::vector<Particle*>> out;
+    for (int inode = 0; inode < nodes.size(); inode++) {
+        int length = ChainLength(nodes[inode], pattern);
+        if (length > 0) {
+            out.emplace_back();
+            FillChain(nodes[inode], length, out.back());
+        }
     }
+    return out;
+}
 
+/**Finds several decay chains (ex. `6>24>1:5` and `6>5`)
+ * in one pass over the tree.
+ * @param patterns Compiled chains.
+ * @return The chains found for every pattern (same order as patterns),
+ * each from the last particle to the ancestor. */
+std::vector<std::vector<std::vector<Particle*>>> GenParticleTree::FindChains(const std::vector<GenChainPattern>& patterns) {
+    std::vector<std::vector<std::vector<Particle*>>> out(patterns.size());
+    for (int inode = 0; inode < nodes.size(); inode++) {
+        for (int ipattern = 0; ipattern < patterns.size(); ipattern++) {
+            int length = ChainLength(nodes[inode], patterns[ipattern]);
+            if (length > 0) {
+                out[ipattern].emplace_back();
+                FillChain(nodes[inode], length, out[ipattern].back());
+            }
+        }
+    }
     return out;
 }
 
-std::vector<Particle*> GenParticleTree::RunChain(Particle* node, std::vector<std::string> chain) {
-    std::vector<Particle*> nodechain {node};
-    Particle* parent = GetParent(node);
-    std::vector<std::string> chain_minus_first = {chain.begin()+1,chain.end()};
-    
-    if (chain.size() == 0) {
-        return nodechain;
-    } else if (parent->flag == false) {
-        nodechain.push_back(&NoneParticle);
-    } else if (MatchParticleToString(parent, chain.at(0))) {
-        Extend(nodechain, RunChain(parent,chain_minus_first));
-    } else if (parent->pdgId == node->pdgId) {
-        Extend(nodechain, RunChain(parent, chain));
-    } else {
-        nodechain.push_back(&NoneParticle);
+////////////////////////////////////
+// GenJetMatcher Member Functions //
+////////////////////////////////////
+/**Follows a particle down its copies (children with the same PDG ID).
+ * @param particle Particle in the tree.
+ * @return The last copy, the one that decays. */
+Particle* GenJetMatcher::LastCopy(Particle* particle) {
+    bool found = true;
+    while (found) {
+        found = false;
+        std::vector<Particle*> children = tree.GetChildren(particle);
+        for (int i = 0; i < children.size(); i++) {
+            if (*children[i]->pdgId == *particle->pdgId) {
+                particle = children[i];
+                found = true;
+                break;
+            }
+        }
+    }
+    return particle;
+}
+
+/**Adds the quarks of the hadronic decay of a top (the b and the quarks
+ * of the W) or of a W.
+ * @param particle Last copy of the top or W.
+ * @param quarks Vector the quarks are added to. */
+void GenJetMatcher::AddQuarks(Particle* particle, std::vector<Particle*>& quarks) {
+    const bool isTop = std::abs(*particle->pdgId) == 6;
+    std::vector<Particle*> children = tree.GetChildren(particle);
+    for (int i = 0; i < children.size(); i++) {
+        int child_pdgId = std::abs(*children[i]->pdgId);
+        if (isTop && child_pdgId == 5) {
+            quarks.push_back(children[i]);
+        } else if (isTop && child_pdgId == 24) {
+            AddQuarks(LastCopy(children[i]), quarks);
+        } else if (!isTop && child_pdgId >= 1 && child_pdgId <= 5) {
+            quarks.push_back(children[i]);
+        }
+    }
+}
+
+/**Builds the tree of the event and finds the quarks of every top and W.
+ * @param genParts View of the gen particles of the event. */
+void GenJetMatcher::Build(const GenParticleObjs& genParts) {
+    const int nGenPart = genParts.size();
+    tree.Reset(nGenPart);
+    for (int i = 0; i < nGenPart; i++) {
+        genParts.FillParticle(i, staged);
+        tree.AddParticle(&staged);
     }
 
-    return nodechain;
+    // Keep the vectors of the previous events and only count the ones used
+    nTops = 0; nWs = 0;
+    for (int i = 0; i < nGenPart; i++) {
+        Particle* particle = tree.GetParticle(i);
+        int pdgId = std::abs(*particle->pdgId);
+        if ((pdgId != 6 && pdgId != 24) || LastCopy(particle) != particle) continue;
+        std::vector<Particle*>& decays = pdgId == 6 ? tops : Ws;
+        std::vector<std::vector<Particle*>>& quarks = pdgId == 6 ? topQuarks : WQuarks;
+        int& n = pdgId == 6 ? nTops : nWs;
+        if (n == decays.size()) {
+            decays.push_back(particle);
+            quarks.emplace_back();
+        } else {
+            decays[n] = particle;
+            quarks[n].clear();
+        }
+        AddQuarks(particle, quarks[n]);
+        n++;
+    }
 }
 
-std::vector<std::vector<Particle*>> GenParticleTree::FindChain(std::string chainstring) {
-    std::vector<std::string> reveresed_chain = split(chainstring,'>');
-    std::reverse(reveresed_chain.begin(), reveresed_chain.end());
+/**Builds the tree of the event from the GenPart columns (see \ref Build(const GenParticleObjs&)). */
+void GenJetMatcher::Build(int nGenPart, const RVec<float>& GenPart_pt, const RVec<float>& GenPart_eta,
+                          const RVec<float>& GenPart_phi, const RVec<float>& GenPart_mass,
+                          const RVec<int>& GenPart_pdgId, const RVec<int>& GenPart_genPartIdxMother) {
+    Build(GenParticleObjs(GenPart_pt, GenPart_eta, GenPart_phi, GenPart_mass, GenPart_pdgId, GenPart_genPartIdxMother));
+}
 
-    std::vector<std::string> reveresed_chain_minus_first = {reveresed_chain.begin()+1,reveresed_chain.end()};
+/**Category of a jet from the decays matched to it.
+ * @param jet Jet vector.
+ * @param decays Tops or Ws.
+ * @param quarks Quarks of every decay.
+ * @param nDecays Number of decays in the event.
+ * @param nQuarks Number of quarks of a hadronic decay (3 for tops, 2 for Ws).
+ * @return GenMergeCategory */
+int GenJetMatcher::Category(LVector jet, std::vector<Particle*>& decays, std::vector<std::vector<Particle*>>& quarks, int nDecays, int nQuarks) {
+    int total = 0, inJet = 0;
+    for (int i = 0; i < nDecays; i++) {
+        if (decays[i]->DeltaR(jet) >= 0.8) continue;
+        for (int iq = 0; iq < quarks[i].size(); iq++) {
+            total++;
+            if (quarks[i][iq]->DeltaR(jet) < 0.8) inJet++;
+        }
+    }
+    if (total != nQuarks || inJet == 0) return kNoMatch;
+    if (inJet == total) return kMerged;
+    if (inJet > 1) return kSemiMerged;
+    return kNotMerged;
+}
 
-    std::vector<Particle*> chain_result;
-    std::vector<std::vector<Particle*>> out;
+/**Category of a jet with the tops of the event (after \ref Build).
+ * @param jet Jet vector.
+ * @return GenMergeCategory */
+int GenJetMatcher::TopCategory(LVector jet) {
+    return Category(jet, tops, topQuarks, nTops, 3);
+}
 
-    for (int inode = 0; inode < nodes.size(); inode++) {
-        Particle* n = nodes[inode];
-        if (MatchParticleToString(n, reveresed_chain.at(0))) {
-            chain_result = RunChain(n,reveresed_chain_minus_first);
-            bool no_NoneParticle = true;
-            for (int icr = 0; icr < chain_result.size(); icr++) {
-                if (chain_result[icr]->flag == false) {
-                    no_NoneParticle = false;
-                    break;
-                }
-            }
-            if (no_NoneParticle) {out.push_back(chain_result);}
-        } 
+/**Category of a jet with the Ws of the event (after \ref Build).
+ * @param jet Jet vector.
+ * @return GenMergeCategory */
+int GenJetMatcher::WCategory(LVector jet) {
+    return Category(jet, Ws, WQuarks, nWs, 2);
+}
+
+/**Categories of several jets with the tops and Ws of the event (after \ref Build).
+ * @param jet_eta \f$\eta\f$ of each jet.
+ * @param jet_phi \f$\phi\f$ of each jet.
+ * @param jetIdx Jets to match (ex. jetIdx of hemispherize()). Empty for all jets.
+ * Negative indices get kNoMatch.
+ * @return GenJetMatches with one entry per jet (or per jetIdx entry). */
+GenJetMatches GenJetMatcher::Match(const RVec<float>& jet_eta, const RVec<float>& jet_phi, const RVec<int>& jetIdx) {
+    const bool useIndex = jetIdx.size() > 0;
+    const int nJets = useIndex ? jetIdx.size() : jet_eta.size();
+    GenJetMatches out;
+    out.top.resize(nJets, kNoMatch);
+    out.W.resize(nJets, kNoMatch);
+    for (int i = 0; i < nJets; i++) {
+        int ijet = useIndex ? jetIdx[i] : i;
+        if (ijet < 0) continue;
+        LVector jet(1., jet_eta[ijet], jet_phi[ijet], 0.); // only the direction is used
+        out.top[i] = TopCategory(jet);
+        out.W[i] = WCategory(jet);
     }
     return out;
-}
\ No newline at end of file
+}
+
+/**Matches jets to the generator tops and Ws, building the tree of the
+ * event once for all the jets. Uses one \ref GenJetMatcher per thread.
+ * @return GenJetMatches with one entry per jet (or per jetIdx entry). */
+GenJetMatches MatchJetsToGen(const RVec<float>& FatJet_eta, const RVec<float>& FatJet_phi,
+                             int nGenPart, const RVec<float>& GenPart_pt, const RVec<float>& GenPart_eta,
+                             const RVec<float>& GenPart_phi, const RVec<float>& GenPart_mass,
+                             const RVec<int>& GenPart_pdgId, const RVec<int>& GenPart_genPartIdxMother,
+                             const RVec<int>& jetIdx) {
+    static thread_local GenJetMatcher matcher;
+    matcher.Build(nGenPart, GenPart_pt, GenPart_eta, GenPart_phi, GenPart_mass, GenPart_pdgId, GenPart_genPartIdxMother);
+    return matcher.Match(FatJet_eta, FatJet_phi, jetIdx);
+}
@@ -30,7 +30,7 @@ class Particle {
         int index; /**< Index in collection */
         int* pdgId; /**< PDG ID of particle */
         int* status; /**< Pythia status of particle */
-        std::map <std::string, int> statusFlags; /**< Map of status flags for set gen particle  */
+        int statusFlags = 0; /**< Status flags of the particle, one bit per flag (see GenStatusFlag) */
         int parentIndex; /**< Parent index  */
         std::vector<int> childIndex; /**< Children indices */
         LVector vect; /**< Lorentz vector */
@@ -42,6 +42,9 @@ class Particle {
             childIndex.push_back(idx);
         }
         float DeltaR(LVector input_vector);
+        /**Status flag of the particle.
+         * @param bit Bit of the flag (ex. GenStatusFlag::isLastCopy). */
+        bool GetStatusFlag(int bit) {return BitChecker(bit, statusFlags);}
 };
 
 /**Map of the PDG ID values to the particle names.
@@ -72,21 +75,89 @@ static const std::map <std::string, int> GenParticleStatusFlags {
         {"isLastCopyBeforeFSR", 14}
 };
 
+/**Bits of the flags in the value of the statusFlags branch
+ * (the same as \ref GenParticleStatusFlags without the string lookup). */
+namespace GenStatusFlag {
+    enum Bit {
+        isPrompt = 0,
+        isDecayedLeptonHadron = 1,
+        isTauDecayProduct = 2,
+        isPromptTauDecayProduct = 3,
+        isDirectTauDecayProduct = 4,
+        isDirectPromptTauDecayProduct = 5,
+        isDirectHadronDecayProduct = 6,
+        isHardProcess = 7,
+        fromHardProcess = 8,
+        isHardProcessTauDecayProduct = 9,
+        isDirectHardProcessTauDecayProduct = 10,
+        fromHardProcessBeforeFSR = 11,
+        isFirstCopy = 12,
+        isLastCopy = 13,
+        isLastCopyBeforeFSR = 14
+    };
+}
+
+/**\class GenChainPattern
+ * Decay chain compiled once for \ref GenParticleTree::FindChain.
+ * The chain is written from the ancestor to the last particle with
+ * the steps separated by `>` (ex. `6>24>1:5`, a top decaying to a W
+ * decaying to a quark). A step is a PDG ID, a list of them separated
+ * by `,` (ex. `1,2,3`) or an inclusive range (ex. `1:5`), which can
+ * be mixed (ex. `1:5,21`). The steps match the absolute value of the PDG ID.
+ * 
+ * The string is parsed only in the constructor, into flat arrays
+ * of ID ranges, so matching a particle to a step is a few integer
+ * comparisons. The steps are stored from the last particle
+ * (step 0) to the ancestor, the order in which the tree is walked. */
+class GenChainPattern {
+    private:
+        std::vector<int> lows, highs; /**< Ranges of absolute PDG IDs of all the steps */
+        std::vector<int> stepStart; /**< Ranges of step i are [stepStart[i], stepStart[i+1]) */
+
+    public:
+        std::string chainstring; /**< Chain the pattern was compiled from */
+
+        GenChainPattern(std::string chainstring);
+
+        int size() const {return stepStart.size()-1;}
+        /**Whether a PDG ID matches a step.
+         * @param step Step counted from the last particle of the chain (0).
+         * @param pdgId PDG ID (its absolute value is used). */
+        bool Matches(int step, int pdgId) const {
+            int id = std::abs(pdgId);
+            for (int i = stepStart[step]; i < stepStart[step+1]; i++) {
+                if (id >= lows[i] && id <= highs[i]) return true;
+            }
+            return false;
+        }
+};
+
 /**\class GenParticleTree
  * Constructs tree by adding particles. Establish relationships
  * between particles (parent, child) and allows you to search
- * for a chain of decays. */
+ * for a chain of decays.
+ * 
+ * The tree keeps its own copy of every particle added, in storage
+ * that is reused from one event to the next (call \ref Reset at the
+ * start of every event), and an array from the index in the collection
+ * to the node so that adding a particle and finding its parent or
+ * children takes constant time. */
 class GenParticleTree
 {
     private:
         Collection GenParts;
-        std::vector<Particle*> nodes;
-        std::vector<Particle*> heads;
+        std::vector<Particle> storage; /**< Copies of the particles added. Only grows so it is reused across events. */
+        std::vector<Particle*> nodes; /**< nodes[i] is &storage[i] for the particles of the current event */
+        std::vector<int> heads; /**< Nodes whose parent is not in the tree */
+        std::vector<int> orphans; /**< Nodes whose parent is in the collection but was not added yet */
+        std::vector<int> nodeIndex; /**< Node of each index in the collection (-1 if not added) */
 
-        bool MatchParticleToString(Particle* particle, std::string string);
-        std::vector<Particle*> RunChain(Particle* node, std::vector<std::string> chain);
+        int ChainLength(Particle* node, const GenChainPattern& pattern);
+        void FillChain(Particle* node, int length, std::vector<Particle*>& chain);
 
-        std::vector<int> StoredIndexes();
+        void Reserve(int nParticles);
+        int NodeOf(int index);
+        void CopyParticle(Particle* from, Particle* to);
         Particle NoneParticle;
 
     public:
@@ -94,39 +165,131 @@ class GenParticleTree
             NoneParticle.flag = false;
         };
 
-        void AddParticle(Particle* particle);
+        void Reset(int nParticles = 0);
+        Particle* AddParticle(Particle* particle);
 
         std::vector<Particle*> GetParticles() {return nodes;}
+        Particle* GetParticle(int index);
         std::vector<Particle*> GetChildren(Particle* particle);
         Particle* GetParent(Particle* particle);
         
         std::vector<std::vector<Particle*>> FindChain(std::string chainstring);
+        std::vector<std::vector<Particle*>> FindChain(const GenChainPattern& pattern);
+        std::vector<std::vector<std::vector<Particle*>>> FindChains(const std::vector<GenChainPattern>& patterns);
 };
 
+/** Result of \ref GenParticle::CompareToVector */
+struct GenVectorComparison {
+    bool sameHemisphere; /**< DeltaPhi < pi */
+    bool deltaR; /**< DeltaR < 0.8 */
+    bool deltaM; /**< |delta m|/m_gen < 0.05 */
+};
+
+class GenParticle;
+
 /**\class GenParticleObjs
- * Object that stores and manipulates the information for gen particles.
- * Stores all gen particles in the event and member functions can be used to
- * access the gen particles by index. */
+ * Struct-of-arrays view of the gen particles of an event.
+ * The arrays are the memory of the GenPart_* columns (nothing is copied),
+ * so the view is only valid as long as they are (ex. during the call of
+ * the function that receives the columns). Particles are accessed by
+ * index or through \ref GenParticle handles, which stay valid as long as the view. */
 class GenParticleObjs {
-    private:
-        Collection GenPartCollection; /** Struct holding maps of values */
+    public:
+        int n = 0; /**< Number of particles */
+        const float *pt = nullptr, *eta = nullptr, *phi = nullptr, *m = nullptr;
+        const int *pdgId = nullptr, *status = nullptr, *statusFlags = nullptr, *genPartIdxMother = nullptr;
+
+        GenParticleObjs(const RVec<float>& in_pt, 
+                        const RVec<float>& in_eta, const RVec<float>& in_phi, 
+                        const RVec<float>& in_m, const RVec<int>& in_pdgId, 
+                        const RVec<int>& in_status, const RVec<int>& in_statusFlags, 
+                        const RVec<int>& in_genPartIdxMother);
+        GenParticleObjs(const RVec<float>& in_pt, 
+                        const RVec<float>& in_eta, const RVec<float>& in_phi, 
+                        const RVec<float>& in_m, const RVec<int>& in_pdgId, 
+                        const RVec<int>& in_genPartIdxMother);
+        GenParticleObjs(Collection genParts);   
 
-        /**Sets the status flags for the current particle.
-         * Called by \ref SetIndex. */
-        void SetStatusFlags(int particleIndex);
+        int size() const {return n;}
+        GenParticle Get(int idx) const;
+        LVector Vect(int idx) const {return LVector(pt[idx], eta[idx], phi[idx], m[idx]);}
+        /**Status flag of a particle (false if the statusFlags were not given).
+         * @param idx Index in the collection.
+         * @param bit Bit of the flag (ex. GenStatusFlag::isLastCopy). */
+        bool GetStatusFlag(int idx, int bit) const {return statusFlags != nullptr && ((statusFlags[idx] >> bit) & 1);}
+        void FillParticle(int idx, Particle& particle) const;
+};
 
+/**\class GenParticle
+ * Handle to one particle of a \ref GenParticleObjs (the view and the index).
+ * Cheap to copy and independent of the other handles. */
+class GenParticle {
     public:
-        GenParticleObjs(RVec<float> in_pt, 
-                        RVec<float> in_eta, RVec<float> in_phi, 
-                        RVec<float> in_m, RVec<int> in_pdgId, 
-                        RVec<int> in_status, RVec<int> in_statusFlags, 
-                        RVec<int> in_genPartIdxMother);
+        const GenParticleObjs* objs; /**< View the particle belongs to */
+        int index; /**< Index in the collection (-1 for no particle) */
 
-        GenParticleObjs(Collection genParts);   
+        GenParticle(const GenParticleObjs* in_objs, int in_index) : objs(in_objs), index(in_index) {};
+
+        bool Valid() const {return index >= 0 && index < objs->size();}
+        int pdgId() const {return objs->pdgId[index];}
+        int status() const {return objs->status != nullptr ? objs->status[index] : 0;}
+        int parentIndex() const {return objs->genPartIdxMother[index];}
+        GenParticle Parent() const {return GenParticle(objs, parentIndex());}
+        bool GetStatusFlag(int bit) const {return objs->GetStatusFlag(index, bit);}
+        LVector vect() const {return objs->Vect(index);}
+        float DeltaR(LVector input_vector) const;
+        GenVectorComparison CompareToVector(LVector vect) const;
+};
+
+/**Merging categories of a jet with the generator tops or Ws
+ * returned by \ref GenJetMatcher. With all the quarks of the
+ * hadronic decays matched to the jet (dR < 0.8) found:
+ * all of the quarks in the jet is merged, more than one but not all
+ * is semimerged and exactly one is notmerged (the convention of the
+ * top tagging scale factors). Otherwise (no quark in the jet, no
+ * hadronic decay, or quarks of several decays) there is no match. */
+enum GenMergeCategory {kNoMatch = 0, kNotMerged = 1, kSemiMerged = 2, kMerged = 3};
 
-        Particle particle;
+/** Categories of a list of jets, usable as RDataFrame columns
+ * (ex. `Define("genmatch", "MatchJetsToGen(...)")` then `genmatch.top`). */
+struct GenJetMatches {
+    RVec<int> top; /**< GenMergeCategory of every jet with the tops */
+    RVec<int> W; /**< GenMergeCategory of every jet with the Ws */
+};
+
+/**\class GenJetMatcher
+ * Matches jets to the hadronic decays of the generator tops and Ws.
+ * The tree of the event is built once by \ref Build and every jet
+ * is then classified with a few deltaR computations, instead of
+ * walking the whole tree again for every jet. The matcher keeps its
+ * memory from one event to the next so it should be reused
+ * (one per thread). */
+class GenJetMatcher {
+    private:
+        GenParticleTree tree;
+        Particle staged; /**< Particle being added to the tree */
+        std::vector<Particle*> tops, Ws; /**< Decaying tops and hadronic Ws of the event */
+        std::vector<std::vector<Particle*>> topQuarks, WQuarks; /**< Quarks of every top and W */
+        int nTops, nWs;
+
+        Particle* LastCopy(Particle* particle);
+        void AddQuarks(Particle* particle, std::vector<Particle*>& quarks);
+        int Category(LVector jet, std::vector<Particle*>& decays, std::vector<std::vector<Particle*>>& quarks, int nDecays, int nQuarks);
+
+    public:
+        GenJetMatcher(){};
+
+        void Build(const GenParticleObjs& genParts);
+        void Build(int nGenPart, const RVec<float>& GenPart_pt, const RVec<float>& GenPart_eta,
+                   const RVec<float>& GenPart_phi, const RVec<float>& GenPart_mass,
+                   const RVec<int>& GenPart_pdgId, const RVec<int>& GenPart_genPartIdxMother);
+        int TopCategory(LVector jet);
+        int WCategory(LVector jet);
+        GenJetMatches Match(const RVec<float>& jet_eta, const RVec<float>& jet_phi, const RVec<int>& jetIdx = {});
+};
 
-        std::map< std::string, bool> CompareToVector(LVector vect);
-        Particle SetIndex(int idx);   
-        int GetStatusFlag(std::string flagName);
-};
\ No newline at end of file
+GenJetMatches MatchJetsToGen(const RVec<float>& FatJet_eta, const RVec<float>& FatJet_phi,
+                             int nGenPart, const RVec<float>& GenPart_pt, const RVec<float>& GenPart_eta,
+                             const RVec<float>& GenPart_phi, const RVec<float>& GenPart_mass,
+                             const RVec<int>& GenPart_pdgId, const RVec<int>& GenPart_genPartIdxMother,
+                             const RVec<int>& jetIdx = {});
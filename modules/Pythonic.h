@@ -66,7 +66,7 @@ bool FindInString(std::string sub, std::string main) {
 }
 
 template<typename T>
-void Extend(std::vector<T> base, std::vector<T> extension) {
+void Extend(std::vector<T>& base, std::vector<T> extension) {
     for (int i = 0; i < extension.size(); i++) {
         base.push_back(extension.at(i));
     }
@@ -24,8 +24,33 @@ TopTaggingSF::TopTaggingSF(int year, string wp, string pruning,
 
     filename = TIMBERPATH+"/data/OfficialSFs/20"+to_string(year)+"TopTaggingScaleFactors"+NMC_string+".root";
     histprefix = pruning+"_"+workpoint+btag_string+"/sf_";
-    SF_file = TFile::Open(TString(filename));
-    
+
+    // Read the nine histograms once. eval() only uses the copies so it does
+    // not touch the file and can run in several threads at once (EnableImplicitMT)
+    TFile* SF_file = TFile::Open(TString(filename));
+    if (!SF_file || SF_file->IsZombie()) {
+        throw "Scale factor file could not be opened";
+    }
+    const string categories[3] = {"mergedTop", "semimerged", "notmerged"};
+    const string variations[3] = {"nominal", "up", "down"};
+    for (int icat = 0; icat < 3; icat++) {
+        for (int ivar = 0; ivar < 3; ivar++) {
+            TH1F* hist = (TH1F*)SF_file->Get(TString(histprefix+categories[icat]+"_"+variations[ivar]));
+            if (!hist) {
+                throw "Scale factor histogram not found";
+            }
+            SFHist& sf = SF_hists[icat][ivar];
+            int nbins = hist->GetNbinsX();
+            sf.edges.resize(nbins+1);
+            sf.values.resize(nbins+2);
+            for (int ibin = 0; ibin <= nbins+1; ibin++) {
+                if (ibin > 0) sf.edges[ibin-1] = hist->GetXaxis()->GetBinLowEdge(ibin);
+                sf.values[ibin] = hist->GetBinContent(ibin);
+            }
+        }
+    }
+    SF_file->Close();
+    delete SF_file;
 }
 
 vector<float> TopTaggingSF::eval (LVector top_vect, int nGenPart,
@@ -36,111 +61,29 @@ vector<float> TopTaggingSF::eval (LVector top_vect, int nGenPart,
     
     vector<float> sfs {1,1,1};
 
-    GenParticleObjs GenParticles (GenPart_pt, GenPart_eta,
-                                  GenPart_phi, GenPart_mass,
-                                  GenPart_pdgId, GenPart_status,
-                                  GenPart_statusFlags, GenPart_genPartIdxMother);
-
-    GenParticleTree GPT;
-
-    vector<Particle*> tops, Ws, quarks, prongs; // prongs are final particles we'll check
-    // Build the tree and save tops, Ws, quarks
-    for (int i = 0; i < nGenPart; i++) {
-        GenParticles.SetIndex(i);
-        Particle* this_particle = &GenParticles.particle;
-        GPT.AddParticle(this_particle);
-        
-        int this_pdgId = *(this_particle->pdgId);
-
-        if (abs(this_pdgId) == 6 && this_particle->DeltaR(top_vect) < 0.8) {
-            tops.push_back(this_particle);
-        } else if (abs(this_pdgId) == 24) {
-            Ws.push_back(this_particle);
-        } else if (abs(this_pdgId) >= 1 && abs(this_pdgId) <= 5) {
-            quarks.push_back(this_particle);
-        }
-    }
-
-    // Loop over Ws
-    Particle *W, *this_W, *wChild, *wParent;
-    vector<Particle*> this_W_children;
-    for (int iW = 0; iW < Ws.size(); iW++) {
-        W = Ws[iW];
-        wParent = GPT.GetParent(W);
-        if (wParent->flag != false) {
-            // Make sure parent is top that's in the jet
-            if (abs(*(wParent->pdgId)) == 6 && wParent->DeltaR(top_vect) < 0.8) {
-                this_W = W;
-                this_W_children = GPT.GetChildren(this_W);
-                // Make sure the child is not just another W
-                if (this_W_children.size() == 1 && this_W_children[0]->pdgId == W->pdgId) {
-                    this_W = this_W_children[0];
-                    this_W_children = GPT.GetChildren(this_W);
-                }
-                // Add children as prongs
-                for (int ichild = 0; ichild < this_W_children.size(); ichild++) {
-                    wChild = this_W_children[ichild];
-                    int child_pdgId = *(wChild->pdgId);
-                    if (abs(child_pdgId) >= 1 && abs(child_pdgId) <= 5) {
-                        prongs.push_back(wChild);
-                    }
-                } 
-            }
-        }
-    }
-    // Get bottom quarks
-    Particle *q, *bottom_parent;
-    for (int iq = 0; iq < quarks.size(); iq++) {
-        q = quarks[iq];
-        if (abs(*(q->pdgId)) == 5) { // if bottom
-            bottom_parent = GPT.GetParent(q);
-            if (bottom_parent->flag != false) { // if has parent
-                if (abs(*(bottom_parent->pdgId)) == 6 && bottom_parent->DeltaR(top_vect) < 0.8) { // if parent is a matched top
-                    prongs.push_back(q);
-                }
-            }
-        }
-    }
-    // Check how many of the prongs are merged
-    int merged_particles = 0;
-    if (prongs.size() != 3) return sfs;
-
-    for (int iprong = 0; iprong < prongs.size(); iprong++) {
-        if (prongs[iprong]->DeltaR(top_vect) < 0.8) {
-            merged_particles++;
-        }
-    }
+    // One matcher per thread, with its memory reused from one event to the next
+    static thread_local GenJetMatcher matcher;
+    matcher.Build(nGenPart, GenPart_pt, GenPart_eta, GenPart_phi, GenPart_mass,
+                  GenPart_pdgId, GenPart_genPartIdxMother);
 
-    if (merged_particles == 3) {
-        SF_hist_nom = (TH1F*)SF_file->Get(TString(histprefix+"mergedTop_nominal"));
-        SF_hist_up = (TH1F*)SF_file->Get(TString(histprefix+"mergedTop_up"));
-        SF_hist_down = (TH1F*)SF_file->Get(TString(histprefix+"mergedTop_down"));
-    } else if (merged_particles == 2) {
-        SF_hist_nom = (TH1F*)SF_file->Get(TString(histprefix+"semimerged_nominal"));
-        SF_hist_up = (TH1F*)SF_file->Get(TString(histprefix+"semimerged_up"));
-        SF_hist_down = (TH1F*)SF_file->Get(TString(histprefix+"semimerged_down"));
-    } else if (merged_particles == 1) {
-        SF_hist_nom = (TH1F*)SF_file->Get(TString(histprefix+"notmerged_nominal"));
-        SF_hist_up = (TH1F*)SF_file->Get(TString(histprefix+"notmerged_up"));
-        SF_hist_down = (TH1F*)SF_file->Get(TString(histprefix+"notmerged_down"));
+    // Number of quarks of the top decay (b and the W quarks) merged in the jet
+    int category;
+    int merged = matcher.TopCategory(top_vect);
+    if (merged == kMerged) {
+        category = 0;
+    } else if (merged == kSemiMerged) {
+        category = 1;
+    } else if (merged == kNotMerged) {
+        category = 2;
     } else {
         return sfs;
     }
     
-    int sfbin_nom, sfbin_up, sfbin_down;
-    if (top_vect.Pt() > 5000) {
-        sfbin_nom = SF_hist_nom->GetNbinsX();
-        sfbin_up = SF_hist_up->GetNbinsX();
-        sfbin_down = SF_hist_down->GetNbinsX();
-    } else {
-        sfbin_nom = SF_hist_nom->FindFixBin(top_vect.Pt());
-        sfbin_up = SF_hist_up->FindFixBin(top_vect.Pt());
-        sfbin_down = SF_hist_down->FindFixBin(top_vect.Pt());
+    for (int ivar = 0; ivar < 3; ivar++) {
+        const SFHist& sf = SF_hists[category][ivar];
+        int sfbin = top_vect.Pt() > 5000 ? sf.GetNbinsX() : sf.FindBin(top_vect.Pt());
+        sfs[ivar] = sf.GetBinContent(sfbin);
     }
 
-    sfs[0] = SF_hist_nom->GetBinContent(sfbin_nom);
-    sfs[1] = SF_hist_up->GetBinContent(sfbin_up);
-    sfs[2] = SF_hist_down->GetBinContent(sfbin_down);
-
     return sfs;
 } 
\ No newline at end of file
@@ -6,16 +6,30 @@
 using namespace ROOT::VecOps;
 using namespace std;
 
+/** Bin edges and contents of a scale factor histogram, copied out of the
+ * file so that it can be evaluated without ROOT objects (and from several threads). */
+struct SFHist {
+    vector<double> edges; /**< nbins+1 bin edges */
+    vector<float> values; /**< nbins+2 bin contents, with the underflow and overflow */
+
+    /**Bin of a value with the same convention as TH1::FindFixBin
+     * (0 for the underflow and nbins+1 for the overflow). */
+    int FindBin(double x) const {
+        return upper_bound(edges.begin(), edges.end(), x) - edges.begin();
+    }
+    int GetNbinsX() const {return edges.size()-1;}
+    float GetBinContent(int bin) const {return values[bin];}
+};
+
 class TopTaggingSF {
 private:
     string workpoint, histprefix, filename;
-    TFile* SF_file;
-    TH1F *SF_hist_nom, *SF_hist_up, *SF_hist_down;
+    SFHist SF_hists[3][3]; /**< [mergedTop, semimerged, notmerged][nominal, up, down] */
 
 public:
     TopTaggingSF(int year, string wp, string pruning, 
                  bool btag, bool NoMassCut);
-    ~TopTaggingSF();
+    ~TopTaggingSF(){};
     vector<float> eval(ROOT::Math::PtEtaPhiMVector jet, int nGenPart,
                 RVec<float> GenPart_pt, RVec<float> GenPart_eta,
                 RVec<float> GenPart_phi, RVec<float> GenPart_mass,